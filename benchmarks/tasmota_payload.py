@@ -0,0 +1,63 @@
+"""
+Microbenchmark of the Tasmota payload decoders, single thread (messages per second per core, best of 5 runs).
+
+Usage: python benchmarks/tasmota_payload.py [messages]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from helpers.tasmotapayload import JSON_BACKEND, decode_result_payload, decode_sensor_payload
+
+SENSOR_PAYLOAD = (b'{"Time":"2024-01-01T12:00:00","ENERGY":{"TotalStartTime":"2023-01-01T00:00:00","Total":12.345,'
+                  b'"Yesterday":0.512,"Today":0.231,"Period":2,"Power":87,"ApparentPower":95,"ReactivePower":38,'
+                  b'"Factor":0.92,"Voltage":229,"Current":0.415},"ANALOG":{"Temperature":24.7},"TempUnit":"C"}')
+RESULT_PAYLOAD = b'{"POWER1":"ON","POWER2":"OFF"}'
+
+def decode_sensor_by_indexing(payload: bytes):
+    # the hand-written decoding the spec replaced
+    sensor_json = json.loads(payload.decode())
+    fields = {'device_total_energy': sensor_json['ENERGY']['Total']}
+    if 'ANALOG' in sensor_json and 'Temperature' in sensor_json['ANALOG']:
+        fields['device_temperature'] = sensor_json['ANALOG']['Temperature']
+    return fields
+
+def decode_sensor_by_indexing_all_fields(payload: bytes):
+    # the same five fields by direct indexing, for a like-for-like comparison with the spec
+    sensor_json = json.loads(payload.decode())
+    fields = {}
+    energy = sensor_json.get('ENERGY')
+    if type(energy) is dict:
+        for key, field in (('Total', 'device_total_energy'), ('Power', 'device_power'), ('Voltage', 'device_voltage'), ('Current', 'device_current')):
+            if key in energy:
+                fields[field] = float(energy[key])
+    for section in ('ANALOG', 'DS18B20'):
+        if section in sensor_json and 'Temperature' in sensor_json[section]:
+            fields['device_temperature'] = float(sensor_json[section]['Temperature'])
+            break
+    return fields
+
+def measure(name: str, decode, payload: bytes, messages: int, repeats: int = 5):
+    # best of the repeats, the others are mostly scheduling noise
+    elapsed = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in range(messages):
+            decode(payload)
+        run_time = time.perf_counter() - started
+        elapsed = run_time if elapsed is None else min(elapsed, run_time)
+    print(f'{name:<40} {messages / elapsed:>12,.0f} msg/s  {elapsed / messages * 1e6:>8.2f} us/msg')
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f'JSON backend: {JSON_BACKEND}, messages: {messages}')
+    measure('sensor, indexing (json, 2 fields)', decode_sensor_by_indexing, SENSOR_PAYLOAD, messages)
+    measure('sensor, indexing (json, 5 fields)', decode_sensor_by_indexing_all_fields, SENSOR_PAYLOAD, messages)
+    measure('sensor, compiled spec (5 fields)', lambda payload: decode_sensor_payload(payload).to_fields(), SENSOR_PAYLOAD, messages)
+    measure('result, compiled spec (2 relays)', lambda payload: decode_result_payload(payload).to_fields(), RESULT_PAYLOAD, messages)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import threading
+import time
+from pymongo.command_cursor import CommandCursor
+from pymongo.cursor import Cursor
+from helpers.dbaccess import MongoDbAccess
+from helpers.env import Env
+
+class AsyncMongoDbAccess:
+    """
+    Description
+    -----------
+    Awaitable facade over MongoDbAccess for asyncio code (the telegram bot).
+    Every MongoDbAccess method is available as a coroutine that runs on a dedicated
+    thread pool with a timeout, and cursors are read to a list before returning,
+    so the event loop never waits on Mongo. run() does the same for any other
+    blocking callable. Per-call latencies are collected, see get_stats.
+    """
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.__logger = logger
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=Env.get_async_db_workers(), thread_name_prefix='async-db')
+        self.__timeout = Env.get_async_db_timeout()
+        self.__stats_lock = threading.Lock()
+        self.__stats = {}
+
+    def __getattr__(self, name: str):
+        if name.startswith('_') or not callable(getattr(MongoDbAccess, name)):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self.run(self.__call_mongo, name, *args, call_name=name, **kwargs)
+        return call
+
+    def __call_mongo(self, name: str, *args, **kwargs):
+        with MongoDbAccess() as mongo_client:
+            result = getattr(mongo_client, name)(*args, **kwargs)
+            if isinstance(result, (Cursor, CommandCursor)):
+                result = list(result)
+        return result
+
+    def __record(self, call_name: str, elapsed: float, outcome: str):
+        with self.__stats_lock:
+            stats = self.__stats.setdefault(call_name, {"calls": 0, "errors": 0, "timeouts": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["calls"] += 1
+            if outcome != "ok":
+                stats[outcome] += 1
+            elapsed_ms = elapsed * 1000
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+        if elapsed > self.__timeout / 2:
+            self.__logger.warning(f"slow data access call {call_name}: {round(elapsed * 1000)} ms ({outcome})")
+
+    async def run(self, fn, *args, call_name: str | None = None, **kwargs):
+        if call_name is None:
+            call_name = getattr(fn, '__name__', repr(fn))
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        outcome = "errors"
+        try:
+            result = await asyncio.wait_for(loop.run_in_executor(self.__executor, functools.partial(fn, *args, **kwargs)), timeout=self.__timeout)
+            outcome = "ok"
+            return result
+        except asyncio.TimeoutError:
+            # the worker thread still finishes the call, only the handler stops waiting for it
+            outcome = "timeouts"
+            self.__logger.error(f"data access call {call_name} timed out after {self.__timeout} s")
+            raise
+        finally:
+            self.__record(call_name, time.perf_counter() - started, outcome)
+
+    def get_stats(self):
+        with self.__stats_lock:
+            return {
+                call_name: {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "timeouts": stats["timeouts"],
+                    "avg_ms": round(stats["total_ms"] / stats["calls"], 3),
+                    "max_ms": round(stats["max_ms"], 3)
+                }
+                for call_name, stats in self.__stats.items()
+            }
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=True)
+        self.__logger.info(f"async data access stopped, stats: {self.get_stats()}")
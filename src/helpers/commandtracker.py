@@ -0,0 +1,220 @@
+import bisect
+import logging
+import threading
+import time
+from helpers.env import Env
+
+class PendingCommand:
+    __slots__ = ('device_name', 'command', 'expected_state', 'on_ack', 'attempts', 'first_sent_at', 'sent_at', 'deadline')
+
+    def __init__(self, device_name: str, command: str, expected_state: bool | None, on_ack) -> None:
+        self.device_name = device_name
+        self.command = command
+        self.expected_state = expected_state
+        self.on_ack = on_ack
+        self.attempts = 0
+        self.first_sent_at = None
+        self.sent_at = None
+        self.deadline = None
+
+class CommandAckTracker:
+    """
+    Description
+    -----------
+    Pending-command table for device power commands. A command is acknowledged by the
+    next stat/<device>/RESULT of the device (reporting the expected state, when known).
+    Unacknowledged commands are re-published with exponential backoff, retries use the
+    explicit target state so a late ack of the first attempt can't be undone by a toggle.
+
+    on_ack(is_acked) is called once per command: True on acknowledgement, False when the
+    retries are exhausted or the command is superseded by a newer one for the device.
+
+    publish_commands receives every batch of (device_name, command) to publish, so the
+    commands of one send_many, or the retries due at once, go out together.
+    get_state_command(state) gives the command that sets the device to the state.
+    """
+
+    # command-to-ack latency histogram bucket bounds, seconds
+    LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+    STATS_LOG_INTERVAL = 600
+
+    def __init__(self, publish_commands, get_state_command, logger: logging.Logger) -> None:
+        self.__publish_commands = publish_commands
+        self.__get_state_command = get_state_command
+        self.__logger = logger
+        self.__timeout = Env.get_command_ack_timeout()
+        self.__retries = Env.get_command_retries()
+
+        self.__pending = {}
+        self.__condition = threading.Condition()
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+        self.__stats = {}
+        self.__last_stats_log = time.monotonic()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        with self.__condition:
+            self.__condition.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        with self.__condition:
+            pending = list(self.__pending.values())
+            self.__pending.clear()
+        for command in pending:
+            self.__logger.error(f"command {command.command} to {command.device_name} was not acknowledged before shutdown")
+            self.__complete(command, False)
+        self.__logger.info(f"command tracker stopped, stats: {self.get_stats()}")
+
+    def __get_device_stats(self, device_name: str):
+        if device_name not in self.__stats:
+            self.__stats[device_name] = {
+                "sent": 0,
+                "acked": 0,
+                "retried": 0,
+                "timed_out": 0,
+                "superseded": 0,
+                "latency_sum": 0.0,
+                "histogram": [0] * (len(CommandAckTracker.LATENCY_BUCKETS) + 1)
+            }
+        return self.__stats[device_name]
+
+    def __complete(self, command: PendingCommand, is_acked: bool):
+        if command.on_ack is None:
+            return
+        try:
+            command.on_ack(is_acked)
+        except Exception as e:
+            self.__logger.exception(f"command ack callback of {command.device_name} failed: {e}")
+
+    def __mark_sent(self, command: PendingCommand):
+        command.attempts += 1
+        command.sent_at = time.monotonic()
+        if command.first_sent_at is None:
+            command.first_sent_at = command.sent_at
+        command.deadline = command.sent_at + self.__timeout * 2 ** (command.attempts - 1)
+
+    def send(self, device_name: str, command: str, expected_state: bool | None = None, on_ack = None):
+        self.send_many([(device_name, command, expected_state, on_ack)])
+
+    def send_many(self, commands):
+        """
+        Description
+        -----------
+        Tracks and publishes (device_name, command, expected_state, on_ack) commands as one batch.
+        """
+        pending_commands = [PendingCommand(device_name, command, expected_state, on_ack) for device_name, command, expected_state, on_ack in commands]
+        superseded_commands = []
+        with self.__condition:
+            for pending_command in pending_commands:
+                superseded = self.__pending.pop(pending_command.device_name, None)
+                stats = self.__get_device_stats(pending_command.device_name)
+                stats["sent"] += 1
+                if superseded is not None:
+                    stats["superseded"] += 1
+                    superseded_commands.append((superseded, pending_command.command))
+                self.__mark_sent(pending_command)
+                self.__pending[pending_command.device_name] = pending_command
+            self.__publish_commands([(pending_command.device_name, pending_command.command) for pending_command in pending_commands])
+            self.__condition.notify()
+
+        for superseded, command in superseded_commands:
+            self.__logger.info(f"command {superseded.command} to {superseded.device_name} superseded by {command}")
+            self.__complete(superseded, False)
+
+    def has_pending(self, device_name: str) -> bool:
+        with self.__condition:
+            return device_name in self.__pending
+
+    def handle_result(self, device_name: str, power_on: bool | None):
+        with self.__condition:
+            command = self.__pending.get(device_name)
+            if command is None:
+                return
+            if command.expected_state is not None and power_on is not None and command.expected_state != power_on:
+                return
+            del self.__pending[device_name]
+
+            # latency of the attempt that was answered, the previous ones are counted as retries
+            latency = time.monotonic() - command.sent_at
+            stats = self.__get_device_stats(device_name)
+            stats["acked"] += 1
+            stats["latency_sum"] += latency
+            stats["histogram"][bisect.bisect_left(CommandAckTracker.LATENCY_BUCKETS, latency)] += 1
+
+        self.__logger.info(f"command {command.command} to {device_name} acknowledged in {round(latency * 1000, 2)} ms, attempts: {command.attempts}")
+        self.__complete(command, True)
+
+    def __process_timeouts(self, now: float):
+        timed_out = []
+        retries = []
+        for device_name, command in list(self.__pending.items()):
+            if command.deadline > now:
+                continue
+            stats = self.__get_device_stats(device_name)
+            if command.attempts > self.__retries:
+                del self.__pending[device_name]
+                stats["timed_out"] += 1
+                timed_out.append(command)
+                continue
+            stats["retried"] += 1
+            if command.expected_state is None:
+                retry_command = command.command
+            else:
+                retry_command = self.__get_state_command(command.expected_state)
+            self.__logger.info(f"command {command.command} to {device_name} not acknowledged, retrying with {retry_command} (attempt {command.attempts + 1})")
+            self.__mark_sent(command)
+            retries.append((device_name, retry_command))
+        if len(retries) > 0:
+            self.__publish_commands(retries)
+        return timed_out
+
+    def __run(self):
+        while not self.__stop_event.is_set():
+            with self.__condition:
+                timed_out = self.__process_timeouts(time.monotonic())
+                wait_time = None
+                if len(self.__pending) > 0:
+                    wait_time = max(0, min(command.deadline for command in self.__pending.values()) - time.monotonic())
+                if len(timed_out) == 0:
+                    self.__condition.wait(wait_time)
+
+            for command in timed_out:
+                self.__logger.error(f"command {command.command} to {command.device_name} was not acknowledged after {command.attempts} attempts")
+                self.__complete(command, False)
+
+            now = time.monotonic()
+            if now - self.__last_stats_log >= CommandAckTracker.STATS_LOG_INTERVAL:
+                self.__last_stats_log = now
+                self.__logger.info(f"command tracker stats: {self.get_stats()}")
+
+    def get_stats(self):
+        with self.__condition:
+            stats = {}
+            for device_name, device_stats in self.__stats.items():
+                bounds = [f"<={bound}s" for bound in CommandAckTracker.LATENCY_BUCKETS] + [f">{CommandAckTracker.LATENCY_BUCKETS[-1]}s"]
+                acked = device_stats["acked"]
+                stats[device_name] = {
+                    "sent": device_stats["sent"],
+                    "acked": acked,
+                    "retried": device_stats["retried"],
+                    "timed_out": device_stats["timed_out"],
+                    "superseded": device_stats["superseded"],
+                    "avg_latency_ms": None if acked == 0 else round(device_stats["latency_sum"] / acked * 1000, 2),
+                    "histogram": dict(zip(bounds, device_stats["histogram"]))
+                }
+            return stats
@@ -0,0 +1,145 @@
+import json
+import logging
+import signal
+import threading
+from dataclasses import dataclass
+from helpers.env import Env
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Description
+    -----------
+    Immutable snapshot of the settings that are read at runtime and can be changed
+    without a restart. Connection settings (MQTT, Mongo, Telegram) stay in Env and
+    are read once on start.
+    """
+    publish_to_tg: bool
+    publish_to_tasmota: bool
+    longitude: float
+    latitude: float
+    sunrise_offset: int
+    sunset_offset: int
+    ping_interval: int
+    ping_min_interval: int
+    ping_max_interval: int
+    ping_timeout: float
+    ping_retries: int
+    tasmota_group_topic: str | None
+    status_poll_deadline: float
+
+    def __post_init__(self):
+        if not -180 <= self.longitude <= 180 or not -90 <= self.latitude <= 90:
+            raise ValueError(f'invalid coordinates: {self.longitude}, {self.latitude}')
+        if abs(self.sunrise_offset) >= 720 or abs(self.sunset_offset) >= 720:
+            raise ValueError(f'sunrise and sunset offsets must be within 12 hours, got {self.sunrise_offset}, {self.sunset_offset}')
+        if not 0 < self.ping_min_interval <= self.ping_interval <= self.ping_max_interval:
+            raise ValueError(f'ping intervals must satisfy 0 < min <= interval <= max, got {self.ping_min_interval}, {self.ping_interval}, {self.ping_max_interval}')
+        if self.ping_timeout <= 0 or self.ping_retries < 0:
+            raise ValueError(f'invalid ping timeout or retries: {self.ping_timeout}, {self.ping_retries}')
+        if self.status_poll_deadline <= 0:
+            raise ValueError(f'invalid status poll deadline: {self.status_poll_deadline}')
+
+    def load():
+        longitude, latitude = Env.get_device_lon_lat()
+        sunrise_offset, sunset_offset = Env.get_sunrise_sunset_offsets()
+        return Config(
+            publish_to_tg=Env.get_publish_to_tg(),
+            publish_to_tasmota=Env.get_publish_to_tasmota(),
+            longitude=float(longitude),
+            latitude=float(latitude),
+            sunrise_offset=sunrise_offset,
+            sunset_offset=sunset_offset,
+            ping_interval=Env.get_mobile_device_ping_interval(),
+            ping_min_interval=Env.get_mobile_device_ping_min_interval(),
+            ping_max_interval=Env.get_mobile_device_ping_max_interval(),
+            ping_timeout=Env.get_ping_timeout(),
+            ping_retries=Env.get_ping_retries(),
+            tasmota_group_topic=Env.get_tasmota_group_topic(),
+            status_poll_deadline=Env.get_status_poll_deadline()
+        )
+
+class ConfigStore:
+    """
+    Description
+    -----------
+    Holds the current Config. The snapshot is built from the environment, overridden by
+    the optional JSON file named by CONFIG_FILE ({"PUBLISH_TO_TG": 1, ...}), and is
+    replaced as a whole on reload, so readers never see a half-applied configuration.
+    A reload that fails to read or validate keeps the previous snapshot.
+    Listeners registered with add_reload_listener get the new Config after a reload
+    that changed it, reloaders of state kept outside the configuration (add_reloader)
+    run on every reload signal.
+    """
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.__logger = logger
+        self.__reload_lock = threading.Lock()
+        self.__reload_listeners = []
+        self.__reloaders = []
+        self.__overrides = self.__read_overrides()
+        Env.set_overrides(self.__overrides)
+        self.__config = Config.load()
+
+    def __read_overrides(self):
+        config_file = Env.get_config_file()
+        if config_file is None:
+            return {}
+
+        with open(config_file) as overrides_file:
+            overrides = json.load(overrides_file)
+        if not isinstance(overrides, dict):
+            raise ValueError(f'{config_file} must contain a JSON object')
+        return overrides
+
+    def get_config(self) -> Config:
+        return self.__config
+
+    def reload(self) -> bool:
+        with self.__reload_lock:
+            try:
+                overrides = self.__read_overrides()
+                Env.set_overrides(overrides)
+                config = Config.load()
+            except (OSError, ValueError, TypeError) as e:
+                Env.set_overrides(self.__overrides)
+                self.__logger.error(f'configuration reload failed, keeping the current one: {e}')
+                return False
+
+            previous = self.__config
+            self.__overrides = overrides
+            self.__config = config
+        changes = {field: getattr(config, field) for field in config.__dataclass_fields__ if getattr(config, field) != getattr(previous, field)}
+        self.__logger.info(f'configuration reloaded, changes: {changes}')
+        return True
+
+    def add_reload_listener(self, listener):
+        self.__reload_listeners.append(listener)
+
+    def add_reloader(self, reloader):
+        self.__reloaders.append(reloader)
+
+    def __run_safely(self, name: str, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            self.__logger.exception(f'{name} failed: {e}')
+
+    def __on_reload_signal(self):
+        previous = self.__config
+        try:
+            is_reloaded = self.reload()
+        except Exception as e:
+            self.__logger.exception(f'configuration reload failed: {e}')
+            is_reloaded = False
+
+        config = self.__config
+        if is_reloaded and config != previous:
+            for listener in self.__reload_listeners:
+                self.__run_safely('configuration reload listener', listener, config)
+        for reloader in self.__reloaders:
+            self.__run_safely('reload', reloader)
+
+    def install_reload_signal(self):
+        # the handler runs on the main thread between bytecodes, reload on a thread so it can take locks
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=self.__on_reload_signal, daemon=True).start())
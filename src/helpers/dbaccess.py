@@ -1,5 +1,8 @@
 from enum import Enum
+import logging
+import threading
 import pymongo
+import pymongo.errors
 from helpers.env import Env
 import datetime
 
@@ -7,7 +10,99 @@ class DeviceType(Enum):
     DESK_LIGHT = 'desk_light'
     FLOOR_HEATING = 'floor_heating'
 
-class MongoDbAccess(pymongo.MongoClient):
+class SensorHistoryTier:
+    """
+    Description
+    -----------
+    One resolution of the sensor history. The raw tier is a time-series collection
+    of every reading, the others hold min/max/avg buckets rolled up from the tier before.
+    """
+    def __init__(self, name: str, unit: str | None, resolution: datetime.timedelta, retention: datetime.timedelta, collection) -> None:
+        self.name = name
+        self.unit = unit
+        self.resolution = resolution
+        self.retention = retention
+        self.collection = collection
+
+    def truncate(self, moment: datetime.datetime) -> datetime.datetime:
+        moment = moment.replace(second=0, microsecond=0)
+        if self.unit == 'hour' or self.unit == 'day':
+            moment = moment.replace(minute=0)
+        if self.unit == 'day':
+            moment = moment.replace(hour=0)
+        return moment
+
+class MongoCollections:
+    """
+    Description
+    -----------
+    Collection handles of the HomeKeeper database, resolved once against the shared client.
+    Any handle is None if the corresponding name is not configured.
+    """
+    def __init__(self, client: pymongo.MongoClient) -> None:
+        db_name = Env.get_mongo_db_name()
+        self.database = None if db_name is None else client[db_name]
+        self.devices = self.__get_collection(Env.get_mongo_devices_coll_name())
+        self.mobile_devices = self.__get_collection(Env.get_mongo_mobile_devices_coll_name())
+        self.schedules = self.__get_collection(Env.get_mongo_schedules_coll_name())
+        self.netwatcher_states = self.__get_collection(Env.get_mongo_netwatcher_state_coll_name())
+        self.solar_table = self.__get_collection(Env.get_mongo_solar_table_coll_name())
+        self.device_rules = self.__get_collection(Env.get_mongo_device_rules_coll_name())
+
+        history_name = Env.get_mongo_sensor_history_coll_name()
+        raw_retention, minute_retention, hour_retention, day_retention = Env.get_sensor_history_retention_days()
+        # tasmota can't report more often than every 10 seconds
+        self.sensor_history_tiers = [
+            SensorHistoryTier('raw', None, datetime.timedelta(seconds=10), datetime.timedelta(days=raw_retention), self.__get_collection(history_name)),
+            SensorHistoryTier('minute', 'minute', datetime.timedelta(minutes=1), datetime.timedelta(days=minute_retention), self.__get_collection(f'{history_name}_1m')),
+            SensorHistoryTier('hour', 'hour', datetime.timedelta(hours=1), datetime.timedelta(days=hour_retention), self.__get_collection(f'{history_name}_1h')),
+            SensorHistoryTier('day', 'day', datetime.timedelta(days=1), datetime.timedelta(days=day_retention), self.__get_collection(f'{history_name}_1d'))
+        ]
+
+    def __get_collection(self, collection_name: str | None):
+        if self.database is None or collection_name is None:
+            return None
+        return self.database[collection_name]
+
+_mongo_client: pymongo.MongoClient | None = None
+_mongo_collections: MongoCollections | None = None
+_mongo_client_lock = threading.Lock()
+
+def get_mongo_client() -> pymongo.MongoClient:
+    """
+    Returns
+    -------
+    pymongo.MongoClient
+        Process-wide client, created on first use.
+    Description
+    -----------
+    pymongo clients are thread-safe and keep their own connection pool, so the whole
+    service shares one instead of connecting (and spawning monitor threads) per operation.
+    """
+    global _mongo_client, _mongo_collections
+    if _mongo_client is None:
+        with _mongo_client_lock:
+            if _mongo_client is None:
+                client = pymongo.MongoClient(Env.get_mongo_connection_url(),
+                                             maxPoolSize=Env.get_mongo_max_pool_size(),
+                                             minPoolSize=Env.get_mongo_min_pool_size())
+                _mongo_collections = MongoCollections(client)
+                _mongo_client = client
+    return _mongo_client
+
+def get_mongo_collections() -> MongoCollections:
+    get_mongo_client()
+    return _mongo_collections
+
+def close_mongo_client():
+    global _mongo_client, _mongo_collections
+    with _mongo_client_lock:
+        if _mongo_client is not None:
+            _mongo_client.close()
+        _mongo_client = None
+        _mongo_collections = None
+
+class MongoDbAccess:
 
     DEVICE_NAME_FIELD = 'device_name'
     DEVICE_POWER_ON_FIELD = 'power_on'
@@ -19,52 +114,141 @@ class MongoDbAccess(pymongo.MongoClient):
     DEVICE_TEMPERATURE_FIELD = 'device_temperature'
     DEVICE_TYPE_FIELD = 'device_type'
     DEVICE_TOTAL_ENERGY_FIELD = 'device_total_energy'
+    DEVICE_POWER_FIELD = 'device_power'
+    DEVICE_VOLTAGE_FIELD = 'device_voltage'
+    DEVICE_CURRENT_FIELD = 'device_current'
+    DEVICE_RELAYS_FIELD = 'device_relays'
+    DEVICE_IS_STALE_FIELD = 'device_is_stale'
+    DEVICE_LAST_SEEN_FIELD = 'device_last_seen'
     DEVICE_IS_POWER_FORCED_FIELD = 'device_is_power_forced'
+    DEVICE_GROUP_FIELD = 'device_group'
 
     MOBILE_DEVICE_NAME_FIELD = 'mobile_device_name'
     MOBILE_DEVICE_IP_ADDRESS = 'ip_address'
     MOBILE_DEVICE_IS_CONNECTED = 'is_connected'
 
+    NETWATCHER_STATE_IP_ADDRESS_FIELD = 'ip_address'
+
+    SOLAR_TABLE_DATE_FIELD = 'date'
+    SOLAR_TABLE_LATITUDE_FIELD = 'latitude'
+    SOLAR_TABLE_LONGITUDE_FIELD = 'longitude'
+
+    HISTORY_TIME_FIELD = 'ts'
+    HISTORY_DEVICE_FIELD = 'device'
+    HISTORY_COUNT_FIELD = 'count'
+    HISTORY_ENERGY_TOTAL_FIELD = 'energy_total'
+    HISTORY_ENERGY_DELTA_FIELD = 'energy_delta'
+    # device field -> history field, aggregated as min/max/avg by the rollups
+    HISTORY_MEASURE_FIELDS = {
+        DEVICE_TEMPERATURE_FIELD: 'temperature',
+        DEVICE_POWER_FIELD: 'power',
+        DEVICE_VOLTAGE_FIELD: 'voltage',
+        DEVICE_CURRENT_FIELD: 'current'
+    }
+
     def __init__(self) -> None:
-        mongo_url = Env.get_mongo_connection_url()
-        super().__init__(mongo_url)
+        collections = get_mongo_collections()
+        self.__devices_collection = collections.devices
+        self.__mobile_devices_collection = collections.mobile_devices
+        self.__schedules_collection = collections.schedules
+        self.__sensor_history_tiers = collections.sensor_history_tiers
+        self.__netwatcher_states_collection = collections.netwatcher_states
+        self.__solar_table_collection = collections.solar_table
+        self.__device_rules_collection = collections.device_rules
 
     def __enter__(self):
-        super().__enter__()
         return self
 
-    def __get_database(self):
-        db_name = Env.get_mongo_db_name()
-        if db_name is None:
-            return None
-        return self[db_name]
-    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # the pooled client outlives the session, see close_mongo_client
+        pass
+
+    def __get_index_specs(self):
+        return [
+            (self.__get_devices_collection(), [(self.DEVICE_NAME_FIELD, pymongo.ASCENDING)], {"unique": True}),
+            (self.__get_devices_collection(), [(self.DEVICE_PAIRED_DEVICES_FIELD, pymongo.ASCENDING)], {}),
+            (self.__get_mobile_devices_collection(), [(self.MOBILE_DEVICE_NAME_FIELD, pymongo.ASCENDING)], {"unique": True}),
+            (self.__get_mobile_devices_collection(), [(self.MOBILE_DEVICE_IS_CONNECTED, pymongo.ASCENDING)], {}),
+            (self.__netwatcher_states_collection, [(self.NETWATCHER_STATE_IP_ADDRESS_FIELD, pymongo.ASCENDING)], {"unique": True}),
+            (self.__solar_table_collection, [(self.SOLAR_TABLE_DATE_FIELD, pymongo.ASCENDING), (self.SOLAR_TABLE_LATITUDE_FIELD, pymongo.ASCENDING),
+                                             (self.SOLAR_TABLE_LONGITUDE_FIELD, pymongo.ASCENDING)], {"unique": True})
+        ]
+
+    def __get_obsolete_indexes(self):
+        # a date-only unique index would reject the table of other coordinates
+        return [(self.__solar_table_collection, f"{self.SOLAR_TABLE_DATE_FIELD}_1")]
+
+    def __get_hot_queries(self):
+        # the $lookup of get_devices_with_mobile_pair resolves through the mobile_device_name query
+        return {
+            "device by name": (self.__get_devices_collection(), {self.DEVICE_NAME_FIELD: ""}),
+            "devices by paired mobile devices": (self.__get_devices_collection(), {self.DEVICE_PAIRED_DEVICES_FIELD: {"$in": [""]}}),
+            "mobile device by name": (self.__get_mobile_devices_collection(), {self.MOBILE_DEVICE_NAME_FIELD: ""}),
+            "offline mobile devices": (self.__get_mobile_devices_collection(), {self.MOBILE_DEVICE_IS_CONNECTED: False})
+        }
+
+    def __is_collscan(self, plan) -> bool:
+        if isinstance(plan, dict):
+            if plan.get("stage") == "COLLSCAN":
+                return True
+            return any(self.__is_collscan(value) for value in plan.values())
+        if isinstance(plan, list):
+            return any(self.__is_collscan(value) for value in plan)
+        return False
+
+    def ensure_indexes(self, logger: logging.Logger | None = None) -> bool:
+        """
+        Returns
+        -------
+        bool
+            True, if every required index exists after the call.
+        Description
+        -----------
+        Creates the indexes backing the device lookups. Creating an index that already
+        exists with the same options is a no-op, so it is safe to call on every start.
+        Indexes replaced by other keys are dropped first.
+        """
+        logger = logging if logger is None else logger
+        all_created = True
+        for collection, index_name in self.__get_obsolete_indexes():
+            try:
+                if index_name in collection.index_information():
+                    collection.drop_index(index_name)
+                    logger.info(f"obsolete index {collection.name}.{index_name} is dropped")
+            except pymongo.errors.PyMongoError as e:
+                logger.error(f"failed to drop index {index_name} on {collection.name}: {e}")
+                all_created = False
+        for collection, keys, options in self.__get_index_specs():
+            try:
+                index_name = collection.create_index(keys, **options)
+                logger.info(f"index {collection.name}.{index_name} is present")
+            except pymongo.errors.PyMongoError as e:
+                logger.error(f"failed to create index {keys} on {collection.name}: {e}")
+                all_created = False
+        return all_created
+
+    def get_collscan_queries(self):
+        """
+        Returns
+        -------
+        list
+            Names of the hot queries whose winning plan is a collection scan.
+        """
+        collscan_queries = []
+        for query_name, (collection, query_filter) in self.__get_hot_queries().items():
+            explanation = collection.find(query_filter).explain()
+            if self.__is_collscan(explanation.get("queryPlanner", {}).get("winningPlan")):
+                collscan_queries.append(query_name)
+        return collscan_queries
+
     def __get_devices_collection(self):
-        db = self.__get_database()
-        if db is None:
-            return None
-        collection_name = Env.get_mongo_devices_coll_name()
-        if collection_name is None:
-            return None
-        return db[collection_name]
-    
+        return self.__devices_collection
+
     def __get_mobile_devices_collection(self):
-        db = self.__get_database()
-        if db is None:
-            return None
-        collection_name = Env.get_mongo_mobile_devices_coll_name()
-        if collection_name is None:
-            return None
-        return db[collection_name]
-    
+        return self.__mobile_devices_collection
+
     def __get_schedules_collection(self):
-        db = self.__get_database()
-        if db is None:
-            return None
-        collection_name = Env.get_mongo_schedules_coll_name()
-        if collection_name is None:
-            return None
-        return db[collection_name]
+        return self.__schedules_collection
 
     def get_timings(self):
         schedules_collection = self.__get_schedules_collection()
@@ -72,13 +256,18 @@ class MongoDbAccess(pymongo.MongoClient):
             return None
         return schedules_collection.find({})
     
-    def update_devices_sleep(self, is_in_sleep: bool):
+    def __get_devices_filter(self, device_names = None):
+        if device_names is None:
+            return {}
+        return {self.DEVICE_NAME_FIELD: {"$in": list(device_names)}}
+
+    def update_devices_sleep(self, is_in_sleep: bool, device_names = None):
         devices_collection = self.__get_devices_collection()
-        devices_collection.update_many({},  {"$set": {self.DEVICE_IS_DEVICE_SLEEP: is_in_sleep}})
+        devices_collection.update_many(self.__get_devices_filter(device_names),  {"$set": {self.DEVICE_IS_DEVICE_SLEEP: is_in_sleep}})
 
-    def update_devices_dark(self, is_dark: bool):
+    def update_devices_dark(self, is_dark: bool, device_names = None):
         devices_collection = self.__get_devices_collection()
-        devices_collection.update_many({},  {"$set": {self.DEVICE_IS_DARK_FIELD: is_dark}})
+        devices_collection.update_many(self.__get_devices_filter(device_names),  {"$set": {self.DEVICE_IS_DARK_FIELD: is_dark}})
         
     def get_devices_names(self):
         devices_collection = self.__get_devices_collection()
@@ -100,10 +289,21 @@ class MongoDbAccess(pymongo.MongoClient):
         devices_collection = self.__get_devices_collection()
         devices_collection.update_one({self.DEVICE_NAME_FIELD: device_name}, {"$set": device_sensor_stats})
 
+    def bulk_write_devices(self, requests):
+        devices_collection = self.__get_devices_collection()
+        return devices_collection.bulk_write(requests, ordered=False)
+
     def update_device_forced_state(self, device_name: str, is_forced: bool):
         devices_collection = self.__get_devices_collection()
         devices_collection.update_one({self.DEVICE_NAME_FIELD: device_name}, {"$set": {self.DEVICE_IS_POWER_FORCED_FIELD: is_forced}})
 
+    def update_devices_stale(self, device_names, is_stale: bool, last_seen: datetime.datetime | None = None):
+        fields = {self.DEVICE_IS_STALE_FIELD: is_stale}
+        if last_seen is not None:
+            fields[self.DEVICE_LAST_SEEN_FIELD] = last_seen
+        devices_collection = self.__get_devices_collection()
+        devices_collection.update_many(self.__get_devices_filter(device_names), {"$set": fields})
+
     def update_device_stats(self, device_name: str, last_switch: datetime.datetime, forced_power: bool):
 
         stats = {
@@ -114,10 +314,49 @@ class MongoDbAccess(pymongo.MongoClient):
         devices_collection = self.__get_devices_collection()
         devices_collection.update_one({self.DEVICE_NAME_FIELD: device_name}, {"$set": stats})
 
+    def update_devices_stats(self, stats):
+        """
+        Description
+        -----------
+        update_device_stats for a batch of (device_name, last_switch, forced_power), one bulk write.
+        """
+        requests = [pymongo.UpdateOne({self.DEVICE_NAME_FIELD: device_name}, {"$set": {
+            self.DEVICE_LAST_SWITCH_FIELD: last_switch,
+            self.DEVICE_IS_POWER_FORCED_FIELD: forced_power
+        }}) for device_name, last_switch, forced_power in stats]
+        if len(requests) > 0:
+            self.__get_devices_collection().bulk_write(requests, ordered=False)
+
     def update_mobile_device_stat(self, device_name: str, is_connected: bool):
         mobile_devices_connection = self.__get_mobile_devices_collection()
         mobile_devices_connection.update_one({self.MOBILE_DEVICE_NAME_FIELD: device_name}, {"$set": {self.MOBILE_DEVICE_IS_CONNECTED: is_connected}})
 
+    def get_netwatcher_states(self):
+        return self.__netwatcher_states_collection.find({}, {"_id": 0})
+
+    def save_netwatcher_states(self, states):
+        requests = [pymongo.ReplaceOne({self.NETWATCHER_STATE_IP_ADDRESS_FIELD: state[self.NETWATCHER_STATE_IP_ADDRESS_FIELD]}, state, upsert=True) for state in states]
+        if len(requests) > 0:
+            self.__netwatcher_states_collection.bulk_write(requests, ordered=False)
+
+    def get_solar_table(self, latitude: float, longitude: float, year: int):
+        return self.__solar_table_collection.find({
+            self.SOLAR_TABLE_DATE_FIELD: {"$gte": f'{year:04}-01-01', "$lte": f'{year:04}-12-31'},
+            self.SOLAR_TABLE_LATITUDE_FIELD: latitude,
+            self.SOLAR_TABLE_LONGITUDE_FIELD: longitude
+        }, {"_id": 0})
+
+    def save_solar_table(self, documents):
+        requests = [pymongo.ReplaceOne({self.SOLAR_TABLE_DATE_FIELD: document[self.SOLAR_TABLE_DATE_FIELD],
+                                        self.SOLAR_TABLE_LATITUDE_FIELD: document[self.SOLAR_TABLE_LATITUDE_FIELD],
+                                        self.SOLAR_TABLE_LONGITUDE_FIELD: document[self.SOLAR_TABLE_LONGITUDE_FIELD]}, document, upsert=True)
+                    for document in documents]
+        if len(requests) > 0:
+            self.__solar_table_collection.bulk_write(requests, ordered=False)
+
+    def get_device_rules(self):
+        return self.__device_rules_collection.find({})
+
     def get_paired_devices(self, mobile_devices):
         devices_collection = self.__get_devices_collection()
 
@@ -140,7 +379,7 @@ class MongoDbAccess(pymongo.MongoClient):
             },
             {
                 "$lookup": {
-                    "from": "mobile_devices",
+                    "from": self.__get_mobile_devices_collection().name,
                     "localField": "paired_devices",
                     "foreignField": "mobile_device_name",
                     "as": "mobile_device"
@@ -158,4 +397,155 @@ class MongoDbAccess(pymongo.MongoClient):
                 }
             }
         ]
-        return devices_collection.aggregate(pipeline)
\ No newline at end of file
+        return devices_collection.aggregate(pipeline)
+
+    def watch_devices(self, resume_after=None, max_await_time_ms: int | None = None):
+        devices_collection = self.__get_devices_collection()
+        return devices_collection.watch(full_document='updateLookup', resume_after=resume_after, max_await_time_ms=max_await_time_ms)
+
+    def watch_schedules(self, resume_after=None, max_await_time_ms: int | None = None):
+        schedules_collection = self.__get_schedules_collection()
+        return schedules_collection.watch(resume_after=resume_after, max_await_time_ms=max_await_time_ms)
+
+    def watch_mobile_devices(self, resume_after=None, max_await_time_ms: int | None = None):
+        mobile_devices_collection = self.__get_mobile_devices_collection()
+        return mobile_devices_collection.watch(full_document='updateLookup', resume_after=resume_after, max_await_time_ms=max_await_time_ms)
+
+    def __get_sensor_history_tier(self, tier_name: str) -> SensorHistoryTier:
+        return next(tier for tier in self.__sensor_history_tiers if tier.name == tier_name)
+
+    def ensure_sensor_history_collections(self, logger: logging.Logger | None = None):
+        logger = logging if logger is None else logger
+        raw_tier = self.__sensor_history_tiers[0]
+        database = raw_tier.collection.database
+        raw_expire_seconds = int(raw_tier.retention.total_seconds())
+        if raw_tier.collection.name not in database.list_collection_names():
+            database.create_collection(raw_tier.collection.name, expireAfterSeconds=raw_expire_seconds, timeseries={
+                "timeField": self.HISTORY_TIME_FIELD,
+                "metaField": self.HISTORY_DEVICE_FIELD,
+                "granularity": "seconds"
+            })
+            logger.info(f"time-series collection {raw_tier.collection.name} created")
+        else:
+            database.command('collMod', raw_tier.collection.name, expireAfterSeconds=raw_expire_seconds)
+
+        for tier in self.__sensor_history_tiers[1:]:
+            tier.collection.create_index([(self.HISTORY_DEVICE_FIELD, pymongo.ASCENDING), (self.HISTORY_TIME_FIELD, pymongo.ASCENDING)], unique=True)
+            expire_seconds = int(tier.retention.total_seconds())
+            try:
+                tier.collection.create_index([(self.HISTORY_TIME_FIELD, pymongo.ASCENDING)], expireAfterSeconds=expire_seconds)
+            except pymongo.errors.OperationFailure:
+                # retention changed since the index was created
+                database.command('collMod', tier.collection.name, index={"keyPattern": {self.HISTORY_TIME_FIELD: 1}, "expireAfterSeconds": expire_seconds})
+            logger.info(f"sensor history tier {tier.collection.name} ready, retention: {tier.retention}")
+
+    def append_sensor_readings(self, readings):
+        raw_tier = self.__sensor_history_tiers[0]
+        raw_tier.collection.insert_many(readings, ordered=False)
+
+    def __get_rollup_group_stage(self, tier_unit: str, from_raw: bool):
+        group = {
+            "_id": {
+                self.HISTORY_DEVICE_FIELD: f"${self.HISTORY_DEVICE_FIELD}",
+                self.HISTORY_TIME_FIELD: {"$dateTrunc": {"date": f"${self.HISTORY_TIME_FIELD}", "unit": tier_unit}}
+            },
+            self.HISTORY_COUNT_FIELD: {"$sum": 1 if from_raw else f"${self.HISTORY_COUNT_FIELD}"},
+            self.HISTORY_ENERGY_TOTAL_FIELD: {"$max": f"${self.HISTORY_ENERGY_TOTAL_FIELD}"},
+            self.HISTORY_ENERGY_DELTA_FIELD: {"$sum": f"${self.HISTORY_ENERGY_DELTA_FIELD}"}
+        }
+        for measure in self.HISTORY_MEASURE_FIELDS.values():
+            if from_raw:
+                group[f"{measure}_min"] = {"$min": f"${measure}"}
+                group[f"{measure}_max"] = {"$max": f"${measure}"}
+                group[f"{measure}_sum"] = {"$sum": f"${measure}"}
+                group[f"{measure}_count"] = {"$sum": {"$cond": [{"$isNumber": f"${measure}"}, 1, 0]}}
+            else:
+                group[f"{measure}_min"] = {"$min": f"${measure}_min"}
+                group[f"{measure}_max"] = {"$max": f"${measure}_max"}
+                group[f"{measure}_sum"] = {"$sum": f"${measure}_sum"}
+                group[f"{measure}_count"] = {"$sum": f"${measure}_count"}
+        return group
+
+    def __get_rollup_project_stage(self):
+        project = {
+            "_id": 0,
+            self.HISTORY_DEVICE_FIELD: f"$_id.{self.HISTORY_DEVICE_FIELD}",
+            self.HISTORY_TIME_FIELD: f"$_id.{self.HISTORY_TIME_FIELD}",
+            self.HISTORY_COUNT_FIELD: 1,
+            self.HISTORY_ENERGY_TOTAL_FIELD: 1,
+            self.HISTORY_ENERGY_DELTA_FIELD: 1
+        }
+        for measure in self.HISTORY_MEASURE_FIELDS.values():
+            project[f"{measure}_min"] = 1
+            project[f"{measure}_max"] = 1
+            project[f"{measure}_sum"] = 1
+            project[f"{measure}_count"] = 1
+            project[f"{measure}_avg"] = {
+                "$cond": [{"$gt": [f"${measure}_count", 0]}, {"$divide": [f"${measure}_sum", f"${measure}_count"]}, None]
+            }
+        return project
+
+    def rollup_sensor_history(self, tier_name: str, now: datetime.datetime | None = None):
+        """
+        Returns
+        -------
+        tuple
+            The rolled up [start, end) range.
+        Description
+        -----------
+        Downsamples the closed buckets of the previous tier into the given one. The range
+        starts one bucket before the latest stored bucket, so late readings are picked up
+        and a missed run catches up; re-rolling a bucket replaces it.
+        """
+        tiers = self.__sensor_history_tiers
+        tier = self.__get_sensor_history_tier(tier_name)
+        source_tier = tiers[tiers.index(tier) - 1]
+
+        if now is None:
+            now = datetime.datetime.now(datetime.timezone.utc)
+        end = tier.truncate(now)
+
+        latest_bucket = tier.collection.find_one({}, sort=[(self.HISTORY_TIME_FIELD, pymongo.DESCENDING)])
+        if latest_bucket is None:
+            start = tier.truncate(now - source_tier.retention)
+        else:
+            start = latest_bucket[self.HISTORY_TIME_FIELD].replace(tzinfo=datetime.timezone.utc) - tier.resolution
+
+        pipeline = [
+            {"$match": {self.HISTORY_TIME_FIELD: {"$gte": start, "$lt": end}}},
+            {"$group": self.__get_rollup_group_stage(tier.unit, source_tier.unit is None)},
+            {"$project": self.__get_rollup_project_stage()},
+            {"$merge": {
+                "into": tier.collection.name,
+                "on": [self.HISTORY_DEVICE_FIELD, self.HISTORY_TIME_FIELD],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }}
+        ]
+        source_tier.collection.aggregate(pipeline)
+        return start, end
+
+    def get_sensor_history(self, device_name: str, start: datetime.datetime, end: datetime.datetime, max_points: int = 500):
+        """
+        Returns
+        -------
+        tuple
+            Name of the tier that was read, and its documents ordered by time.
+        Description
+        -----------
+        Reads the finest tier that both still holds the start of the window and returns
+        at most max_points buckets for it, so long windows are served from coarse tiers.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        window = end - start
+        tier = self.__sensor_history_tiers[-1]
+        for candidate in self.__sensor_history_tiers:
+            if now - candidate.retention <= start and window / candidate.resolution <= max_points:
+                tier = candidate
+                break
+
+        cursor = tier.collection.find(
+            {self.HISTORY_DEVICE_FIELD: device_name, self.HISTORY_TIME_FIELD: {"$gte": start, "$lt": end}},
+            {"_id": 0}
+        ).sort(self.HISTORY_TIME_FIELD, pymongo.ASCENDING)
+        return tier.name, list(cursor)
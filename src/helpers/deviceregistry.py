@@ -0,0 +1,414 @@
+import datetime
+import logging
+import threading
+import time
+import pymongo.errors
+from helpers.dbaccess import MongoDbAccess
+from helpers.env import Env
+
+class DeviceRegistry:
+    """
+    Description
+    -----------
+    Write-through, in-process copy of the devices and mobile devices collections.
+    It is loaded once on start and kept current through change streams, or by
+    periodic reloads when the server does not support them (standalone mongod).
+    Reads are served from memory, writes go to Mongo first and then patch the cache.
+    """
+
+    CHANGE_STREAM_MODE = 'change_stream'
+    POLLING_MODE = 'polling'
+
+    STATS_LOG_INTERVAL = 600
+    WATCH_MAX_AWAIT_MS = 1000
+    WATCH_RETRY_DELAY = 5
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.__logger = logger
+        self.__lock = threading.RLock()
+        self.__stop_event = threading.Event()
+        self.__threads = []
+
+        self.__devices = {}
+        self.__mobile_devices = {}
+        self.__device_names_by_id = {}
+        self.__mobile_device_names_by_id = {}
+        # reverse index: mobile device name -> names of the devices paired with it
+        self.__device_names_by_mobile_device = {}
+        # device name -> fields cached ahead of Mongo, re-applied over the stored documents until persisted
+        self.__unpersisted_fields = {}
+
+        self.__mode = None
+        self.__hits = 0
+        self.__misses = 0
+        self.__last_sync = None
+        self.__last_stats_log = time.monotonic()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self.reload()
+        if self.__is_change_stream_supported():
+            self.__mode = DeviceRegistry.CHANGE_STREAM_MODE
+            self.__start_thread(self.__watch_collection, 'devices', MongoDbAccess.watch_devices, self.__devices, self.__device_names_by_id, MongoDbAccess.DEVICE_NAME_FIELD)
+            self.__start_thread(self.__watch_collection, 'mobile_devices', MongoDbAccess.watch_mobile_devices, self.__mobile_devices, self.__mobile_device_names_by_id, MongoDbAccess.MOBILE_DEVICE_NAME_FIELD)
+        else:
+            self.__mode = DeviceRegistry.POLLING_MODE
+            self.__start_thread(self.__poll)
+        self.__logger.info(f"device registry started in {self.__mode} mode, devices: {len(self.__devices)}, mobile devices: {len(self.__mobile_devices)}")
+
+    def stop(self):
+        self.__stop_event.set()
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+        self.__logger.info(f"device registry stopped, stats: {self.get_stats()}")
+
+    def __start_thread(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.__threads.append(thread)
+
+    def __is_change_stream_supported(self):
+        try:
+            with MongoDbAccess() as mongo_client:
+                with mongo_client.watch_devices(max_await_time_ms=1):
+                    pass
+            return True
+        except pymongo.errors.OperationFailure as e:
+            self.__logger.info(f"change streams are not available ({e}), falling back to polling")
+            return False
+
+    def reload(self):
+        with MongoDbAccess() as mongo_client:
+            devices = list(mongo_client.get_devices())
+            mobile_devices = list(mongo_client.get_mobile_devices())
+
+        with self.__lock:
+            self.__devices.clear()
+            self.__device_names_by_id.clear()
+            self.__device_names_by_mobile_device.clear()
+            for device in devices:
+                self.__store(self.__devices, self.__device_names_by_id, MongoDbAccess.DEVICE_NAME_FIELD, device)
+
+            self.__mobile_devices.clear()
+            self.__mobile_device_names_by_id.clear()
+            for mobile_device in mobile_devices:
+                self.__store(self.__mobile_devices, self.__mobile_device_names_by_id, MongoDbAccess.MOBILE_DEVICE_NAME_FIELD, mobile_device)
+
+            self.__mark_synced()
+
+    def __index_pairs(self, device, is_indexed: bool):
+        if device is None:
+            return
+        device_name = device[MongoDbAccess.DEVICE_NAME_FIELD]
+        for mobile_device_name in device.get(MongoDbAccess.DEVICE_PAIRED_DEVICES_FIELD, []):
+            device_names = self.__device_names_by_mobile_device.setdefault(mobile_device_name, set())
+            if is_indexed:
+                device_names.add(device_name)
+            else:
+                device_names.discard(device_name)
+                if len(device_names) == 0:
+                    del self.__device_names_by_mobile_device[mobile_device_name]
+
+    def __store(self, documents: dict, names_by_id: dict, name_field: str, document):
+        previous_name = names_by_id.get(document['_id'])
+        if previous_name is not None and previous_name != document[name_field]:
+            previous = documents.pop(previous_name, None)
+        else:
+            previous = documents.get(document[name_field])
+        documents[document[name_field]] = document
+        names_by_id[document['_id']] = document[name_field]
+        if documents is self.__devices:
+            document.update(self.__unpersisted_fields.get(document[name_field], {}))
+            self.__index_pairs(previous, False)
+            self.__index_pairs(document, True)
+
+    def __remove(self, documents: dict, names_by_id: dict, document_id):
+        name = names_by_id.pop(document_id, None)
+        if name is not None:
+            previous = documents.pop(name, None)
+            if documents is self.__devices:
+                self.__index_pairs(previous, False)
+
+    def __mark_synced(self):
+        self.__last_sync = time.monotonic()
+        if self.__last_sync - self.__last_stats_log >= DeviceRegistry.STATS_LOG_INTERVAL:
+            self.__last_stats_log = self.__last_sync
+            self.__logger.info(f"device registry stats: {self.get_stats()}")
+
+    def __apply_change(self, documents: dict, names_by_id: dict, name_field: str, change):
+        operation_type = change['operationType']
+        with self.__lock:
+            if operation_type in ('insert', 'update', 'replace'):
+                document = change.get('fullDocument')
+                if document is None:
+                    # the document was deleted before the update could be looked up
+                    self.__remove(documents, names_by_id, change['documentKey']['_id'])
+                else:
+                    self.__store(documents, names_by_id, name_field, document)
+            elif operation_type == 'delete':
+                self.__remove(documents, names_by_id, change['documentKey']['_id'])
+            self.__mark_synced()
+        return operation_type
+
+    def __watch_collection(self, collection_name: str, open_stream, documents: dict, names_by_id: dict, name_field: str):
+        resume_token = None
+        while not self.__stop_event.is_set():
+            try:
+                with MongoDbAccess() as mongo_client:
+                    with open_stream(mongo_client, resume_after=resume_token, max_await_time_ms=DeviceRegistry.WATCH_MAX_AWAIT_MS) as stream:
+                        while stream.alive and not self.__stop_event.is_set():
+                            change = stream.try_next()
+                            resume_token = stream.resume_token
+                            if change is None:
+                                with self.__lock:
+                                    self.__mark_synced()
+                                continue
+                            operation_type = self.__apply_change(documents, names_by_id, name_field, change)
+                            if operation_type in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                                self.__logger.info(f"{collection_name} change stream invalidated ({operation_type}), reloading")
+                                resume_token = None
+                                self.reload()
+                                break
+            except pymongo.errors.PyMongoError as e:
+                self.__logger.error(f"{collection_name} change stream failed: {e}, reloading")
+                resume_token = None
+                self.__stop_event.wait(DeviceRegistry.WATCH_RETRY_DELAY)
+                try:
+                    self.reload()
+                except pymongo.errors.PyMongoError as reload_error:
+                    self.__logger.error(f"device registry reload failed: {reload_error}")
+
+    def __poll(self):
+        interval = Env.get_registry_poll_interval()
+        while not self.__stop_event.wait(interval):
+            try:
+                self.reload()
+            except pymongo.errors.PyMongoError as e:
+                self.__logger.error(f"device registry reload failed: {e}")
+
+    def get_stats(self):
+        with self.__lock:
+            staleness = None if self.__last_sync is None else round(time.monotonic() - self.__last_sync, 3)
+            return {
+                "mode": self.__mode,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "devices": len(self.__devices),
+                "mobile_devices": len(self.__mobile_devices),
+                "staleness_seconds": staleness
+            }
+
+    def get_device(self, device_name: str):
+        with self.__lock:
+            device = self.__devices.get(device_name)
+            if device is not None:
+                self.__hits += 1
+                return dict(device)
+            self.__misses += 1
+
+        with MongoDbAccess() as mongo_client:
+            device = mongo_client.get_device_by_name(device_name=device_name)
+        if device is None:
+            return None
+
+        with self.__lock:
+            self.__store(self.__devices, self.__device_names_by_id, MongoDbAccess.DEVICE_NAME_FIELD, device)
+        return dict(device)
+
+    def has_device(self, device_name: str) -> bool:
+        return device_name in self.__devices
+
+    def get_devices(self):
+        with self.__lock:
+            self.__hits += 1
+            return [dict(device) for device in self.__devices.values()]
+
+    def get_devices_names(self):
+        with self.__lock:
+            self.__hits += 1
+            return list(self.__devices.keys())
+
+    def get_devices_names_in_scope(self, devices = None, group: str | None = None):
+        """
+        Returns
+        -------
+        list
+            Names of the listed devices and of the devices of the group (device_group is a
+            name or a list of names), or of all devices if neither is given.
+        """
+        with self.__lock:
+            self.__hits += 1
+            if devices is None and group is None:
+                return list(self.__devices.keys())
+            names = [name for name in devices if name in self.__devices] if devices is not None else []
+            if group is not None:
+                for name, device in self.__devices.items():
+                    device_group = device.get(MongoDbAccess.DEVICE_GROUP_FIELD)
+                    if (device_group == group or (isinstance(device_group, list) and group in device_group)) and name not in names:
+                        names.append(name)
+            return names
+
+    def get_mobile_devices(self):
+        with self.__lock:
+            self.__hits += 1
+            return [dict(mobile_device) for mobile_device in self.__mobile_devices.values()]
+
+    def get_offline_mobile_devices_names(self):
+        with self.__lock:
+            self.__hits += 1
+            return [name for name, mobile_device in self.__mobile_devices.items() if mobile_device.get(MongoDbAccess.MOBILE_DEVICE_IS_CONNECTED) is False]
+
+    def get_paired_devices(self, mobile_devices):
+        mobile_devices = set(mobile_devices)
+        with self.__lock:
+            self.__hits += 1
+            return [dict(device) for device in self.__devices.values()
+                    if not mobile_devices.isdisjoint(device.get(MongoDbAccess.DEVICE_PAIRED_DEVICES_FIELD, []))]
+
+    def get_devices_with_mobile_pair(self):
+        with self.__lock:
+            self.__hits += 1
+            connected = {name for name, mobile_device in self.__mobile_devices.items() if mobile_device.get(MongoDbAccess.MOBILE_DEVICE_IS_CONNECTED) is True}
+            return [dict(device) for device in self.__devices.values()
+                    if not connected.isdisjoint(device.get(MongoDbAccess.DEVICE_PAIRED_DEVICES_FIELD, []))]
+
+    def get_paired_devices_names(self, mobile_device_name: str):
+        with self.__lock:
+            self.__hits += 1
+            return list(self.__device_names_by_mobile_device.get(mobile_device_name, ()))
+
+    def get_device_pairing(self, device_name: str):
+        """
+        Returns
+        -------
+        tuple
+            Copy of the device, True if any of its mobile devices is connected,
+        and True if all of them are offline. (None, False, False) for unknown devices.
+        """
+        with self.__lock:
+            device = self.__devices.get(device_name)
+            if device is None:
+                return None, False, False
+            self.__hits += 1
+            states = [self.__mobile_devices.get(name, {}).get(MongoDbAccess.MOBILE_DEVICE_IS_CONNECTED)
+                      for name in device.get(MongoDbAccess.DEVICE_PAIRED_DEVICES_FIELD, [])]
+            return dict(device), any(state is True for state in states), all(state is False for state in states)
+
+    def __patch_device(self, device_name: str, fields: dict):
+        with self.__lock:
+            device = self.__devices.get(device_name)
+            if device is not None:
+                device.update(fields)
+
+    def __patch_all_devices(self, fields: dict):
+        with self.__lock:
+            for device in self.__devices.values():
+                device.update(fields)
+
+    def cache_device_fields(self, device_name: str, fields: dict):
+        """
+        Description
+        -----------
+        Patches the cached device only, for callers that persist the fields themselves
+        (e.g. the telemetry write-behind buffer). The fields survive reloads and change
+        stream updates of the device until release_cached_fields.
+        """
+        with self.__lock:
+            self.__unpersisted_fields.setdefault(device_name, {}).update(fields)
+            self.__patch_device(device_name, fields)
+
+    def release_cached_fields(self, device_name: str, fields: dict):
+        """
+        Description
+        -----------
+        Called once the fields are persisted, fields cached again since keep their newer value.
+        """
+        with self.__lock:
+            unpersisted = self.__unpersisted_fields.get(device_name)
+            if unpersisted is None:
+                return
+            for field, value in fields.items():
+                if field in unpersisted and unpersisted[field] == value:
+                    del unpersisted[field]
+            if len(unpersisted) == 0:
+                del self.__unpersisted_fields[device_name]
+
+    def update_device_power_on(self, device_name: str, power_on: bool):
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_device_power_on(device_name=device_name, power_on=power_on)
+        self.__patch_device(device_name, {MongoDbAccess.DEVICE_POWER_ON_FIELD: power_on})
+
+    def update_device_sensor_stats(self, device_name: str, device_sensor_stats: dict):
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_device_sensor_stats(device_name, device_sensor_stats)
+        self.__patch_device(device_name, device_sensor_stats)
+
+    def update_device_forced_state(self, device_name: str, is_forced: bool):
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_device_forced_state(device_name=device_name, is_forced=is_forced)
+        self.__patch_device(device_name, {MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD: is_forced})
+
+    def update_device_stats(self, device_name: str, last_switch: datetime.datetime, forced_power: bool):
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_device_stats(device_name=device_name, last_switch=last_switch, forced_power=forced_power)
+        self.__patch_device(device_name, {
+            MongoDbAccess.DEVICE_LAST_SWITCH_FIELD: last_switch,
+            MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD: forced_power
+        })
+
+    def update_devices_stats(self, stats):
+        if len(stats) == 0:
+            return
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_devices_stats(stats)
+        for device_name, last_switch, forced_power in stats:
+            self.__patch_device(device_name, {
+                MongoDbAccess.DEVICE_LAST_SWITCH_FIELD: last_switch,
+                MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD: forced_power
+            })
+
+    def __patch_devices(self, device_names, fields: dict):
+        if device_names is None:
+            self.__patch_all_devices(fields)
+            return
+        for device_name in device_names:
+            self.__patch_device(device_name, fields)
+
+    def update_devices_sleep(self, is_in_sleep: bool, device_names = None):
+        if device_names is not None and len(device_names) == 0:
+            return
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_devices_sleep(is_in_sleep, device_names)
+        self.__patch_devices(device_names, {MongoDbAccess.DEVICE_IS_DEVICE_SLEEP: is_in_sleep})
+
+    def update_devices_dark(self, is_dark: bool, device_names = None):
+        if device_names is not None and len(device_names) == 0:
+            return
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_devices_dark(is_dark, device_names)
+        self.__patch_devices(device_names, {MongoDbAccess.DEVICE_IS_DARK_FIELD: is_dark})
+
+    def update_devices_stale(self, device_names, is_stale: bool, last_seen: datetime.datetime | None = None):
+        if len(device_names) == 0:
+            return
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_devices_stale(device_names, is_stale, last_seen)
+        fields = {MongoDbAccess.DEVICE_IS_STALE_FIELD: is_stale}
+        if last_seen is not None:
+            fields[MongoDbAccess.DEVICE_LAST_SEEN_FIELD] = last_seen
+        self.__patch_devices(device_names, fields)
+
+    def update_mobile_device_stat(self, mobile_device_name: str, is_connected: bool):
+        with MongoDbAccess() as mongo_client:
+            mongo_client.update_mobile_device_stat(mobile_device_name, is_connected)
+        with self.__lock:
+            mobile_device = self.__mobile_devices.get(mobile_device_name)
+            if mobile_device is not None:
+                mobile_device[MongoDbAccess.MOBILE_DEVICE_IS_CONNECTED] = is_connected
@@ -0,0 +1,202 @@
+import datetime
+import logging
+import threading
+import pymongo.errors
+from helpers.dbaccess import DeviceType, MongoDbAccess
+
+# rule: {"states": [{"when": {condition: value, ...}, "state": state}, ...], "min_switch_interval": seconds}
+# The first clause whose conditions all hold gives the desired power state, a clause without
+# "when" always holds. No matching clause leaves the device as it is.
+#   conditions: dark, sleep, present, power_on (bool), temperature_below, temperature_above (strict)
+#   state: true, false, "keep" (current power state), "dark" or "present" (the value of that condition)
+DEFAULT_MIN_SWITCH_INTERVAL = 300
+DEFAULT_RULES = {
+    DeviceType.DESK_LIGHT.value: {
+        "states": [
+            {"when": {"sleep": True}, "state": False},
+            {"state": "dark"}
+        ]
+    },
+    DeviceType.FLOOR_HEATING.value: {
+        "states": [
+            {"when": {"sleep": True}, "state": False},
+            {"when": {"temperature_below": 25}, "state": True},
+            {"when": {"temperature_above": 25, "temperature_below": 38}, "state": "keep"},
+            {"state": False}
+        ]
+    }
+}
+
+# condition or state source -> device field it reads, present comes from the caller
+RULE_FIELDS = {
+    "dark": MongoDbAccess.DEVICE_IS_DARK_FIELD,
+    "sleep": MongoDbAccess.DEVICE_IS_DEVICE_SLEEP,
+    "power_on": MongoDbAccess.DEVICE_POWER_ON_FIELD,
+    "keep": MongoDbAccess.DEVICE_POWER_ON_FIELD,
+    "temperature_below": MongoDbAccess.DEVICE_TEMPERATURE_FIELD,
+    "temperature_above": MongoDbAccess.DEVICE_TEMPERATURE_FIELD
+}
+
+def compile_condition(name: str, value):
+    if name == "present":
+        if not isinstance(value, bool):
+            raise ValueError(f'{name} expects true or false, got {value}')
+        return lambda device, present: present is value
+    if name not in RULE_FIELDS:
+        raise ValueError(f'unknown rule condition: {name}')
+    field = RULE_FIELDS[name]
+    if name == "temperature_below":
+        threshold = float(value)
+        return lambda device, present: device[field] < threshold
+    if name == "temperature_above":
+        threshold = float(value)
+        return lambda device, present: device[field] > threshold
+    if not isinstance(value, bool):
+        raise ValueError(f'{name} expects true or false, got {value}')
+    return lambda device, present: device[field] is value
+
+def compile_state(state):
+    if isinstance(state, bool):
+        return lambda device, present: state
+    if state == "present":
+        return lambda device, present: present
+    if state in ("keep", "dark"):
+        field = RULE_FIELDS[state]
+        return lambda device, present: device[field]
+    raise ValueError(f'unknown rule state: {state}')
+
+def compile_clause(clause: dict):
+    conditions = [compile_condition(name, value) for name, value in clause.get("when", {}).items()]
+    get_state = compile_state(clause["state"])
+    if len(conditions) == 0:
+        return lambda device, present: (True, get_state(device, present))
+    if len(conditions) == 1:
+        condition = conditions[0]
+        return lambda device, present: (condition(device, present), get_state(device, present))
+    return lambda device, present: (all(condition(device, present) for condition in conditions), get_state(device, present))
+
+def compile_rule(rule: dict):
+    """
+    Returns
+    -------
+    tuple
+        (desired_state(device, present) -> bool | None, min switch interval in seconds)
+    Description
+    -----------
+    desired_state is None when no clause matches or a field the rule reads is missing.
+    Raises ValueError on an invalid rule.
+    """
+    clauses = rule.get("states")
+    if not isinstance(clauses, list) or len(clauses) == 0:
+        raise ValueError(f'rule has no states: {rule}')
+    compiled_clauses = [compile_clause(clause) for clause in clauses]
+    fields = {RULE_FIELDS[name] for clause in clauses for name in list(clause.get("when", {})) + [clause["state"]]
+              if isinstance(name, str) and name in RULE_FIELDS}
+    min_switch_interval = rule.get("min_switch_interval", DEFAULT_MIN_SWITCH_INTERVAL)
+
+    def desired_state(device, present):
+        if not fields.issubset(device.keys()):
+            return None
+        for clause in compiled_clauses:
+            is_matching, state = clause(device, present)
+            if is_matching:
+                return state
+        return None
+
+    return desired_state, min_switch_interval
+
+class DeviceRuleEngine:
+    """
+    Description
+    -----------
+    Decides device power toggles. The rules are documents of the device rules collection
+    keyed by device_name or device_type (DEFAULT_RULES for the built-in types when absent),
+    compiled into closures on (re)load; a device rule wins over its type's rule.
+
+    evaluate reproduces the switching checks: the desired state of the rule, the minimal
+    interval between switches and the forced power overrides.
+    """
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.__logger = logger
+        self.__reload_lock = threading.Lock()
+        self.__rules_by_type = {}
+        self.__rules_by_device = {}
+
+    def __compile_rules(self, documents):
+        rules_by_type = {device_type: compile_rule(rule) for device_type, rule in DEFAULT_RULES.items()}
+        rules_by_device = {}
+        for document in documents:
+            device_name = document.get(MongoDbAccess.DEVICE_NAME_FIELD)
+            device_type = document.get(MongoDbAccess.DEVICE_TYPE_FIELD)
+            try:
+                compiled = compile_rule(document)
+            except (KeyError, ValueError, TypeError) as e:
+                self.__logger.error(f'invalid device rule {document.get("_id")}: {e}')
+                continue
+            if device_name is not None:
+                rules_by_device[device_name] = compiled
+            elif device_type is not None:
+                rules_by_type[device_type] = compiled
+            else:
+                self.__logger.error(f'device rule {document.get("_id")} names neither a device nor a device type')
+        return rules_by_type, rules_by_device
+
+    def reload(self) -> bool:
+        with self.__reload_lock:
+            try:
+                with MongoDbAccess() as mongo_db_access:
+                    documents = list(mongo_db_access.get_device_rules())
+            except pymongo.errors.PyMongoError as e:
+                self.__logger.error(f'failed to load device rules, keeping the current ones: {e}')
+                if len(self.__rules_by_type) == 0:
+                    self.__rules_by_type, self.__rules_by_device = self.__compile_rules([])
+                return False
+            rules_by_type, rules_by_device = self.__compile_rules(documents)
+            self.__rules_by_type, self.__rules_by_device = rules_by_type, rules_by_device
+        self.__logger.info(f'device rules loaded, device types: {list(rules_by_type)}, devices: {list(rules_by_device)}')
+        return True
+
+    def evaluate(self, device, state: bool | None = None, forced: bool = False, use_rules: bool = True, present: bool | None = None):
+        """
+        Returns
+        -------
+        tuple
+            (is toggle allowed, power forced flag to store once the toggle is acknowledged)
+        Description
+        -----------
+        With use_rules the requested state comes from the device rule, otherwise state is
+        used as is (direct commands, offline devices).
+        """
+        device_name = device[MongoDbAccess.DEVICE_NAME_FIELD]
+        power_on = device[MongoDbAccess.DEVICE_POWER_ON_FIELD]
+        is_power_forced = device.get(MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD, False)
+
+        rule = self.__rules_by_device.get(device_name)
+        if rule is None:
+            rule = self.__rules_by_type.get(device.get(MongoDbAccess.DEVICE_TYPE_FIELD))
+        if use_rules:
+            if rule is None:
+                self.__logger.warning(f'no rule for {device_name} of type {device.get(MongoDbAccess.DEVICE_TYPE_FIELD)}')
+                return False, is_power_forced
+            state = rule[0](device, present)
+            if state is None:
+                self.__logger.info(f'rule of {device_name} gives no state')
+                return False, is_power_forced
+
+        switch_interval = device.get(MongoDbAccess.DEVICE_SWITCH_INTERVAL_FIELD)
+        if switch_interval is None:
+            switch_interval = DEFAULT_MIN_SWITCH_INTERVAL if rule is None else rule[1]
+        last_switch = device.get(MongoDbAccess.DEVICE_LAST_SWITCH_FIELD, datetime.datetime.min)
+        if last_switch + datetime.timedelta(seconds=switch_interval) > datetime.datetime.now():
+            self.__logger.info(f"too small interval for {device_name}, device interval is: {switch_interval}")
+            return False, is_power_forced
+
+        self.__logger.info(f'{device_name} old state: {power_on}, new state: {state}, forced: {forced}, old forced: {is_power_forced}')
+        if is_power_forced == forced:
+            return state != power_on, is_power_forced
+        if forced:
+            # a forced switch of an automatically driven device takes it over
+            return True, True
+        # a forced device is left alone by the automatic logic
+        return False, is_power_forced
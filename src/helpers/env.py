@@ -1,5 +1,10 @@
-from os import environ
+from collections import ChainMap
 import logging
+import os
+import socket
+
+# the process environment with the configuration file overrides in front, see Env.set_overrides
+environ = ChainMap({}, os.environ)
 
 class Env:
     MQTT_HOST = "MQTT_HOST"
@@ -7,19 +12,84 @@ class Env:
     MQTT_USERNAME = "MQTT_USERNAME"
     MQTT_PASSWORD = "MQTT_PASSWORD"
     MONGO_URL = "MONGO_URL"
+    MONGO_MAX_POOL_SIZE = "MONGO_MAX_POOL_SIZE"
+    MONGO_MIN_POOL_SIZE = "MONGO_MIN_POOL_SIZE"
+    MONGO_FAIL_ON_COLLSCAN = "MONGO_FAIL_ON_COLLSCAN"
     MONGO_HOMEKEEPER_DB = "MONGO_HOMEKEEPER_DB"
     MONGO_HOMEKEEPER_LOGS_DB = "MONGO_HOMEKEEPER_LOGS_DB"
     MONGO_HOMEKEEPER_CONTROL_LOGS_COLL = "MONGO_HOMEKEEPER_CONTROL_LOGS_COLL"
     MONGO_DEVICES_COLL = "MONGO_DEVICES_COLL"
     MONGO_MOBILE_DEVICES_COLL = "MONGO_MOBILE_DEVICES_COLL"
     MONGO_SCHEDULES_COLL = "MONGO_SCHEDULES_COLL"
+    MONGO_SENSOR_HISTORY_COLL = "MONGO_SENSOR_HISTORY_COLL"
+    MONGO_NETWATCHER_STATE_COLL = "MONGO_NETWATCHER_STATE_COLL"
+    MONGO_SOLAR_TABLE_COLL = "MONGO_SOLAR_TABLE_COLL"
+    MONGO_SCHEDULER_JOBS_COLL = "MONGO_SCHEDULER_JOBS_COLL"
+    MONGO_DEVICE_RULES_COLL = "MONGO_DEVICE_RULES_COLL"
+    SCHEDULER_MISFIRE_GRACE_TIME = "SCHEDULER_MISFIRE_GRACE_TIME"
+    SCHEDULER_WORKERS = "SCHEDULER_WORKERS"
+    NETWATCHER_SNAPSHOT_INTERVAL = "NETWATCHER_SNAPSHOT_INTERVAL"
+    SENSOR_HISTORY_RAW_RETENTION_DAYS = "SENSOR_HISTORY_RAW_RETENTION_DAYS"
+    SENSOR_HISTORY_MINUTE_RETENTION_DAYS = "SENSOR_HISTORY_MINUTE_RETENTION_DAYS"
+    SENSOR_HISTORY_HOUR_RETENTION_DAYS = "SENSOR_HISTORY_HOUR_RETENTION_DAYS"
+    SENSOR_HISTORY_DAY_RETENTION_DAYS = "SENSOR_HISTORY_DAY_RETENTION_DAYS"
     PUBLISH_TO_TG = "PUBLISH_TO_TG"
     PUBLISH_TO_TASMOTA = "PUBLISH_TO_TASMOTA"
     DEVICE_LON = "DEVICE_LONGITUDE"
     DEVICE_LAT = "DEVICE_LATITUDE"
+    SUNRISE_OFFSET = "SUNRISE_OFFSET"
+    SUNSET_OFFSET = "SUNSET_OFFSET"
     PING_INTERVAL = "PING_INTERVAL"
+    PING_MIN_INTERVAL = "PING_MIN_INTERVAL"
+    PING_MAX_INTERVAL = "PING_MAX_INTERVAL"
+    PING_TIMEOUT = "PING_TIMEOUT"
+    PING_RETRIES = "PING_RETRIES"
+    NEIGHBOUR_TABLE_ENABLED = "NEIGHBOUR_TABLE_ENABLED"
+    DHCP_LEASES_FILE = "DHCP_LEASES_FILE"
+    REGISTRY_POLL_INTERVAL = "REGISTRY_POLL_INTERVAL"
+    SCHEDULES_POLL_INTERVAL = "SCHEDULES_POLL_INTERVAL"
+    TELEMETRY_FLUSH_INTERVAL = "TELEMETRY_FLUSH_INTERVAL"
+    TELEMETRY_QUEUE_SIZE = "TELEMETRY_QUEUE_SIZE"
+    TELEMETRY_ENERGY_DEADBAND = "TELEMETRY_ENERGY_DEADBAND"
+    TELEMETRY_TEMPERATURE_DEADBAND = "TELEMETRY_TEMPERATURE_DEADBAND"
+    DEVICE_EVALUATION_WINDOW = "DEVICE_EVALUATION_WINDOW"
+    COMMAND_ACK_TIMEOUT = "COMMAND_ACK_TIMEOUT"
+    COMMAND_RETRIES = "COMMAND_RETRIES"
+    MQTT_CLIENT_ID = "MQTT_CLIENT_ID"
+    MQTT_MAX_INFLIGHT = "MQTT_MAX_INFLIGHT"
+    MQTT_OUTBOX_PATH = "MQTT_OUTBOX_PATH"
+    MQTT_QOS_POLICY = "MQTT_QOS_POLICY"
+    MQTT_WORKERS = "MQTT_WORKERS"
+    TASMOTA_GROUP_TOPIC = "TASMOTA_GROUP_TOPIC"
+    STATUS_POLL_INTERVAL = "STATUS_POLL_INTERVAL"
+    STATUS_POLL_DEADLINE = "STATUS_POLL_DEADLINE"
+    MQTT_QUEUE_SIZE = "MQTT_QUEUE_SIZE"
+    MQTT_QUEUE_OVERFLOW_POLICY = "MQTT_QUEUE_OVERFLOW_POLICY"
     TL_CHAT_ID = "CHAT_ID"
+    ASYNC_DB_WORKERS = "ASYNC_DB_WORKERS"
+    ASYNC_DB_TIMEOUT = "ASYNC_DB_TIMEOUT"
     TL_TOKEN = "TL_TOKEN"
+    CONFIG_FILE = "CONFIG_FILE"
+
+    def set_overrides(overrides: dict):
+        """
+        Description
+        -----------
+        Replaces the file overrides of environment variables. Values are stored the way
+        they would appear in the environment (true -> "1"), null removes the override.
+        """
+        global environ
+        values = {}
+        for name, value in overrides.items():
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = int(value)
+            values[name] = str(value)
+        environ = ChainMap(values, os.environ)
+
+    def get_config_file():
+        return os.environ.get(Env.CONFIG_FILE)
 
     def get_mqtt_connection_params():
         broker_host = environ.get(Env.MQTT_HOST)
@@ -34,10 +104,85 @@ class Env:
 
         return broker_host, broker_port, broker_username, broker_password
         
+    def get_mqtt_client_id():
+        client_id = environ.get(Env.MQTT_CLIENT_ID)
+
+        if client_id is None:
+            client_id = f"home-control-{socket.gethostname()}"
+
+        return client_id
+
+    def get_mqtt_max_inflight():
+        max_inflight = environ.get(Env.MQTT_MAX_INFLIGHT)
+
+        if max_inflight is None:
+            max_inflight = 20
+        else:
+            max_inflight = int(max_inflight)
+
+        return max_inflight
+
+    def get_mqtt_outbox_path():
+        outbox_path = environ.get(Env.MQTT_OUTBOX_PATH)
+
+        if outbox_path is None:
+            # the data volume of the container, so the outbox survives redeploys
+            outbox_path = '/data/mqtt_outbox.sqlite3'
+
+        return outbox_path
+
+    def get_mqtt_qos_policy():
+        """
+        Returns
+        -------
+        dict
+            QoS overrides per message class, from e.g. MQTT_QOS_POLICY="command=2,status_poll=0".
+        """
+        qos_policy = {}
+        value = environ.get(Env.MQTT_QOS_POLICY)
+        if value is None:
+            return qos_policy
+
+        for item in value.split(','):
+            if item.strip() == '':
+                continue
+            message_class, qos = item.split('=')
+            qos_policy[message_class.strip()] = int(qos)
+
+        return qos_policy
+
     def get_mongo_connection_url():
         mongo_url = environ.get(Env.MONGO_URL)
         return mongo_url
     
+    def get_mongo_max_pool_size():
+        max_pool_size = environ.get(Env.MONGO_MAX_POOL_SIZE)
+
+        if max_pool_size is None:
+            max_pool_size = 20
+        else:
+            max_pool_size = int(max_pool_size)
+
+        return max_pool_size
+
+    def get_mongo_min_pool_size():
+        min_pool_size = environ.get(Env.MONGO_MIN_POOL_SIZE)
+
+        if min_pool_size is None:
+            min_pool_size = 0
+        else:
+            min_pool_size = int(min_pool_size)
+
+        return min_pool_size
+
+    def get_mongo_fail_on_collscan():
+        fail_on_collscan = environ.get(Env.MONGO_FAIL_ON_COLLSCAN)
+
+        if fail_on_collscan is None:
+            return False
+
+        return int(fail_on_collscan) == 1
+
     def get_mongo_db_name():
         return environ.get(Env.MONGO_HOMEKEEPER_DB)
     
@@ -56,12 +201,114 @@ class Env:
     def get_mongo_schedules_coll_name():
         return environ.get(Env.MONGO_SCHEDULES_COLL)
     
+    def get_mongo_sensor_history_coll_name():
+        coll_name = environ.get(Env.MONGO_SENSOR_HISTORY_COLL)
+
+        if coll_name is None:
+            coll_name = 'sensor_history'
+
+        return coll_name
+
+    def get_mongo_netwatcher_state_coll_name():
+        coll_name = environ.get(Env.MONGO_NETWATCHER_STATE_COLL)
+
+        if coll_name is None:
+            coll_name = 'netwatcher_state'
+
+        return coll_name
+
+    def get_mongo_solar_table_coll_name():
+        coll_name = environ.get(Env.MONGO_SOLAR_TABLE_COLL)
+
+        if coll_name is None:
+            coll_name = 'solar_table'
+
+        return coll_name
+
+    def get_mongo_scheduler_jobs_coll_name():
+        coll_name = environ.get(Env.MONGO_SCHEDULER_JOBS_COLL)
+
+        if coll_name is None:
+            coll_name = 'scheduler_jobs'
+
+        return coll_name
+
+    def get_mongo_device_rules_coll_name():
+        coll_name = environ.get(Env.MONGO_DEVICE_RULES_COLL)
+
+        if coll_name is None:
+            coll_name = 'device_rules'
+
+        return coll_name
+
+    def get_scheduler_misfire_grace_time():
+        """
+        Returns
+        -------
+        int
+            Seconds a missed timing event (sunset, bed time...) may be late and still run.
+        """
+        grace_time = environ.get(Env.SCHEDULER_MISFIRE_GRACE_TIME)
+
+        if grace_time is None:
+            grace_time = 3600
+        else:
+            grace_time = int(grace_time)
+
+        return grace_time
+
+    def get_scheduler_workers():
+        workers = environ.get(Env.SCHEDULER_WORKERS)
+
+        if workers is None:
+            workers = 10
+        else:
+            workers = int(workers)
+
+        return workers
+
+    def get_netwatcher_snapshot_interval():
+        snapshot_interval = environ.get(Env.NETWATCHER_SNAPSHOT_INTERVAL)
+
+        if snapshot_interval is None:
+            snapshot_interval = 60
+        else:
+            snapshot_interval = int(snapshot_interval)
+
+        return snapshot_interval
+
+    def get_sensor_history_retention_days():
+        retention_days = []
+        for variable, default in [(Env.SENSOR_HISTORY_RAW_RETENTION_DAYS, 7),
+                                  (Env.SENSOR_HISTORY_MINUTE_RETENTION_DAYS, 30),
+                                  (Env.SENSOR_HISTORY_HOUR_RETENTION_DAYS, 365),
+                                  (Env.SENSOR_HISTORY_DAY_RETENTION_DAYS, 3650)]:
+            value = environ.get(variable)
+            retention_days.append(default if value is None else int(value))
+
+        return tuple(retention_days)
+
     def get_device_lon_lat():
         lon = environ.get(Env.DEVICE_LON)
         lat = environ.get(Env.DEVICE_LAT)
 
         return lon, lat
 
+    def get_sunrise_sunset_offsets():
+        """
+        Returns
+        -------
+        tuple
+            Minutes added to the sunrise and sunset events, -30 fires the event 30 minutes early.
+        """
+        sunrise_offset = environ.get(Env.SUNRISE_OFFSET)
+        sunset_offset = environ.get(Env.SUNSET_OFFSET)
+
+        sunrise_offset = 0 if sunrise_offset is None else int(sunrise_offset)
+        sunset_offset = 0 if sunset_offset is None else int(sunset_offset)
+
+        return sunrise_offset, sunset_offset
+
     def get_mobile_device_ping_interval():
         ping_interval = environ.get(Env.PING_INTERVAL)
 
@@ -72,6 +319,198 @@ class Env:
 
         return ping_interval
 
+    def get_mobile_device_ping_min_interval():
+        ping_min_interval = environ.get(Env.PING_MIN_INTERVAL)
+
+        if ping_min_interval is None:
+            ping_min_interval = 5
+        else:
+            ping_min_interval = int(ping_min_interval)
+
+        return ping_min_interval
+
+    def get_mobile_device_ping_max_interval():
+        ping_max_interval = environ.get(Env.PING_MAX_INTERVAL)
+
+        if ping_max_interval is None:
+            ping_max_interval = 300
+        else:
+            ping_max_interval = int(ping_max_interval)
+
+        return ping_max_interval
+
+    def get_ping_timeout():
+        ping_timeout = environ.get(Env.PING_TIMEOUT)
+
+        if ping_timeout is None:
+            ping_timeout = 1.0
+        else:
+            ping_timeout = float(ping_timeout)
+
+        return ping_timeout
+
+    def get_ping_retries():
+        ping_retries = environ.get(Env.PING_RETRIES)
+
+        if ping_retries is None:
+            ping_retries = 1
+        else:
+            ping_retries = int(ping_retries)
+
+        return ping_retries
+
+    def get_neighbour_table_enabled():
+        neighbour_table_enabled = environ.get(Env.NEIGHBOUR_TABLE_ENABLED)
+
+        if neighbour_table_enabled is None:
+            return True
+
+        return int(neighbour_table_enabled) == 1
+
+    def get_dhcp_leases_file():
+        return environ.get(Env.DHCP_LEASES_FILE)
+
+    def get_registry_poll_interval():
+        poll_interval = environ.get(Env.REGISTRY_POLL_INTERVAL)
+
+        if poll_interval is None:
+            poll_interval = 10
+        else:
+            poll_interval = int(poll_interval)
+
+        return poll_interval
+
+    def get_schedules_poll_interval():
+        poll_interval = environ.get(Env.SCHEDULES_POLL_INTERVAL)
+
+        if poll_interval is None:
+            poll_interval = 30
+        else:
+            poll_interval = int(poll_interval)
+
+        return poll_interval
+
+    def get_telemetry_flush_interval():
+        flush_interval = environ.get(Env.TELEMETRY_FLUSH_INTERVAL)
+
+        if flush_interval is None:
+            flush_interval = 5.0
+        else:
+            flush_interval = float(flush_interval)
+
+        return flush_interval
+
+    def get_telemetry_queue_size():
+        queue_size = environ.get(Env.TELEMETRY_QUEUE_SIZE)
+
+        if queue_size is None:
+            queue_size = 1000
+        else:
+            queue_size = int(queue_size)
+
+        return queue_size
+
+    def get_telemetry_energy_deadband():
+        deadband = environ.get(Env.TELEMETRY_ENERGY_DEADBAND)
+
+        if deadband is None:
+            deadband = 0.01
+        else:
+            deadband = float(deadband)
+
+        return deadband
+
+    def get_telemetry_temperature_deadband():
+        deadband = environ.get(Env.TELEMETRY_TEMPERATURE_DEADBAND)
+
+        if deadband is None:
+            deadband = 0.2
+        else:
+            deadband = float(deadband)
+
+        return deadband
+
+    def get_device_evaluation_window():
+        evaluation_window = environ.get(Env.DEVICE_EVALUATION_WINDOW)
+
+        if evaluation_window is None:
+            evaluation_window = 0.5
+        else:
+            evaluation_window = float(evaluation_window)
+
+        return evaluation_window
+
+    def get_command_ack_timeout():
+        ack_timeout = environ.get(Env.COMMAND_ACK_TIMEOUT)
+
+        if ack_timeout is None:
+            ack_timeout = 3.0
+        else:
+            ack_timeout = float(ack_timeout)
+
+        return ack_timeout
+
+    def get_command_retries():
+        retries = environ.get(Env.COMMAND_RETRIES)
+
+        if retries is None:
+            retries = 2
+        else:
+            retries = int(retries)
+
+        return retries
+
+    def get_mqtt_workers():
+        workers = environ.get(Env.MQTT_WORKERS)
+
+        if workers is None:
+            workers = 4
+        else:
+            workers = int(workers)
+
+        return workers
+
+    def get_mqtt_queue_size():
+        queue_size = environ.get(Env.MQTT_QUEUE_SIZE)
+
+        if queue_size is None:
+            queue_size = 1000
+        else:
+            queue_size = int(queue_size)
+
+        return queue_size
+
+    def get_mqtt_queue_overflow_policy():
+        overflow_policy = environ.get(Env.MQTT_QUEUE_OVERFLOW_POLICY)
+
+        if overflow_policy is None:
+            overflow_policy = 'drop_oldest'
+
+        return overflow_policy
+
+    def get_tasmota_group_topic():
+        return environ.get(Env.TASMOTA_GROUP_TOPIC)
+
+    def get_status_poll_interval():
+        poll_interval = environ.get(Env.STATUS_POLL_INTERVAL)
+
+        if poll_interval is None:
+            poll_interval = 1200
+        else:
+            poll_interval = int(poll_interval)
+
+        return poll_interval
+
+    def get_status_poll_deadline():
+        deadline = environ.get(Env.STATUS_POLL_DEADLINE)
+
+        if deadline is None:
+            deadline = 5.0
+        else:
+            deadline = float(deadline)
+
+        return deadline
+
     def get_publish_to_tg():
         publish_to_tg = environ.get(Env.PUBLISH_TO_TG)
 
@@ -88,6 +527,26 @@ class Env:
         
         return int(publish_to_tasmota) == 1
     
+    def get_async_db_workers():
+        workers = environ.get(Env.ASYNC_DB_WORKERS)
+
+        if workers is None:
+            workers = 4
+        else:
+            workers = int(workers)
+
+        return workers
+
+    def get_async_db_timeout():
+        timeout = environ.get(Env.ASYNC_DB_TIMEOUT)
+
+        if timeout is None:
+            timeout = 5.0
+        else:
+            timeout = float(timeout)
+
+        return timeout
+
     def get_tl_token():
         return environ.get(Env.TL_TOKEN)
     
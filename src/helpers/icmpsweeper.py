@@ -0,0 +1,160 @@
+import concurrent.futures
+import logging
+import os
+import select
+import socket
+import struct
+import subprocess
+import threading
+import time
+from helpers.interfaces import ConfigProviderInterface
+
+class ProbeResult:
+    __slots__ = ('address', 'is_alive', 'rtt', 'attempts')
+
+    def __init__(self, address: str) -> None:
+        self.address = address
+        self.is_alive = False
+        self.rtt = None
+        self.attempts = 0
+
+    def __repr__(self) -> str:
+        return f'ProbeResult({self.address}, alive: {self.is_alive}, rtt: {self.rtt}, attempts: {self.attempts})'
+
+class IcmpSweeper:
+    """
+    Description
+    -----------
+    Probes a set of hosts concurrently. Echo requests to every host go out at once
+    over one unprivileged ICMP datagram socket (net.ipv4.ping_group_range must allow
+    the process group) and the replies are collected until the probe deadline, so a
+    sweep takes about one timeout per attempt regardless of the number of hosts.
+    If the socket can't be opened, concurrent `ping` subprocesses are used instead.
+    """
+
+    ICMP_ECHO_REQUEST = 8
+    ICMP_ECHO_REPLY = 0
+    PAYLOAD = b'homekeeper-netwatcher'
+
+    def __init__(self, config: ConfigProviderInterface, logger: logging.Logger) -> None:
+        self.__logger = logger
+        self.__config = config
+        self.__lock = threading.Lock()
+        self.__socket = None
+        self.__sequence = int.from_bytes(os.urandom(2), 'big')
+        self.__resolved = {}
+
+    def close(self):
+        with self.__lock:
+            if self.__socket is not None:
+                self.__socket.close()
+                self.__socket = None
+
+    def __get_socket(self):
+        if self.__socket is None:
+            self.__socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.__socket.setblocking(False)
+        return self.__socket
+
+    def __checksum(self, data: bytes) -> int:
+        if len(data) % 2 == 1:
+            data += b'\x00'
+        checksum = sum(struct.unpack(f'!{len(data) // 2}H', data))
+        checksum = (checksum >> 16) + (checksum & 0xffff)
+        checksum += checksum >> 16
+        return ~checksum & 0xffff
+
+    def __build_echo_request(self, sequence: int) -> bytes:
+        # the kernel replaces the identifier with the socket's own one
+        header = struct.pack('!BBHHH', IcmpSweeper.ICMP_ECHO_REQUEST, 0, 0, 0, sequence)
+        checksum = self.__checksum(header + IcmpSweeper.PAYLOAD)
+        return struct.pack('!BBHHH', IcmpSweeper.ICMP_ECHO_REQUEST, 0, checksum, 0, sequence) + IcmpSweeper.PAYLOAD
+
+    def __next_sequence(self) -> int:
+        self.__sequence = (self.__sequence + 1) & 0xffff
+        return self.__sequence
+
+    def __resolve(self, address: str) -> str:
+        if address not in self.__resolved:
+            self.__resolved[address] = socket.gethostbyname(address)
+        return self.__resolved[address]
+
+    def __probe_with_socket(self, sock: socket.socket, results: dict, timeout: float):
+        sent = {}
+        for result in results.values():
+            if result.is_alive:
+                continue
+            try:
+                target = self.__resolve(result.address)
+                sequence = self.__next_sequence()
+                sock.sendto(self.__build_echo_request(sequence), (target, 0))
+            except OSError as e:
+                self.__logger.info(f'failed to send echo request to {result.address}: {e}')
+                continue
+            result.attempts += 1
+            sent[sequence] = (result, target, time.perf_counter())
+
+        deadline = time.perf_counter() + timeout
+        while len(sent) > 0:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select([sock], [], [], remaining)
+            if len(readable) == 0:
+                break
+            while True:
+                try:
+                    data, (source, _) = sock.recvfrom(1024)
+                except BlockingIOError:
+                    break
+                received = time.perf_counter()
+                if len(data) < 8 or data[0] != IcmpSweeper.ICMP_ECHO_REPLY:
+                    continue
+                sequence = struct.unpack('!H', data[6:8])[0]
+                if sequence in sent and sent[sequence][1] == source:
+                    result, _, sent_at = sent.pop(sequence)
+                    result.is_alive = True
+                    result.rtt = received - sent_at
+
+    def __ping_subprocess(self, result: ProbeResult, timeout: float, retries: int):
+        wait_seconds = str(max(1, round(timeout)))
+        for _ in range(retries + 1):
+            result.attempts += 1
+            started = time.perf_counter()
+            try:
+                subprocess.check_output(['ping', '-c', '1', '-W', wait_seconds, result.address], stderr=subprocess.STDOUT)
+            except (subprocess.CalledProcessError, OSError):
+                continue
+            result.is_alive = True
+            result.rtt = time.perf_counter() - started
+            return
+
+    def sweep(self, addresses):
+        """
+        Returns
+        -------
+        dict
+            ProbeResult for every given address.
+        """
+        results = {address: ProbeResult(address) for address in addresses}
+        if len(results) == 0:
+            return results
+        config = self.__config.get_config()
+
+        with self.__lock:
+            try:
+                sock = self.__get_socket()
+            except OSError as e:
+                sock = None
+                self.__logger.info(f'ICMP datagram socket is not available ({e}), falling back to ping subprocesses')
+
+            if sock is not None:
+                for _ in range(config.ping_retries + 1):
+                    self.__probe_with_socket(sock, results, config.ping_timeout)
+                    if all(result.is_alive for result in results.values()):
+                        break
+                return results
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, len(results))) as executor:
+            list(executor.map(lambda result: self.__ping_subprocess(result, config.ping_timeout, config.ping_retries), results.values()))
+        return results
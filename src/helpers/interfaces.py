@@ -5,63 +5,93 @@ class DeviceManagerInterface:
     def device_direct_command_handler(self, device_name: str, state: bool):
         raise NotImplementedError
     
-    def time_event_handler(self, event_type: DailyEvent, devices):
+    def time_event_handler(self, event_type: DailyEvent, devices = None, group: str | None = None):
         raise NotImplementedError
     
     def mobile_device_connect_disconnect_handler(self, mobile_device_name: str, is_connected: bool):
         raise NotImplementedError
     
-    def process_device_states(self, get_active_devices: bool = True):
+    def process_device_states(self, get_active_devices: bool = True, dry_run: bool = False):
+        raise NotImplementedError
+    
+    def device_telemetry_handler(self, device_name: str):
         raise NotImplementedError
     
 class MqttPublisherInterface:
     def publish(self, topic: str, payload: str | None = None, qos: int = 2):
         raise NotImplementedError
     
+    def publish_message(self, topic: str, payload: str | None, message_class: str):
+        raise NotImplementedError
+    
     def get_devices_stat(self):
         raise NotImplementedError
     
-    def send_device_toggle(self, device_name: str, qos: int = 2, state: bool | None = None):
+    def send_device_toggle(self, device_name: str, state: bool | None = None, on_ack = None):
+        raise NotImplementedError
+    
+    def send_device_toggles(self, toggles):
+        raise NotImplementedError
+    
+    def get_worker_stats(self):
         raise NotImplementedError
     
-class NetwatcherInterface:
-    def ping_mobile_devices(self):
+    def get_command_stats(self):
         raise NotImplementedError
     
 class TelegramMessageSenderInterface:
     def send_telegram_message(self, message: str):
         raise NotImplementedError
     
-class DependencyContainer(DeviceManagerInterface, MqttPublisherInterface, NetwatcherInterface, TelegramMessageSenderInterface):
-    def register_dependencies(self, device_manager: DeviceManagerInterface, publisher: MqttPublisherInterface, netwatcher: NetwatcherInterface, tl_sender: TelegramMessageSenderInterface):
+class ConfigProviderInterface:
+    def get_config(self):
+        raise NotImplementedError
+    
+class DependencyContainer(DeviceManagerInterface, MqttPublisherInterface, TelegramMessageSenderInterface, ConfigProviderInterface):
+    def register_dependencies(self, device_manager: DeviceManagerInterface, publisher: MqttPublisherInterface, tl_sender: TelegramMessageSenderInterface, config_provider: ConfigProviderInterface):
         self.__device_manager = device_manager
         self.__publisher = publisher
-        self.__netwatcher = netwatcher
         self.__tl_sender = tl_sender
+        self.__config_provider = config_provider
 
     def device_direct_command_handler(self, device_name: str, state: bool):
         return self.__device_manager.device_direct_command_handler(device_name=device_name, state=state)
     
-    def time_event_handler(self, event_type: DailyEvent, devices):
-        return self.__device_manager.time_event_handler(event_type=event_type, devices=devices)
+    def time_event_handler(self, event_type: DailyEvent, devices = None, group: str | None = None):
+        return self.__device_manager.time_event_handler(event_type=event_type, devices=devices, group=group)
     
     def mobile_device_connect_disconnect_handler(self, mobile_device_name: str, is_connected: bool):
         return self.__device_manager.mobile_device_connect_disconnect_handler(mobile_device_name=mobile_device_name, is_connected=is_connected)
     
-    def process_device_states(self, get_active_devices: bool = True):
-        return self.__device_manager.process_device_states(get_active_devices=get_active_devices)
+    def process_device_states(self, get_active_devices: bool = True, dry_run: bool = False):
+        return self.__device_manager.process_device_states(get_active_devices=get_active_devices, dry_run=dry_run)
+    
+    def device_telemetry_handler(self, device_name: str):
+        return self.__device_manager.device_telemetry_handler(device_name=device_name)
 
     def publish(self, topic: str, payload: str | None = None, qos: int = 2):
         return self.__publisher.publish(topic=topic, payload=payload, qos=qos)
     
+    def publish_message(self, topic: str, payload: str | None, message_class: str):
+        return self.__publisher.publish_message(topic=topic, payload=payload, message_class=message_class)
+    
     def get_devices_stat(self):
         return self.__publisher.get_devices_stat()
     
-    def send_device_toggle(self, device_name: str, qos: int = 2, state: bool | None = None):
-        return self.__publisher.send_device_toggle(device_name=device_name, qos=qos, state=state)
+    def send_device_toggle(self, device_name: str, state: bool | None = None, on_ack = None):
+        return self.__publisher.send_device_toggle(device_name=device_name, state=state, on_ack=on_ack)
     
-    def ping_mobile_devices(self):
-        return self.__netwatcher.ping_mobile_devices()
+    def send_device_toggles(self, toggles):
+        return self.__publisher.send_device_toggles(toggles=toggles)
+    
+    def get_worker_stats(self):
+        return self.__publisher.get_worker_stats()
+    
+    def get_command_stats(self):
+        return self.__publisher.get_command_stats()
     
     def send_telegram_message(self, message: str):
-        return self.__tl_sender.send_telegram_message(message=message)
\ No newline at end of file
+        return self.__tl_sender.send_telegram_message(message=message)
+    
+    def get_config(self):
+        return self.__config_provider.get_config()
@@ -0,0 +1,110 @@
+import datetime
+import threading
+import time
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+from apscheduler.executors.base import run_job
+from apscheduler.executors.pool import ThreadPoolExecutor
+
+class JobStats:
+    """
+    Description
+    -----------
+    Per-job run counters, duration and lateness (actual start minus the scheduled run
+    time, which includes the wait for a free executor worker).
+    """
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__stats = {}
+
+    def __get_job_stats(self, job_id: str):
+        if job_id not in self.__stats:
+            self.__stats[job_id] = {
+                "runs": 0,
+                "failed": 0,
+                "missed": 0,
+                "skipped": 0,
+                "duration_sum": 0.0,
+                "duration_max": 0.0,
+                "lateness_sum": 0.0,
+                "lateness_max": 0.0,
+                "last_run": None
+            }
+        return self.__stats[job_id]
+
+    def record_run(self, job_id: str, started: datetime.datetime, lateness: float, duration: float, is_failed: bool):
+        with self.__lock:
+            stats = self.__get_job_stats(job_id)
+            stats["runs"] += 1
+            if is_failed:
+                stats["failed"] += 1
+            stats["duration_sum"] += duration
+            stats["duration_max"] = max(stats["duration_max"], duration)
+            stats["lateness_sum"] += lateness
+            stats["lateness_max"] = max(stats["lateness_max"], lateness)
+            stats["last_run"] = started
+
+    def record_missed(self, job_id: str, count: int = 1):
+        with self.__lock:
+            self.__get_job_stats(job_id)["missed"] += count
+
+    def record_skipped(self, job_id: str):
+        with self.__lock:
+            self.__get_job_stats(job_id)["skipped"] += 1
+
+    def get_stats(self):
+        with self.__lock:
+            stats = {}
+            for job_id, job_stats in self.__stats.items():
+                runs = job_stats["runs"]
+                stats[job_id] = {
+                    "runs": runs,
+                    "failed": job_stats["failed"],
+                    "missed": job_stats["missed"],
+                    "skipped": job_stats["skipped"],
+                    "avg_duration_ms": None if runs == 0 else round(job_stats["duration_sum"] / runs * 1000, 2),
+                    "max_duration_ms": round(job_stats["duration_max"] * 1000, 2),
+                    "avg_lateness_ms": None if runs == 0 else round(job_stats["lateness_sum"] / runs * 1000, 2),
+                    "max_lateness_ms": round(job_stats["lateness_max"] * 1000, 2),
+                    "last_run": job_stats["last_run"]
+                }
+            return stats
+
+class InstrumentedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    Description
+    -----------
+    Thread pool executor that times every job submission into JobStats.
+    """
+
+    def __init__(self, stats: JobStats, max_workers: int = 10):
+        super().__init__(max_workers)
+        self.__stats = stats
+
+    def __run_job(self, job, jobstore_alias, run_times, logger_name):
+        started = datetime.datetime.now(datetime.timezone.utc)
+        start = time.monotonic()
+        events = run_job(job, jobstore_alias, run_times, logger_name)
+        duration = time.monotonic() - start
+
+        executed = [event for event in events if event.code in (EVENT_JOB_EXECUTED, EVENT_JOB_ERROR)]
+        missed = len(events) - len(executed)
+        if missed > 0:
+            self.__stats.record_missed(job.id, missed)
+        if len(executed) > 0:
+            # runs of one submission execute back to back, the lateness is the one of the first
+            lateness = max(0.0, (started - executed[0].scheduled_run_time).total_seconds())
+            self.__stats.record_run(job.id, started, lateness, duration, any(event.code == EVENT_JOB_ERROR for event in executed))
+        return events
+
+    def _do_submit_job(self, job, run_times):
+        # BasePoolExecutor._do_submit_job with run_job wrapped
+        def callback(future):
+            exception = future.exception()
+            if exception:
+                self._run_job_error(job.id, exception, getattr(exception, '__traceback__', None))
+            else:
+                self._run_job_success(job.id, future.result())
+
+        future = self._pool.submit(self.__run_job, job, job._jobstore_alias, run_times, self._logger.name)
+        future.add_done_callback(callback)
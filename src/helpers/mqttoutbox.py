@@ -0,0 +1,85 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+class MqttOutbox:
+    """
+    Description
+    -----------
+    Disk-backed queue of outgoing MQTT messages (sqlite). A message is stored before it
+    is handed to the client and deleted once the broker confirms it, so messages published
+    while the broker is unreachable, or still unconfirmed when the process stops, are
+    replayed after the next connect. Messages past their expiry are dropped instead.
+    """
+
+    def __init__(self, path: str, logger: logging.Logger) -> None:
+        self.__logger = logger
+        self.__lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.__connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.__connection.execute('PRAGMA journal_mode=WAL')
+        self.__connection.execute('''CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            payload BLOB,
+            qos INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )''')
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+    def put(self, topic: str, payload, qos: int, ttl: float) -> int:
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.__lock:
+            cursor = self.__connection.execute('INSERT INTO outbox (topic, payload, qos, expires_at) VALUES (?, ?, ?, ?)',
+                                               (topic, payload, qos, time.time() + ttl))
+            return cursor.lastrowid
+
+    def put_many(self, messages, qos: int, ttl: float):
+        """
+        Returns
+        -------
+        list
+            ids of the (topic, payload) messages, stored in one transaction.
+        """
+        expires_at = time.time() + ttl
+        rows = [(topic, payload.encode() if isinstance(payload, str) else payload, qos, expires_at) for topic, payload in messages]
+        message_ids = []
+        with self.__lock:
+            self.__connection.execute('BEGIN')
+            try:
+                for row in rows:
+                    message_ids.append(self.__connection.execute('INSERT INTO outbox (topic, payload, qos, expires_at) VALUES (?, ?, ?, ?)', row).lastrowid)
+                self.__connection.execute('COMMIT')
+            except sqlite3.Error:
+                self.__connection.execute('ROLLBACK')
+                raise
+        return message_ids
+
+    def remove(self, message_id: int):
+        with self.__lock:
+            self.__connection.execute('DELETE FROM outbox WHERE id = ?', (message_id,))
+
+    def get_pending(self):
+        """
+        Returns
+        -------
+        list
+            (id, topic, payload, qos) of the unexpired messages, oldest first.
+        Expired messages are deleted.
+        """
+        with self.__lock:
+            expired = self.__connection.execute('DELETE FROM outbox WHERE expires_at < ?', (time.time(),)).rowcount
+            pending = self.__connection.execute('SELECT id, topic, payload, qos FROM outbox ORDER BY id').fetchall()
+        if expired > 0:
+            self.__logger.info(f"dropped {expired} expired messages from the MQTT outbox")
+        return pending
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__connection.execute('SELECT COUNT(*) FROM outbox').fetchone()[0]
@@ -0,0 +1,212 @@
+import logging
+import os
+import socket
+import struct
+import time
+from helpers.env import Env
+
+class NeighbourTable:
+    """
+    Description
+    -----------
+    Passive presence source backed by the kernel neighbour (ARP) table.
+    The table is dumped once over rtnetlink and then followed incrementally through
+    the neighbour multicast group; /proc/net/arp is read when netlink is unavailable.
+    An optional dnsmasq lease file is re-read only when it changes.
+
+    get_presence() answers True for reachable entries and False for failed entries
+    or expired leases. None means the entry is stale, incomplete (or unknown) and
+    the device has to be confirmed with an active probe.
+    """
+
+    NLMSG_ERROR = 2
+    NLMSG_DONE = 3
+    RTM_NEWNEIGH = 28
+    RTM_DELNEIGH = 29
+    RTM_GETNEIGH = 30
+    NLM_F_REQUEST = 0x1
+    NLM_F_DUMP = 0x300
+    RTMGRP_NEIGH = 0x4
+    NDA_DST = 1
+
+    NUD_INCOMPLETE = 0x01
+    NUD_REACHABLE = 0x02
+    NUD_STALE = 0x04
+    NUD_FAILED = 0x20
+    NUD_PERMANENT = 0x80
+
+    NLMSG_HEADER = struct.Struct('=LHHLL')
+    NDMSG = struct.Struct('=BxxxiHBB')
+    RTATTR = struct.Struct('=HH')
+
+    PROC_ARP_PATH = '/proc/net/arp'
+    PROC_ARP_COMPLETE_FLAG = 0x2
+
+    DUMP_TIMEOUT = 2
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.__logger = logger
+        self.__states = {}
+        self.__socket = None
+        self.__use_netlink = True
+        self.__sequence = 0
+
+        self.__leases_file = Env.get_dhcp_leases_file()
+        self.__leases_mtime = None
+        self.__lease_expiries = {}
+
+    def close(self):
+        if self.__socket is not None:
+            self.__socket.close()
+            self.__socket = None
+
+    def __align(self, length: int) -> int:
+        return (length + 3) & ~3
+
+    def __parse_neighbour(self, msg_type: int, body: bytes):
+        if len(body) < NeighbourTable.NDMSG.size:
+            return
+        family, _, state, _, _ = NeighbourTable.NDMSG.unpack_from(body, 0)
+        if family != socket.AF_INET:
+            return
+
+        address = None
+        offset = NeighbourTable.NDMSG.size
+        while offset + NeighbourTable.RTATTR.size <= len(body):
+            attr_length, attr_type = NeighbourTable.RTATTR.unpack_from(body, offset)
+            if attr_length < NeighbourTable.RTATTR.size:
+                break
+            if attr_type == NeighbourTable.NDA_DST:
+                address = socket.inet_ntoa(body[offset + NeighbourTable.RTATTR.size:offset + attr_length])
+            offset += self.__align(attr_length)
+
+        if address is None:
+            return
+        if msg_type == NeighbourTable.RTM_DELNEIGH:
+            self.__states.pop(address, None)
+        else:
+            self.__states[address] = state
+
+    def __parse_messages(self, data: bytes) -> bool:
+        done = False
+        offset = 0
+        header_size = NeighbourTable.NLMSG_HEADER.size
+        while offset + header_size <= len(data):
+            length, msg_type, _, _, _ = NeighbourTable.NLMSG_HEADER.unpack_from(data, offset)
+            if length < header_size:
+                break
+            if msg_type == NeighbourTable.NLMSG_DONE:
+                done = True
+            elif msg_type == NeighbourTable.NLMSG_ERROR:
+                error = struct.unpack_from('=i', data, offset + header_size)[0]
+                if error != 0:
+                    raise OSError(-error, os.strerror(-error))
+            elif msg_type in (NeighbourTable.RTM_NEWNEIGH, NeighbourTable.RTM_DELNEIGH):
+                self.__parse_neighbour(msg_type, data[offset + header_size:offset + length])
+            offset += self.__align(length)
+        return done
+
+    def __dump(self):
+        self.__sequence += 1
+        request = NeighbourTable.NLMSG_HEADER.pack(NeighbourTable.NLMSG_HEADER.size + NeighbourTable.NDMSG.size, NeighbourTable.RTM_GETNEIGH,
+                                                   NeighbourTable.NLM_F_REQUEST | NeighbourTable.NLM_F_DUMP, self.__sequence, 0)
+        request += NeighbourTable.NDMSG.pack(socket.AF_INET, 0, 0, 0, 0)
+
+        self.__states.clear()
+        self.__socket.settimeout(NeighbourTable.DUMP_TIMEOUT)
+        try:
+            self.__socket.send(request)
+            while not self.__parse_messages(self.__socket.recv(65536)):
+                pass
+        finally:
+            self.__socket.setblocking(False)
+
+    def __drain_events(self):
+        while True:
+            try:
+                data = self.__socket.recv(65536)
+            except BlockingIOError:
+                return
+            self.__parse_messages(data)
+
+    def __refresh_netlink(self):
+        if self.__socket is None:
+            self.__socket = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            self.__socket.bind((0, NeighbourTable.RTMGRP_NEIGH))
+            self.__dump()
+            return
+
+        try:
+            self.__drain_events()
+        except OSError as e:
+            # ENOBUFS: events were lost, start over from a full dump
+            self.__logger.info(f'neighbour events lost ({e}), resynchronizing')
+            self.__dump()
+
+    def __refresh_proc_arp(self):
+        self.__states.clear()
+        with open(NeighbourTable.PROC_ARP_PATH) as arp_file:
+            next(arp_file, None)
+            for line in arp_file:
+                columns = line.split()
+                if len(columns) < 4:
+                    continue
+                # completed entries are still confirmed with a probe, /proc/net/arp has no freshness
+                is_complete = int(columns[2], 16) & NeighbourTable.PROC_ARP_COMPLETE_FLAG
+                self.__states[columns[0]] = NeighbourTable.NUD_STALE if is_complete else NeighbourTable.NUD_INCOMPLETE
+
+    def __refresh_leases(self):
+        if self.__leases_file is None:
+            return
+        try:
+            mtime = os.stat(self.__leases_file).st_mtime
+        except OSError as e:
+            self.__logger.info(f'DHCP leases file is not readable: {e}')
+            self.__lease_expiries.clear()
+            self.__leases_mtime = None
+            return
+        if mtime == self.__leases_mtime:
+            return
+
+        self.__leases_mtime = mtime
+        self.__lease_expiries.clear()
+        with open(self.__leases_file) as leases_file:
+            for line in leases_file:
+                # dnsmasq format: <expiry> <mac> <ip> <hostname> <client id>
+                columns = line.split()
+                if len(columns) >= 3 and columns[0].isdigit():
+                    self.__lease_expiries[columns[2]] = int(columns[0])
+
+    def refresh(self):
+        if self.__use_netlink:
+            try:
+                self.__refresh_netlink()
+            except OSError as e:
+                self.__logger.info(f'rtnetlink is not available ({e}), falling back to {NeighbourTable.PROC_ARP_PATH}')
+                self.close()
+                self.__use_netlink = False
+
+        if not self.__use_netlink:
+            try:
+                self.__refresh_proc_arp()
+            except OSError as e:
+                self.__logger.error(f'failed to read {NeighbourTable.PROC_ARP_PATH}: {e}')
+                self.__states.clear()
+
+        self.__refresh_leases()
+
+    def get_presence(self, address: str) -> bool | None:
+        expiry = self.__lease_expiries.get(address)
+        # dnsmasq writes 0 for infinite leases
+        if expiry is not None and expiry != 0 and expiry < time.time():
+            return False
+
+        state = self.__states.get(address)
+        if state is None:
+            return None
+        if state & (NeighbourTable.NUD_REACHABLE | NeighbourTable.NUD_PERMANENT):
+            return True
+        # an incomplete entry is a resolution in progress, not a missing device
+        if state & NeighbourTable.NUD_FAILED:
+            return False
+        return None
@@ -0,0 +1,165 @@
+import logging
+import queue
+import threading
+import time
+
+class OrderedWorkerPool:
+    """
+    Description
+    -----------
+    Bounded worker pool that keeps the order of tasks sharing a key. Every key is
+    pinned to one worker queue, so tasks of the same device run one after another
+    while different devices are processed in parallel.
+
+    When a worker queue is full the overflow policy applies: 'block' waits for room,
+    'drop_newest' rejects the submitted task and 'drop_oldest' discards the oldest
+    queued task of that worker.
+    """
+
+    OVERFLOW_BLOCK = 'block'
+    OVERFLOW_DROP_NEWEST = 'drop_newest'
+    OVERFLOW_DROP_OLDEST = 'drop_oldest'
+    OVERFLOW_POLICIES = [OVERFLOW_BLOCK, OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST]
+
+    STATS_LOG_INTERVAL = 600
+
+    def __init__(self, name: str, workers: int, queue_size: int, overflow_policy: str, logger: logging.Logger) -> None:
+        if overflow_policy not in OrderedWorkerPool.OVERFLOW_POLICIES:
+            raise ValueError(f'unknown overflow policy: {overflow_policy}')
+        self.__name = name
+        self.__logger = logger
+        self.__overflow_policy = overflow_policy
+        worker_queue_size = max(1, queue_size // workers)
+        self.__queues = [queue.Queue(maxsize=worker_queue_size) for _ in range(workers)]
+        self.__threads = []
+
+        self.__stats_lock = threading.Lock()
+        self.__processed = 0
+        self.__failed = 0
+        self.__dropped = 0
+        self.__max_depth = 0
+        self.__total_handler_ms = 0.0
+        self.__max_handler_ms = 0.0
+        self.__total_wait_ms = 0.0
+        self.__last_stats_log = time.monotonic()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        for index, worker_queue in enumerate(self.__queues):
+            thread = threading.Thread(target=self.__run, args=(worker_queue,), name=f'{self.__name}-{index}', daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+
+    def stop(self):
+        """
+        Description
+        -----------
+        Lets the workers finish every queued task, then stops them.
+        """
+        for worker_queue in self.__queues:
+            worker_queue.put(None)
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+        self.__logger.info(f'{self.__name} worker pool stopped, stats: {self.get_stats()}')
+
+    def submit(self, key, fn, *args) -> bool:
+        """
+        Returns
+        -------
+        bool
+            False, if the task was rejected by the drop_newest policy (or submitted
+            while the pool is stopping).
+        """
+        worker_queue = self.__queues[hash(key) % len(self.__queues)]
+        task = (fn, args, time.perf_counter())
+
+        if self.__overflow_policy == OrderedWorkerPool.OVERFLOW_BLOCK:
+            worker_queue.put(task)
+        elif self.__overflow_policy == OrderedWorkerPool.OVERFLOW_DROP_NEWEST:
+            try:
+                worker_queue.put_nowait(task)
+            except queue.Full:
+                self.__record_drop()
+                return False
+        else:
+            while True:
+                try:
+                    worker_queue.put_nowait(task)
+                    break
+                except queue.Full:
+                    try:
+                        evicted = worker_queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    if evicted is None:
+                        # the stop sentinel is never evicted, the worker is stopping anyway
+                        worker_queue.put_nowait(None)
+                        self.__record_drop()
+                        return False
+                    self.__record_drop()
+
+        depth = self.get_queue_depth()
+        with self.__stats_lock:
+            self.__max_depth = max(self.__max_depth, depth)
+        return True
+
+    def __record_drop(self):
+        with self.__stats_lock:
+            self.__dropped += 1
+        self.__logger.warning(f'{self.__name} worker queue is full, task dropped ({self.__overflow_policy})')
+
+    def __run(self, worker_queue: queue.Queue):
+        while True:
+            task = worker_queue.get()
+            if task is None:
+                return
+            fn, args, enqueued_at = task
+            started = time.perf_counter()
+            failed = False
+            try:
+                fn(*args)
+            except Exception as e:
+                failed = True
+                self.__logger.exception(f'{self.__name} task failed: {e}')
+            finished = time.perf_counter()
+            self.__record_task(started - enqueued_at, finished - started, failed)
+
+    def __record_task(self, wait_time: float, handler_time: float, failed: bool):
+        with self.__stats_lock:
+            self.__processed += 1
+            if failed:
+                self.__failed += 1
+            self.__total_wait_ms += wait_time * 1000
+            self.__total_handler_ms += handler_time * 1000
+            self.__max_handler_ms = max(self.__max_handler_ms, handler_time * 1000)
+
+            now = time.monotonic()
+            log_stats = now - self.__last_stats_log >= OrderedWorkerPool.STATS_LOG_INTERVAL
+            if log_stats:
+                self.__last_stats_log = now
+        if log_stats:
+            self.__logger.info(f'{self.__name} worker pool stats: {self.get_stats()}')
+
+    def get_queue_depth(self) -> int:
+        return sum(worker_queue.qsize() for worker_queue in self.__queues)
+
+    def get_stats(self):
+        with self.__stats_lock:
+            processed = max(1, self.__processed)
+            return {
+                "queue_depth": self.get_queue_depth(),
+                "max_queue_depth": self.__max_depth,
+                "processed": self.__processed,
+                "failed": self.__failed,
+                "dropped": self.__dropped,
+                "avg_wait_ms": round(self.__total_wait_ms / processed, 3),
+                "avg_handler_ms": round(self.__total_handler_ms / processed, 3),
+                "max_handler_ms": round(self.__max_handler_ms, 3)
+            }
@@ -0,0 +1,132 @@
+import datetime
+import math
+from enum import Enum
+from helpers.dbaccess import MongoDbAccess
+
+class SolarEvent(Enum):
+    SUNRISE = "sunrise"
+    SUNSET = "sunset"
+    CIVIL_DAWN = "civil_dawn"
+    CIVIL_DUSK = "civil_dusk"
+    NAUTICAL_DAWN = "nautical_dawn"
+    NAUTICAL_DUSK = "nautical_dusk"
+
+# zenith angle of the sun centre, degrees, for the (morning, evening) event pair
+# 90.833 accounts for the refraction and the radius of the solar disc
+SOLAR_EVENT_ZENITHS = [
+    (90.833, SolarEvent.SUNRISE, SolarEvent.SUNSET),
+    (96.0, SolarEvent.CIVIL_DAWN, SolarEvent.CIVIL_DUSK),
+    (102.0, SolarEvent.NAUTICAL_DAWN, SolarEvent.NAUTICAL_DUSK)
+]
+
+def compute_solar_events(latitude: float, longitude: float, days):
+    """
+    Returns
+    -------
+    list
+        {SolarEvent: UTC datetime | None} per day. None means the sun doesn't cross the
+        event zenith that day (polar day or night).
+    Description
+    -----------
+    NOAA general solar position approximation, accurate to about a minute. The equation
+    of time and the declination are computed once per day and shared by all events.
+    """
+    cos_zeniths = [math.cos(math.radians(zenith)) for zenith, _, _ in SOLAR_EVENT_ZENITHS]
+    lat = math.radians(latitude)
+    cos_lat = math.cos(lat)
+    sin_lat = math.sin(lat)
+
+    rows = []
+    for day in days:
+        gamma = 2 * math.pi / 365 * (day.timetuple().tm_yday - 1)
+        eqtime = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                           - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+        decl = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+                - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+                - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma))
+        cos_lat_decl = cos_lat * math.cos(decl)
+        sin_lat_decl = sin_lat * math.sin(decl)
+        # minutes after UTC midnight of the solar noon
+        solar_noon = 720 - 4 * longitude - eqtime
+        utc_midnight = datetime.datetime(day.year, day.month, day.day, tzinfo=datetime.timezone.utc)
+
+        row = {}
+        for cos_zenith, (_, morning_event, evening_event) in zip(cos_zeniths, SOLAR_EVENT_ZENITHS):
+            cos_hour_angle = (cos_zenith - sin_lat_decl) / cos_lat_decl
+            if cos_hour_angle < -1 or cos_hour_angle > 1:
+                row[morning_event] = None
+                row[evening_event] = None
+                continue
+            half_day = 4 * math.degrees(math.acos(cos_hour_angle))
+            row[morning_event] = utc_midnight + datetime.timedelta(minutes=solar_noon - half_day)
+            row[evening_event] = utc_midnight + datetime.timedelta(minutes=solar_noon + half_day)
+        rows.append(row)
+    return rows
+
+class SolarTable:
+    """
+    Description
+    -----------
+    Solar events of one year at one location, keyed by date. Built in one batch
+    (compute) or restored from the persisted documents (from_documents), lookups are
+    dictionary accesses.
+    """
+
+    def __init__(self, latitude: float, longitude: float, year: int, events) -> None:
+        self.latitude = latitude
+        self.longitude = longitude
+        self.year = year
+        self.__events = events
+
+    def compute(latitude: float, longitude: float, year: int):
+        first_day = datetime.date(year, 1, 1)
+        days = [first_day + datetime.timedelta(days=offset) for offset in range((datetime.date(year + 1, 1, 1) - first_day).days)]
+        return SolarTable(latitude, longitude, year, dict(zip(days, compute_solar_events(latitude, longitude, days))))
+
+    def from_documents(latitude: float, longitude: float, year: int, documents):
+        """
+        Returns
+        -------
+        SolarTable | None
+            None, if the documents don't cover the whole year.
+        """
+        events = {}
+        for document in documents:
+            day = datetime.date.fromisoformat(document[MongoDbAccess.SOLAR_TABLE_DATE_FIELD])
+            if day.year != year:
+                continue
+            # mongo returns naive UTC datetimes
+            events[day] = {event: None if document.get(event.value) is None else document[event.value].replace(tzinfo=datetime.timezone.utc)
+                           for event in SolarEvent}
+        if len(events) != (datetime.date(year + 1, 1, 1) - datetime.date(year, 1, 1)).days:
+            return None
+        return SolarTable(latitude, longitude, year, events)
+
+    def to_documents(self):
+        documents = []
+        for day, row in self.__events.items():
+            document = {
+                MongoDbAccess.SOLAR_TABLE_DATE_FIELD: day.isoformat(),
+                MongoDbAccess.SOLAR_TABLE_LATITUDE_FIELD: self.latitude,
+                MongoDbAccess.SOLAR_TABLE_LONGITUDE_FIELD: self.longitude
+            }
+            for event, moment in row.items():
+                document[event.value] = moment
+            documents.append(document)
+        return documents
+
+    def covers(self, latitude: float, longitude: float, day: datetime.date) -> bool:
+        return self.latitude == latitude and self.longitude == longitude and self.year == day.year
+
+    def get_event_time(self, day: datetime.date, event: SolarEvent, offset: datetime.timedelta = datetime.timedelta(0)):
+        """
+        Returns
+        -------
+        datetime.datetime | None
+            Local time of the event shifted by offset (negative is before the event),
+            None if the event doesn't happen that day.
+        """
+        moment = self.__events[day][event]
+        if moment is None:
+            return None
+        return (moment + offset).astimezone()
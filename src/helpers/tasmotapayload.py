@@ -0,0 +1,163 @@
+from helpers.dbaccess import MongoDbAccess
+
+try:
+    import orjson
+    loads = orjson.loads
+    JSON_BACKEND = 'orjson'
+except ImportError:
+    import json
+    # json.loads detects the encoding of bytes itself, decoding first is faster for the UTF-8 payloads
+    loads = lambda payload: json.loads(payload.decode() if type(payload) is bytes else payload)
+    JSON_BACKEND = 'json'
+
+MAX_RELAYS = 8
+
+RELAY_STATES = {
+    'ON': True,
+    'OFF': False
+}
+
+def to_number(value):
+    # multi-channel meters report a list, one value per channel
+    if isinstance(value, list):
+        return float(sum(value))
+    return float(value)
+
+def to_first_number(value):
+    if isinstance(value, list):
+        return float(value[0]) if len(value) > 0 else None
+    return float(value)
+
+# record attribute -> (alternative (section, key) paths in the tele/<device>/SENSOR payload, converter, device field)
+SENSOR_SPEC = {
+    'energy_total': ([('ENERGY', 'Total')], to_number, MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD),
+    'power': ([('ENERGY', 'Power')], to_number, MongoDbAccess.DEVICE_POWER_FIELD),
+    'voltage': ([('ENERGY', 'Voltage')], to_first_number, MongoDbAccess.DEVICE_VOLTAGE_FIELD),
+    'current': ([('ENERGY', 'Current')], to_number, MongoDbAccess.DEVICE_CURRENT_FIELD),
+    'temperature': ([('ANALOG', 'Temperature'), ('DS18B20', 'Temperature')], to_number, MongoDbAccess.DEVICE_TEMPERATURE_FIELD)
+}
+
+_device_fields = {attribute: device_field for attribute, (_, _, device_field) in SENSOR_SPEC.items()}
+
+class SensorTelemetry:
+    __slots__ = ('fields',)
+
+    def __init__(self, fields: dict) -> None:
+        # device field -> decoded value, only the fields present in the message
+        self.fields = fields
+
+    def __getattr__(self, attribute: str):
+        if attribute not in _device_fields:
+            raise AttributeError(attribute)
+        return self.fields.get(_device_fields[attribute])
+
+    def to_fields(self):
+        return self.fields
+
+    def __repr__(self) -> str:
+        return f'SensorTelemetry({self.fields})'
+
+class PowerStateTelemetry:
+    __slots__ = ('relays',)
+
+    def __init__(self, relays: dict) -> None:
+        # relay index (1-based) -> is power on
+        self.relays = relays
+
+    @property
+    def power_on(self) -> bool:
+        return self.relays.get(1)
+
+    def to_fields(self):
+        fields = {MongoDbAccess.DEVICE_RELAYS_FIELD: {str(relay): state for relay, state in self.relays.items()}}
+        if 1 in self.relays:
+            fields[MongoDbAccess.DEVICE_POWER_ON_FIELD] = self.relays[1]
+        return fields
+
+    def __repr__(self) -> str:
+        return f'PowerStateTelemetry({self.relays})'
+
+def compile_sensor_spec(spec: dict):
+    """
+    Returns
+    -------
+    list
+        (section key, [(key, device field, converter), ...]) in the order the sections
+        are first named by the spec.
+    Description
+    -----------
+    Groups the spec by payload section once, so decoding a message looks up every
+    section once and does no spec lookups. A field found in an earlier section wins,
+    so the alternatives of every attribute must name their sections in that order.
+    """
+    sections = {}
+    for paths, converter, device_field in spec.values():
+        for section_key, key in paths:
+            sections.setdefault(section_key, []).append((key, device_field, converter))
+
+    section_order = list(sections)
+    for attribute, (paths, _, _) in spec.items():
+        positions = [section_order.index(section_key) for section_key, _ in paths]
+        if positions != sorted(positions):
+            raise ValueError(f'alternative paths of {attribute} contradict the section order {section_order}')
+    return list(sections.items())
+
+_sensor_sections = compile_sensor_spec(SENSOR_SPEC)
+
+# POWER for single relay devices, POWER1..POWER8 for multi-relay ones
+_relay_keys = [('POWER', 1)] + [(f'POWER{relay}', relay) for relay in range(1, MAX_RELAYS + 1)]
+
+def decode_sensor_payload(payload: bytes) -> SensorTelemetry | None:
+    """
+    Returns
+    -------
+    SensorTelemetry
+        Decoded tele/<device>/SENSOR message, or None if it has no known fields.
+    Raises ValueError for malformed JSON.
+    """
+    message = loads(payload)
+    if type(message) is not dict:
+        return None
+
+    fields = {}
+    for section_key, extractors in _sensor_sections:
+        section = message.get(section_key)
+        if type(section) is not dict:
+            continue
+        for key, device_field, converter in extractors:
+            value = section.get(key)
+            if value is None or device_field in fields:
+                continue
+            # plain numbers are the common case, only the rest goes through the converter
+            value_type = type(value)
+            if value_type is int:
+                value = float(value)
+            elif value_type is not float:
+                try:
+                    value = converter(value)
+                except (TypeError, ValueError):
+                    continue
+                if value is None:
+                    continue
+            fields[device_field] = value
+    return None if len(fields) == 0 else SensorTelemetry(fields)
+
+def decode_result_payload(payload: bytes) -> PowerStateTelemetry | None:
+    """
+    Returns
+    -------
+    PowerStateTelemetry
+        Relay states of a stat/<device>/RESULT message, or None if it reports no relay
+    (RESULT also carries replies to non-power commands).
+    Raises ValueError for malformed JSON.
+    """
+    message = loads(payload)
+    if type(message) is not dict:
+        return None
+
+    relays = {}
+    for key, relay in _relay_keys:
+        value = message.get(key)
+        if type(value) is str and value in RELAY_STATES:
+            relays[relay] = RELAY_STATES[value]
+    return None if len(relays) == 0 else PowerStateTelemetry(relays)
@@ -0,0 +1,184 @@
+import datetime
+import logging
+import queue
+import threading
+import pymongo
+import pymongo.errors
+from helpers.dbaccess import MongoDbAccess
+from helpers.deviceregistry import DeviceRegistry
+from helpers.env import Env
+
+class TelemetryWriteBehind:
+    """
+    Description
+    -----------
+    Write-behind stage for device telemetry. Submitted fields patch the registry
+    immediately, so device evaluation sees them at once (also across registry reloads
+    until they are flushed), and are persisted later:
+    the latest value per device is coalesced over the flush window, changes below
+    the per-field deadband are dropped and the rest goes to Mongo in one bulk_write.
+    Every sensor reading, deadbanded or not, is also appended to the sensor history.
+    """
+
+    PUT_TIMEOUT = 1
+
+    def __init__(self, registry: DeviceRegistry, logger: logging.Logger) -> None:
+        self.__registry = registry
+        self.__logger = logger
+        self.__queue = queue.Queue(maxsize=Env.get_telemetry_queue_size())
+        self.__flush_interval = Env.get_telemetry_flush_interval()
+        self.__deadbands = {
+            MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD: Env.get_telemetry_energy_deadband(),
+            MongoDbAccess.DEVICE_TEMPERATURE_FIELD: Env.get_telemetry_temperature_deadband()
+        }
+        self.__written = {}
+        self.__unflushed = {}
+        self.__energy_totals = {}
+        self.__unflushed_readings = []
+        self.__flush_lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.flush()
+        if len(self.__unflushed) > 0 or len(self.__unflushed_readings) > 0:
+            self.__logger.error(f"telemetry of {len(self.__unflushed)} devices and {len(self.__unflushed_readings)} sensor readings was not persisted on shutdown")
+
+    def __run(self):
+        while not self.__stop_event.wait(self.__flush_interval):
+            self.flush()
+
+    def __get_reading(self, device_name: str, fields: dict):
+        reading = {}
+        for device_field, history_field in MongoDbAccess.HISTORY_MEASURE_FIELDS.items():
+            if device_field in fields:
+                reading[history_field] = fields[device_field]
+
+        if MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD in fields:
+            energy_total = fields[MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD]
+            previous_energy_total = self.__energy_totals.get(device_name)
+            if previous_energy_total is None:
+                energy_delta = 0
+            elif energy_total < previous_energy_total:
+                # the device counter was reset
+                energy_delta = energy_total
+            else:
+                energy_delta = energy_total - previous_energy_total
+            self.__energy_totals[device_name] = energy_total
+            reading[MongoDbAccess.HISTORY_ENERGY_TOTAL_FIELD] = energy_total
+            reading[MongoDbAccess.HISTORY_ENERGY_DELTA_FIELD] = energy_delta
+
+        if len(reading) == 0:
+            return None
+
+        reading[MongoDbAccess.HISTORY_DEVICE_FIELD] = device_name
+        reading[MongoDbAccess.HISTORY_TIME_FIELD] = datetime.datetime.now(datetime.timezone.utc)
+        return reading
+
+    def submit(self, device_name: str, fields: dict):
+        if device_name not in self.__written:
+            device = self.__registry.get_device(device_name)
+            if device is not None:
+                self.__written.setdefault(device_name, {field: device[field] for field in fields if field in device})
+                if MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD in device:
+                    self.__energy_totals.setdefault(device_name, device[MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD])
+        reading = self.__get_reading(device_name, fields)
+        self.__registry.cache_device_fields(device_name, fields)
+
+        try:
+            self.__queue.put((device_name, fields, reading), timeout=TelemetryWriteBehind.PUT_TIMEOUT)
+        except queue.Full:
+            self.__logger.info("telemetry queue is full, flushing from the producer")
+            self.flush()
+            self.__queue.put((device_name, fields, reading))
+
+    def __flush_readings(self, readings):
+        if len(readings) == 0:
+            return
+        try:
+            with MongoDbAccess() as mongo_client:
+                mongo_client.append_sensor_readings(readings)
+        except pymongo.errors.PyMongoError as e:
+            self.__logger.error(f"appending {len(readings)} sensor readings failed: {e}, retrying on next flush")
+            max_readings = self.__queue.maxsize
+            if len(readings) > max_readings:
+                self.__logger.error(f"dropping {len(readings) - max_readings} oldest sensor readings")
+                readings = readings[-max_readings:]
+            self.__unflushed_readings = readings
+
+    def __is_significant(self, field: str, value, last_value) -> bool:
+        deadband = self.__deadbands.get(field)
+        if deadband is not None and isinstance(value, (int, float)) and isinstance(last_value, (int, float)):
+            return abs(value - last_value) >= deadband
+        return value != last_value
+
+    def __filter_changes(self, device_name: str, fields: dict):
+        written = self.__written.get(device_name, {})
+        return {field: value for field, value in fields.items()
+                if field not in written or self.__is_significant(field, value, written[field])}
+
+    def __release(self, pending):
+        for device_name, fields in pending.items():
+            self.__registry.release_cached_fields(device_name, fields)
+
+    def flush(self):
+        with self.__flush_lock:
+            pending = self.__unflushed
+            self.__unflushed = {}
+            readings = self.__unflushed_readings
+            self.__unflushed_readings = []
+            messages_count = 0
+            while True:
+                try:
+                    device_name, fields, reading = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                pending.setdefault(device_name, {}).update(fields)
+                if reading is not None:
+                    readings.append(reading)
+                messages_count += 1
+
+            self.__flush_readings(readings)
+
+            changes = {}
+            for device_name, fields in pending.items():
+                changed_fields = self.__filter_changes(device_name, fields)
+                if len(changed_fields) > 0:
+                    changes[device_name] = changed_fields
+
+            if len(changes) == 0:
+                self.__release(pending)
+                return
+
+            requests = [pymongo.UpdateOne({MongoDbAccess.DEVICE_NAME_FIELD: device_name}, {"$set": fields}) for device_name, fields in changes.items()]
+            try:
+                with MongoDbAccess() as mongo_client:
+                    mongo_client.bulk_write_devices(requests)
+            except pymongo.errors.PyMongoError as e:
+                self.__logger.error(f"telemetry flush of {len(requests)} devices failed: {e}, retrying on next flush")
+                self.__unflushed = changes
+                # the deadbanded fields are settled, the failed ones stay cached until retried
+                self.__release({device_name: {field: value for field, value in fields.items() if field not in changes.get(device_name, {})}
+                                for device_name, fields in pending.items()})
+                return
+
+            for device_name, fields in changes.items():
+                self.__written.setdefault(device_name, {}).update(fields)
+            self.__release(pending)
+            self.__logger.info(f"telemetry flushed for {len(requests)} devices, coalesced from {messages_count} messages")
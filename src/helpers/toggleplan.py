@@ -0,0 +1,42 @@
+import logging
+import threading
+
+class ToggleAction:
+    __slots__ = ('device_name', 'state', 'forced_power')
+
+    def __init__(self, device_name: str, state: bool | None, forced_power: bool) -> None:
+        self.device_name = device_name
+        self.state = state
+        self.forced_power = forced_power
+
+    def __repr__(self) -> str:
+        return f'ToggleAction({self.device_name}, state: {self.state}, forced: {self.forced_power})'
+
+class TogglePlanCommit:
+    """
+    Description
+    -----------
+    Collects the acknowledgements of the commands of one toggle plan. Once every command
+    is settled, commit(acked, failed) is called once with the actions split by outcome,
+    so the switch stats of the whole plan are stored with one write.
+    """
+
+    def __init__(self, actions, commit, logger: logging.Logger) -> None:
+        self.__commit = commit
+        self.__logger = logger
+        self.__lock = threading.Lock()
+        self.__remaining = len(actions)
+        self.__acked = []
+        self.__failed = []
+
+    def get_on_ack(self, action: ToggleAction):
+        return lambda is_acked: self.__on_ack(action, is_acked)
+
+    def __on_ack(self, action: ToggleAction, is_acked: bool):
+        with self.__lock:
+            (self.__acked if is_acked else self.__failed).append(action)
+            self.__remaining -= 1
+            if self.__remaining != 0:
+                return
+        self.__logger.info(f"toggle plan settled, acknowledged: {len(self.__acked)}, failed: {len(self.__failed)}")
+        self.__commit(self.__acked, self.__failed)
@@ -8,6 +8,29 @@ TASMOTA_POWER_CMND_TEMPLATE = 'cmnd/~/Power'
 TASMOTA_POWER_STAT_TEMPLATE = 'stat/~/POWER'
 TASMOTA_STAT_RESULT_TEMPLATE = 'stat/~/RESULT'
 TASMOTA_SENSOR_TEMPLATE = 'tele/~/SENSOR'
+DEVICE_WILDCARD = '+'
+
+MESSAGE_CLASS_COMMAND = 'command'
+MESSAGE_CLASS_STATUS_POLL = 'status_poll'
+MESSAGE_CLASS_NOTIFICATION = 'notification'
+MESSAGE_CLASS_REQUEST = 'request'
+MESSAGE_CLASS_SUBSCRIPTION = 'subscription'
+
+# QoS per message class, can be overridden with MQTT_QOS_POLICY
+QOS_POLICY = {
+    MESSAGE_CLASS_COMMAND: 1,
+    MESSAGE_CLASS_STATUS_POLL: 0,
+    MESSAGE_CLASS_NOTIFICATION: 1,
+    MESSAGE_CLASS_REQUEST: 1,
+    MESSAGE_CLASS_SUBSCRIPTION: 1
+}
+
+# seconds an undelivered message is kept in the outbox, other classes are not queued
+OUTBOX_TTL = {
+    MESSAGE_CLASS_COMMAND: 30,
+    MESSAGE_CLASS_NOTIFICATION: 3600,
+    MESSAGE_CLASS_REQUEST: 300
+}
 
 def get_tasmota_power_cmnd_topic(device: str):
     return TASMOTA_POWER_CMND_TEMPLATE.replace("~", device)
@@ -0,0 +1,68 @@
+SINGLE_LEVEL_WILDCARD = '+'
+MULTI_LEVEL_WILDCARD = '#'
+
+class TopicTrieNode:
+    __slots__ = ('children', 'handler')
+
+    def __init__(self) -> None:
+        self.children = {}
+        self.handler = None
+
+class TopicTrie:
+    """
+    Description
+    -----------
+    Routes MQTT topics to handlers registered for topic filters ('+' and '#' wildcards).
+    Matching walks one level per topic segment, preferring an exact segment over '+'
+    over '#', and returns the segments matched by '+' (e.g. the device name of tele/+/SENSOR).
+    """
+
+    def __init__(self) -> None:
+        self.__root = TopicTrieNode()
+
+    def add(self, topic_filter: str, handler):
+        node = self.__root
+        for segment in topic_filter.split('/'):
+            node = node.children.setdefault(segment, TopicTrieNode())
+        node.handler = handler
+
+    def __match(self, node: TopicTrieNode, segments: list, index: int, wildcards: list):
+        if index == len(segments):
+            if node.handler is not None:
+                return node.handler
+            # '#' also matches its parent level
+            multi_level = node.children.get(MULTI_LEVEL_WILDCARD)
+            return None if multi_level is None else multi_level.handler
+
+        segment = segments[index]
+        child = node.children.get(segment)
+        if child is not None:
+            handler = self.__match(child, segments, index + 1, wildcards)
+            if handler is not None:
+                return handler
+
+        child = node.children.get(SINGLE_LEVEL_WILDCARD)
+        if child is not None:
+            wildcards.append(segment)
+            handler = self.__match(child, segments, index + 1, wildcards)
+            if handler is not None:
+                return handler
+            wildcards.pop()
+
+        child = node.children.get(MULTI_LEVEL_WILDCARD)
+        if child is not None:
+            return child.handler
+        return None
+
+    def match(self, topic: str):
+        """
+        Returns
+        -------
+        tuple
+            The handler and the list of segments matched by '+', or (None, None).
+        """
+        wildcards = []
+        handler = self.__match(self.__root, topic.split('/'), 0, wildcards)
+        if handler is None:
+            return None, None
+        return handler, wildcards
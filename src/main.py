@@ -1,13 +1,38 @@
 import logging
 from helpers.mongologger import MongoLogger
 from helpers.env import Env
+from helpers.config import ConfigStore
 from helpers.interfaces import DependencyContainer
+from helpers.dbaccess import MongoDbAccess, close_mongo_client
+from helpers.deviceregistry import DeviceRegistry
+from helpers.devicerules import DeviceRuleEngine
+from helpers.telemetrybuffer import TelemetryWriteBehind
+from helpers.asyncdbaccess import AsyncMongoDbAccess
 from modules.tlbot import TlBot
 from modules.scheduler import HomeKeeperScheduler
 from modules.netwatcher import HomeKeeperNetwatcher
 from modules.mqttmanager import HomeKeeperMQTT
 from modules.devicesmanager import DevicesManager
 
+def bootstrap_database() -> bool:
+    with MongoDbAccess() as mongo_client:
+        if not mongo_client.ensure_indexes():
+            logging.warning('some of the device indexes are missing')
+        mongo_client.ensure_sensor_history_collections()
+
+        collscan_queries = mongo_client.get_collscan_queries()
+
+    if len(collscan_queries) == 0:
+        logging.info("device queries are backed by indexes")
+        return True
+
+    if Env.get_mongo_fail_on_collscan():
+        logging.fatal(f'device queries fall back to a collection scan: {collscan_queries}')
+        return False
+
+    logging.warning(f'device queries fall back to a collection scan: {collscan_queries}')
+    return True
+
 def main():
     logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO, datefmt='%Y-%m-%d %H:%M:%S')
 
@@ -17,6 +42,17 @@ def main():
         logging.fatal('missing required environment variables')
         return
 
+    try:
+        config_store = ConfigStore(logging.getLogger('homekeeper_config'))
+    except (OSError, ValueError, TypeError) as e:
+        logging.fatal(f'invalid configuration: {e}')
+        return
+    config_store.install_reload_signal()
+
+    if not bootstrap_database():
+        close_mongo_client()
+        return
+
     # TODO subscribe to devices
     # TODO register all jobs
 
@@ -27,28 +63,45 @@ def main():
     netwatcher_logger = logging.getLogger('homekeeper_netwatcher')
     mqtt_manager_logger = logging.getLogger('homekeeper_mqtt_manager')
     device_manager_logger = logging.getLogger('homekeeper_device_manager')
+    device_registry_logger = logging.getLogger('homekeeper_device_registry')
 
     mongo_handler = MongoLogger()
 
-    loggers = [tl_bot_logger, scheduler_logger, netwatcher_logger, mqtt_manager_logger, device_manager_logger]
+    loggers = [tl_bot_logger, scheduler_logger, netwatcher_logger, mqtt_manager_logger, device_manager_logger, device_registry_logger]
     for logger in loggers:
         logger.setLevel(logging.INFO)
         logger.addHandler(mongo_handler)
 
-    tl_bot = TlBot(di_container, di_container, tl_bot_logger)
+    device_registry = DeviceRegistry(device_registry_logger)
+    device_rules = DeviceRuleEngine(device_manager_logger)
+    device_rules.reload()
+    # the rules are kept in Mongo, they are reloaded on every reload signal
+    config_store.add_reloader(device_rules.reload)
+    telemetry = TelemetryWriteBehind(device_registry, mqtt_manager_logger)
+    tl_bot_data_access = AsyncMongoDbAccess(tl_bot_logger)
+
+    tl_bot = TlBot(di_container, di_container, device_registry, tl_bot_data_access, tl_bot_logger)
     scheduler = HomeKeeperScheduler(di_container, di_container, di_container, scheduler_logger)
-    netwatcher = HomeKeeperNetwatcher(di_container, netwatcher_logger)
-    mqtt_manager = HomeKeeperMQTT(di_container, di_container, mqtt_manager_logger)
-    device_manager = DevicesManager(di_container, device_manager_logger)
+    netwatcher = HomeKeeperNetwatcher(di_container, device_registry, di_container, netwatcher_logger)
+    mqtt_manager = HomeKeeperMQTT(di_container, di_container, device_registry, telemetry, di_container, mqtt_manager_logger)
+    device_manager = DevicesManager(di_container, device_registry, device_rules, device_manager_logger)
+
+    di_container.register_dependencies(device_manager, mqtt_manager, tl_bot, config_store)
+    config_store.add_reload_listener(scheduler.apply_config)
+    config_store.add_reload_listener(netwatcher.apply_config)
+
+    with device_registry:
+        with mqtt_manager:
+            mqtt_manager.subscribe_to_topics()
+            with scheduler:
+                scheduler.register_all_jobs()
 
-    di_container.register_dependencies(device_manager, mqtt_manager, netwatcher, tl_bot)
+                with netwatcher:
+                    tl_bot.start_bot()
 
-    with mqtt_manager:
-        mqtt_manager.subscribe_to_topics()
-        with scheduler:
-            scheduler.register_all_jobs()
+                tl_bot_data_access.shutdown()
 
-            tl_bot.start_bot()
+    close_mongo_client()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
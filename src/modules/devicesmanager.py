@@ -1,83 +1,220 @@
 from helpers.dbaccess import MongoDbAccess
+from helpers.deviceregistry import DeviceRegistry
+from helpers.env import Env
 import logging
 from helpers.dailyevents import DailyEvent
 import datetime
-from helpers.devicestatemachinevalidator import DeviceStateBasicValidator, DeviceSwitchTimeValidator
+import threading
+from helpers.devicerules import DeviceRuleEngine
+from helpers.toggleplan import ToggleAction, TogglePlanCommit
 from helpers.interfaces import DeviceManagerInterface, MqttPublisherInterface
 
 class DevicesManager(DeviceManagerInterface):
 
-    def __init__(self, publisher: MqttPublisherInterface, logger: logging.Logger) -> None:
+    # custom event -> requested power state, None toggles
+    CUSTOM_EVENT_STATES = {
+        DailyEvent.CUSTOM_TIME_ON: True,
+        DailyEvent.CUSTOM_TIME_OFF: False,
+        DailyEvent.CUSTOM_TIME_TOGGLE: None
+    }
+
+    def __init__(self, publisher: MqttPublisherInterface, registry: DeviceRegistry, rules: DeviceRuleEngine, logger: logging.Logger) -> None:
         super().__init__()
         self.__publisher = publisher
+        self.__registry = registry
+        self.__rules = rules
         self.__logger = logger
+        # device states are evaluated from MQTT workers, scheduler and bot threads,
+        # a toggle decided by two of them at once would be sent twice
+        self.__evaluation_lock = threading.RLock()
+        # device name -> switch time of the command waiting for an acknowledgement
+        self.__commands_in_flight = {}
+
+        # events within the window are coalesced into one evaluation per affected device
+        self.__evaluation_window = Env.get_device_evaluation_window()
+        self.__pending_lock = threading.Lock()
+        self.__pending_active = set()
+        self.__pending_offline = set()
+        self.__evaluation_timer = None
+
+    def __plan_toggle(self, device, state: bool | None = None, forced: bool = False, is_user_forced: bool = False, present: bool | None = None) -> ToggleAction | None:
+        device_name = device[MongoDbAccess.DEVICE_NAME_FIELD]
+        if device_name in self.__commands_in_flight and not is_user_forced:
+            # the state the rules see is not committed until the previous command is acknowledged
+            self.__logger.info(f"command to {device_name} is not acknowledged yet, skipping")
+            return None
 
-    def __toggle_device(self, mongo_client: MongoDbAccess, device, state: bool | None = None, forced: bool = False, is_user_forced: bool = False):
-        
         if is_user_forced or forced:
-            validator = DeviceSwitchTimeValidator(device, self.__logger)
-            if not is_user_forced:
-                forced = False
+            # the requested state is applied as is, only a user command takes the device over
+            is_allowed, forced_power = self.__rules.evaluate(device, state=state, forced=is_user_forced, use_rules=False)
+        else:
+            is_allowed, forced_power = self.__rules.evaluate(device, present=present)
+            state = not device[MongoDbAccess.DEVICE_POWER_ON_FIELD]
+
+        if not is_allowed:
+            return None
+        return ToggleAction(device_name, state, forced_power)
+
+    def __apply_plan(self, plan):
+        """
+        Description
+        -----------
+        Publishes the commands of the plan back to back. The switch stats of the acknowledged
+        devices are stored with one bulk write once every command of the plan is settled, the
+        devices stay in flight until then.
+        """
+        if len(plan) == 0:
+            return
+        switch_time = datetime.datetime.now()
+        plan_commit = TogglePlanCommit(plan, lambda acked, failed: self.__commit_plan(switch_time, acked, failed), self.__logger)
+        for action in plan:
+            self.__commands_in_flight[action.device_name] = switch_time
+        self.__publisher.send_device_toggles([(action.device_name, action.state, plan_commit.get_on_ack(action)) for action in plan])
+        self.__logger.info(f"MQTT signals sent to {[action.device_name for action in plan]}")
+
+    def __commit_plan(self, switch_time: datetime.datetime, acked, failed):
+        with self.__evaluation_lock:
+            for action in acked + failed:
+                if self.__commands_in_flight.get(action.device_name) == switch_time:
+                    del self.__commands_in_flight[action.device_name]
+            for action in failed:
+                self.__logger.error(f"{action.device_name} did not acknowledge the command, device state not updated")
+            self.__registry.update_devices_stats([(action.device_name, switch_time, action.forced_power) for action in acked])
+            if len(acked) > 0:
+                self.__logger.info(f"last switch time updated for {[action.device_name for action in acked]}")
+
+    def process_device_states(self, get_active_devices: bool = True, dry_run: bool = False):
+        """
+        Returns
+        -------
+        list
+            ToggleAction of every device to switch. With dry_run the plan is only returned.
+        """
+        with self.__evaluation_lock:
+            plan = self.__plan_device_states(get_active_devices)
+            if dry_run:
+                self.__logger.info(f"toggle plan (dry run): {plan}")
+                return plan
+            self.__apply_plan(plan)
+        return plan
+
+    def __plan_device_states(self, get_active_devices: bool):
+        plan = []
+        if get_active_devices:
+            for device in self.__registry.get_devices_with_mobile_pair():
+                action = self.__plan_toggle(device=device, present=True)
+                if action is not None:
+                    plan.append(action)
         else:
-            validator = DeviceStateBasicValidator.get_device_validator(device, self.__logger)
-
-        if validator.is_toggle_allowed(new_state=state, forced=forced):
-            
-            current_time = datetime.datetime.now()
-
-            mongo_client.update_device_stats(device_name=validator.device_name, last_switch=current_time, forced_power=validator.is_power_forced)
-
-            self.__logger.info(f"last switch time updated for {validator.device_name}")
-
-            self.__publisher.send_device_toggle(device_name=validator.device_name)
-
-            self.__logger.info(f"MQTT signal sent to {validator.device_name}")
-
-    def process_device_states(self, get_active_devices: bool = True):
-        with MongoDbAccess() as mongo_client:
-            if get_active_devices:
-                for device_group in mongo_client.get_devices_with_mobile_pair():
-                    device = device_group['device']
-                    self.__toggle_device(mongo_client=mongo_client, device=device)
-            else:
-                offline_mobile_devices = list(mongo_client.get_offline_mobile_devices())
-                projected_offline_devices = [md[MongoDbAccess.MOBILE_DEVICE_NAME_FIELD] for md in offline_mobile_devices]
-                self.__logger.info(f"got offline devices: {projected_offline_devices}")
-                for device in mongo_client.get_paired_devices(projected_offline_devices):
-                    self.__logger.info(f"processing device: {device}")
-                    device_mobile_devices = device[MongoDbAccess.DEVICE_PAIRED_DEVICES_FIELD]
-                    are_all_mobile_devices_offline = all(md in projected_offline_devices for md in device_mobile_devices)
-                    if are_all_mobile_devices_offline:
-                        self.__toggle_device(mongo_client=mongo_client, device=device, state=False, forced=True, is_user_forced=False)
-                    else:
-                        self.__logger.info("device has still some mobiles connected to network")
+            projected_offline_devices = self.__registry.get_offline_mobile_devices_names()
+            self.__logger.info(f"got offline devices: {projected_offline_devices}")
+            for device in self.__registry.get_paired_devices(projected_offline_devices):
+                self.__logger.info(f"processing device: {device}")
+                device_mobile_devices = device[MongoDbAccess.DEVICE_PAIRED_DEVICES_FIELD]
+                are_all_mobile_devices_offline = all(md in projected_offline_devices for md in device_mobile_devices)
+                if are_all_mobile_devices_offline:
+                    action = self.__plan_toggle(device=device, state=False, forced=True, is_user_forced=False)
+                    if action is not None:
+                        plan.append(action)
+                else:
+                    self.__logger.info("device has still some mobiles connected to network")
+        return plan
+
+    def __schedule_evaluation(self, device_names, is_offline: bool = False):
+        with self.__pending_lock:
+            (self.__pending_offline if is_offline else self.__pending_active).update(device_names)
+            if self.__evaluation_timer is None:
+                self.__evaluation_timer = threading.Timer(self.__evaluation_window, self.__evaluate_pending)
+                self.__evaluation_timer.daemon = True
+                self.__evaluation_timer.start()
+
+    def __evaluate_pending(self):
+        with self.__pending_lock:
+            pending_active, self.__pending_active = self.__pending_active, set()
+            pending_offline, self.__pending_offline = self.__pending_offline, set()
+            self.__evaluation_timer = None
+
+        self.__logger.info(f"evaluating devices: {pending_active | pending_offline}")
+        with self.__evaluation_lock:
+            self.__apply_plan(self.__plan_devices(pending_active | pending_offline, pending_active, pending_offline))
+
+    def __plan_devices(self, device_names, active_names, offline_names):
+        plan = []
+        for device_name in device_names:
+            try:
+                action = self.__plan_device(device_name, device_name in active_names, device_name in offline_names)
+            except Exception as e:
+                self.__logger.exception(f"failed to evaluate device {device_name}: {e}")
+                continue
+            if action is not None:
+                plan.append(action)
+        return plan
+
+    def __plan_device(self, device_name: str, is_active: bool, is_offline: bool) -> ToggleAction | None:
+        device, is_any_mobile_connected, are_all_mobiles_offline = self.__registry.get_device_pairing(device_name)
+        if device is None:
+            return None
+        if is_active and is_any_mobile_connected:
+            return self.__plan_toggle(device=device, present=True)
+        if is_offline:
+            if are_all_mobiles_offline:
+                return self.__plan_toggle(device=device, state=False, forced=True, is_user_forced=False)
+            self.__logger.info(f"device {device_name} has still some mobiles connected to network")
+        return None
 
     def mobile_device_connect_disconnect_handler(self, mobile_device_name: str, is_connected: bool):
         self.__logger.info(f"updating mobile device ({mobile_device_name}) state (connected: {is_connected})")
-        with MongoDbAccess() as mongo_client:
-            mongo_client.update_mobile_device_stat(mobile_device_name, is_connected)
+        self.__registry.update_mobile_device_stat(mobile_device_name, is_connected)
         self.__logger.info("mobile devices states updated")
-        self.process_device_states(is_connected)
+        self.__schedule_evaluation(self.__registry.get_paired_devices_names(mobile_device_name), is_offline=not is_connected)
+
+    def device_telemetry_handler(self, device_name: str):
+        self.__schedule_evaluation([device_name])
 
     def device_direct_command_handler(self, device_name: str, state: bool):
-        with MongoDbAccess() as mongo_client:
-            device = mongo_client.get_device_by_name(device_name=device_name)
-            if device is None:
-                self.__logger.info(f"device {device_name} not found")
-                return
-            self.__toggle_device(mongo_client=mongo_client, state=state, device=device, forced=True, is_user_forced=True)
-
-    def time_event_handler(self, event_type: DailyEvent, devices):
-        self.__logger.info(f"updating devices state: {event_type}")
-
-        with MongoDbAccess() as mongo_client:
-            if event_type == DailyEvent.BED_TIME or event_type == DailyEvent.WAKEUP_TIME:
-                mongo_client.update_devices_sleep(event_type == DailyEvent.BED_TIME)
-            elif event_type == DailyEvent.SUNRISE or event_type == DailyEvent.SUNSET:
-                mongo_client.update_devices_dark(event_type == DailyEvent.SUNSET)
-            else:
-                # TODO implement other events
-                self.__logger.info(f"unknown event type: {event_type}")
-                return
+        device = self.__registry.get_device(device_name=device_name)
+        if device is None:
+            self.__logger.info(f"device {device_name} not found")
+            return
+        with self.__evaluation_lock:
+            action = self.__plan_toggle(state=state, device=device, forced=True, is_user_forced=True)
+            if action is not None:
+                self.__apply_plan([action])
+
+    def time_event_handler(self, event_type: DailyEvent, devices = None, group: str | None = None):
+        """
+        Description
+        -----------
+        Applies a timing event to the listed devices and the devices of the group, or to all
+        devices when neither is given. Sleep and dark events update the scope with one
+        filtered write and re-evaluate only those devices, the custom events switch them
+        to the requested state without taking them over the way a direct command does.
+        Either way the toggles go out as one plan.
+        """
+        is_scoped = devices is not None or group is not None
+        device_names = self.__registry.get_devices_names_in_scope(devices, group)
+        self.__logger.info(f"updating devices state: {event_type}, devices: {device_names if is_scoped else 'all'}")
+
+        if event_type == DailyEvent.BED_TIME or event_type == DailyEvent.WAKEUP_TIME:
+            self.__registry.update_devices_sleep(event_type == DailyEvent.BED_TIME, device_names if is_scoped else None)
+        elif event_type == DailyEvent.SUNRISE or event_type == DailyEvent.SUNSET:
+            self.__registry.update_devices_dark(event_type == DailyEvent.SUNSET, device_names if is_scoped else None)
+        elif event_type in DevicesManager.CUSTOM_EVENT_STATES:
+            state = DevicesManager.CUSTOM_EVENT_STATES[event_type]
+            with self.__evaluation_lock:
+                plan = []
+                for device_name in device_names:
+                    device = self.__registry.get_device(device_name)
+                    if device is not None:
+                        action = self.__plan_toggle(device=device, state=state, forced=True, is_user_forced=False)
+                        if action is not None:
+                            plan.append(action)
+                self.__apply_plan(plan)
+            return
+        else:
+            self.__logger.info(f"unknown event type: {event_type}")
+            return
         self.__logger.info(f"devices state update finished")
-        self.process_device_states()
+
+        with self.__evaluation_lock:
+            self.__apply_plan(self.__plan_devices(device_names, set(device_names), ()))
@@ -1,49 +1,194 @@
 import logging
 from paho.mqtt import client as mqtt_client
 import helpers.topics
-import random
+import datetime
+import threading
+import time
+import pymongo.errors
 from helpers.dailyevents import DailyEvent
 from helpers.env import Env
+from helpers.commandtracker import CommandAckTracker
 from helpers.dbaccess import MongoDbAccess
-import json
-from helpers.interfaces import DeviceManagerInterface, MqttPublisherInterface, TelegramMessageSenderInterface
+from helpers.deviceregistry import DeviceRegistry
+from helpers.mqttoutbox import MqttOutbox
+from helpers.orderedworkerpool import OrderedWorkerPool
+from helpers.telemetrybuffer import TelemetryWriteBehind
+from helpers.tasmotapayload import decode_result_payload, decode_sensor_payload
+from helpers.topictrie import TopicTrie
+from helpers.interfaces import ConfigProviderInterface, DeviceManagerInterface, MqttPublisherInterface, TelegramMessageSenderInterface
+
+class StatusPoll:
+    __slots__ = ('expected', 'replied', 'started', 'timer')
+
+    def __init__(self, expected: set) -> None:
+        self.expected = expected
+        self.replied = set()
+        self.started = time.monotonic()
+        self.timer = None
 
 class HomeKeeperMQTT(mqtt_client.Client, MqttPublisherInterface):
 
-    TASMOTA_DEVICE_POWER_STATUS = "POWER"
-    TASMOTA_DEVICE_ANALOG_STATUS = "ANALOG"
-    TASMOTA_DEVICE_ANALOG_TEMPERATURE_STATUS = "Temperature"
-    TASMOTA_DEVICE_ENERGY_STATUS = "ENERGY"
-    TASMOTA_DEVICE_ENERGY_TOTAL_STATUS = "Total"
-
     TASMOTA_DEVICE_TOGGLE_COMMAND = 'toggle'
     TASMOTA_DEVICE_ON_COMMAND = 'on'
     TASMOTA_DEVICE_OFF_COMMAND = 'off'
+
+    CONFIRMED_MID_TTL = 60
     
-    def __init__(self, tl_message_sender: TelegramMessageSenderInterface, device_manager: DeviceManagerInterface, logger: logging.Logger) -> None:
-        client_id = "home-control-{}".format(random.randint(0, 1000))
-        super().__init__(client_id)
+    def __init__(self, tl_message_sender: TelegramMessageSenderInterface, device_manager: DeviceManagerInterface, registry: DeviceRegistry, telemetry: TelemetryWriteBehind, config: ConfigProviderInterface, logger: logging.Logger) -> None:
+        # a stable client id with a persistent session keeps the subscriptions on the broker across reconnects
+        super().__init__(Env.get_mqtt_client_id(), clean_session=False)
+        self.max_inflight_messages_set(Env.get_mqtt_max_inflight())
         self.__tl_message_sender = tl_message_sender
         self.__device_manager = device_manager
+        self.__registry = registry
+        self.__telemetry = telemetry
+        self.__config = config
         self.__logger = logger
+        self.__qos_policy = dict(helpers.topics.QOS_POLICY)
+        self.__qos_policy.update(Env.get_mqtt_qos_policy())
+
+        self.__outbox = MqttOutbox(Env.get_mqtt_outbox_path(), logger)
+        # never held while calling the client, paho runs on_publish under its own message lock
+        self.__outbox_lock = threading.Lock()
+        # message id of an in-flight publish -> its outbox id
+        self.__outbox_mids = {}
+        # message id -> confirmation time, for confirmations that arrive before publish() returns
+        self.__confirmed_mids = {}
+        self.__subscriptions_lock = threading.Lock()
+        self.__subscriptions = {}
+        self.__status_poll_lock = threading.Lock()
+        self.__status_poll = None
+        # handlers may wait on Mongo, keep them off the network thread so keepalives are not stalled
+        self.__commands = CommandAckTracker(self.__publish_device_commands, self.__get_toggle_command, logger)
+        overflow_policy = Env.get_mqtt_queue_overflow_policy()
+        if overflow_policy == OrderedWorkerPool.OVERFLOW_BLOCK:
+            logger.warning("MQTT queue overflow policy is 'block', a full worker queue stalls the network thread (keepalives, acks)")
+        self.__workers = OrderedWorkerPool('mqtt', Env.get_mqtt_workers(), Env.get_mqtt_queue_size(), overflow_policy, logger)
+
+        self.__device_topics = TopicTrie()
+        self.__device_topics.add(helpers.topics.get_tasmota_stat_result_topic(device=helpers.topics.DEVICE_WILDCARD), self.on_device_result_message)
+        self.__device_topics.add(helpers.topics.get_tasmota_sensor_topic(device=helpers.topics.DEVICE_WILDCARD), self.on_device_sensor_message)
 
     def __on_mqtt_connect(self, client, userdata, flags, rc):
         if rc == 0:
-            self.__logger.info("Connected to MQTT")
+            self.__logger.info(f"Connected to MQTT, session present: {flags.get('session present')}")
+            with self.__subscriptions_lock:
+                subscriptions = list(self.__subscriptions.items())
+            if not flags.get('session present') and len(subscriptions) > 0:
+                self.subscribe(subscriptions)
+            self.__replay_outbox()
         else:
             self.__logger.fatal("Failed to connect to MQTT, return code: %d\n", rc)
 
     def __enter__(self):
+        self.__telemetry.start()
+        self.__workers.start()
+        self.__commands.start()
         self.start_mqtt_client()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.loop_stop()
+        self.__commands.stop()
+        self.__workers.stop()
+        self.__telemetry.stop()
+        self.__outbox.close()
 
     @mqtt_client.Client.on_connect.getter
     def on_connect(self):
         return self.__on_mqtt_connect
 
+    @mqtt_client.Client.on_publish.getter
+    def on_publish(self):
+        return self.__on_mqtt_publish
+
+    def __on_mqtt_publish(self, client, userdata, mid):
+        with self.__outbox_lock:
+            outbox_id = self.__outbox_mids.pop(mid, None)
+            if outbox_id is None:
+                # confirmed before publish() returned its message id, or not an outbox message;
+                # old entries are dropped long before the message id can wrap around
+                now = time.monotonic()
+                self.__confirmed_mids[mid] = now
+                for confirmed_mid, confirmed_at in list(self.__confirmed_mids.items()):
+                    if now - confirmed_at > HomeKeeperMQTT.CONFIRMED_MID_TTL:
+                        del self.__confirmed_mids[confirmed_mid]
+                return
+        self.__outbox.remove(outbox_id)
+
+    def __publish_from_outbox(self, outbox_id: int, topic: str, payload, qos: int):
+        message_info = self.publish(topic, payload, qos)
+        # a QoS>0 message is queued by the client even without a connection (MQTT_ERR_NO_CONN)
+        # and sent by it after the reconnect, replaying it as well would deliver it twice
+        if message_info.rc not in (mqtt_client.MQTT_ERR_SUCCESS, mqtt_client.MQTT_ERR_NO_CONN):
+            # rejected by the client, stays in the outbox until the next connect
+            return
+        with self.__outbox_lock:
+            is_confirmed = self.__confirmed_mids.pop(message_info.mid, None) is not None
+            if not is_confirmed:
+                self.__outbox_mids[message_info.mid] = outbox_id
+        if is_confirmed:
+            self.__outbox.remove(outbox_id)
+
+    def __replay_outbox(self):
+        with self.__outbox_lock:
+            # in-flight messages are resent by the client itself
+            in_flight = set(self.__outbox_mids.values())
+        pending = [message for message in self.__outbox.get_pending() if message[0] not in in_flight]
+        for outbox_id, topic, payload, qos in pending:
+            self.__publish_from_outbox(outbox_id, topic, payload, qos)
+        if len(pending) > 0:
+            self.__logger.info(f"replayed {len(pending)} messages from the MQTT outbox")
+
+    def publish_message(self, topic: str, payload: str | None, message_class: str):
+        """
+        Description
+        -----------
+        Publishes with the QoS of the message class. Classes with an outbox ttl are
+        stored first and delivered after a reconnect (or restart) unless they expire.
+        """
+        qos = self.__qos_policy[message_class]
+        ttl = helpers.topics.OUTBOX_TTL.get(message_class)
+        if ttl is None or qos == 0:
+            return self.publish(topic, payload, qos)
+
+        outbox_id = self.__outbox.put(topic, payload, qos, ttl)
+        if self.is_connected():
+            self.__publish_from_outbox(outbox_id, topic, payload, qos)
+        else:
+            self.__logger.info(f"MQTT is disconnected, message to {topic} queued in the outbox")
+
+    def publish_messages(self, messages, message_class: str):
+        """
+        Description
+        -----------
+        publish_message for a batch of (topic, payload), the outbox stores the whole batch
+        in one transaction before any of it is handed to the client.
+        """
+        qos = self.__qos_policy[message_class]
+        ttl = helpers.topics.OUTBOX_TTL.get(message_class)
+        if ttl is None or qos == 0:
+            for topic, payload in messages:
+                self.publish(topic, payload, qos)
+            return
+
+        outbox_ids = self.__outbox.put_many(messages, qos, ttl)
+        if not self.is_connected():
+            self.__logger.info(f"MQTT is disconnected, {len(outbox_ids)} messages queued in the outbox")
+            return
+        for outbox_id, (topic, payload) in zip(outbox_ids, messages):
+            self.__publish_from_outbox(outbox_id, topic, payload, qos)
+
+    def __subscribe(self, topic: str, callback):
+        qos = self.__qos_policy[helpers.topics.MESSAGE_CLASS_SUBSCRIPTION]
+        self.message_callback_add(topic, callback)
+        with self.__subscriptions_lock:
+            self.__subscriptions[topic] = qos
+            is_connected = self.is_connected()
+        # a connect in between subscribes to it as well, a duplicate subscription is harmless
+        if is_connected:
+            self.subscribe(topic=topic, qos=qos)
+
     def start_mqtt_client(self):
         broker_host, broker_port, broker_username, broker_password = Env.get_mqtt_connection_params()
 
@@ -53,105 +198,190 @@ class HomeKeeperMQTT(mqtt_client.Client, MqttPublisherInterface):
 
         self.loop_start()
 
-    def subscribe_to_device(self, device_name: str, qos: int = 2):
-        power_topic_name = helpers.topics.get_tasmota_stat_result_topic(device=device_name)
-        sensor_topic_name = helpers.topics.get_tasmota_sensor_topic(device=device_name)
-
-        self.subscribe(topic=power_topic_name, qos=qos)
-        self.message_callback_add(power_topic_name, self.on_device_result_message)
-
-        self.subscribe(topic=sensor_topic_name, qos=qos)
-        self.message_callback_add(sensor_topic_name, self.on_device_sensor_message)
-
-    def subscribe_to_devices(self, devices = None):
-        with MongoDbAccess() as mongo_client:
-            if devices is None:
-                devices = mongo_client.get_devices_names()
-            for device_set in devices:
-                device_name = device_set[MongoDbAccess.DEVICE_NAME_FIELD]
-                self.subscribe_to_device(device_name=device_name)
-                self.__logger.info(f"subscribed to device: {device_name}")
+    def __on_device_message(self, client: mqtt_client.Client, userdata, msg):
+        handler, wildcards = self.__device_topics.match(msg.topic)
+        if handler is None:
+            return
+        device_name = wildcards[0]
+        if not self.__registry.has_device(device_name):
+            return
+        # messages of one device are handled in arrival order, devices in parallel
+        self.__workers.submit(device_name, handler, device_name, msg)
+
+    def subscribe_to_devices(self):
+        # one wildcard subscription per message class, devices are resolved by the topic trie
+        for topic_name in [helpers.topics.get_tasmota_stat_result_topic(device=helpers.topics.DEVICE_WILDCARD),
+                           helpers.topics.get_tasmota_sensor_topic(device=helpers.topics.DEVICE_WILDCARD)]:
+            self.__subscribe(topic_name, self.__on_device_message)
+            self.__logger.info(f"subscribed to devices topic: {topic_name}")
+
+    def get_worker_stats(self):
+        return self.__workers.get_stats()
 
     def subscribe_to_telegram_message_sending(self):
-        self.subscribe(topic=helpers.topics.SEND_MESSAGE, qos=2)
-        self.message_callback_add(helpers.topics.SEND_MESSAGE, self.on_telegram_message_request)
+        self.__subscribe(helpers.topics.SEND_MESSAGE, self.on_telegram_message_request)
 
     def subscribe_to_topics(self):
         self.subscribe_to_devices()
         self.subscribe_to_telegram_message_sending()
 
 
-    def get_device_stat(self, device_name: str, qos: int = 2):
+    def get_device_stat(self, device_name: str):
         topic_name = helpers.topics.get_tasmota_power_cmnd_topic(device=device_name)
-        self.publish(topic=topic_name, qos=qos)
+        self.publish_message(topic_name, None, helpers.topics.MESSAGE_CLASS_STATUS_POLL)
 
     def get_devices_stat(self):
-        self.__logger.info('getting devices stat...')
-        with MongoDbAccess() as mongo_client:
-            for device_set in mongo_client.get_devices_names():
-                device_name = device_set[MongoDbAccess.DEVICE_NAME_FIELD]
-                self.__logger.info(f'getting stat from: {device_name}')
+        """
+        Description
+        -----------
+        Polls the power state of every device and accounts the RESULT replies until
+        the deadline. With TASMOTA_GROUP_TOPIC set, the whole fleet is polled with one
+        broadcast to the group topic, otherwise one command per device is sent in a burst.
+        Devices that did not reply are marked stale.
+        """
+        device_names = set(self.__registry.get_devices_names())
+        if len(device_names) == 0:
+            return
+
+        with self.__status_poll_lock:
+            if self.__status_poll is not None:
+                self.__logger.info('previous devices stat poll is still running, skipping')
+                return
+            status_poll = StatusPoll(device_names)
+            config = self.__config.get_config()
+            status_poll.timer = threading.Timer(config.status_poll_deadline, self.__finish_status_poll, args=(status_poll,))
+            status_poll.timer.daemon = True
+            self.__status_poll = status_poll
+
+        group_topic = config.tasmota_group_topic
+        if group_topic is not None:
+            self.__logger.info(f'getting devices stat with the {group_topic} group topic...')
+            self.get_device_stat(device_name=group_topic)
+        else:
+            self.__logger.info(f'getting stat from {len(device_names)} devices...')
+            for device_name in device_names:
                 self.get_device_stat(device_name=device_name)
-
-    def send_device_toggle(self, device_name: str, qos: int = 2, state: bool | None = None):
+        status_poll.timer.start()
+
+    def __record_status_reply(self, device_name: str):
+        with self.__status_poll_lock:
+            status_poll = self.__status_poll
+            if status_poll is None or device_name not in status_poll.expected:
+                return
+            status_poll.replied.add(device_name)
+            is_complete = len(status_poll.replied) == len(status_poll.expected)
+        if is_complete:
+            status_poll.timer.cancel()
+            self.__finish_status_poll(status_poll)
+
+    def __finish_status_poll(self, status_poll: StatusPoll):
+        with self.__status_poll_lock:
+            if self.__status_poll is not status_poll:
+                return
+            self.__status_poll = None
+            replied = set(status_poll.replied)
+        missing = status_poll.expected - replied
+
+        elapsed = round((time.monotonic() - status_poll.started) * 1000, 2)
+        self.__logger.info(f'devices stat poll finished in {elapsed} ms, replied: {len(replied)}/{len(status_poll.expected)}')
+        if len(missing) > 0:
+            self.__logger.warning(f'devices did not reply to the stat poll, marking stale: {sorted(missing)}')
+
+        try:
+            self.__registry.update_devices_stale(replied, False, last_seen=datetime.datetime.now())
+            self.__registry.update_devices_stale(missing, True)
+        except pymongo.errors.PyMongoError as e:
+            self.__logger.error(f'failed to store devices stat poll results: {e}')
+
+    def get_command_stats(self):
+        return self.__commands.get_stats()
+
+    def __publish_device_commands(self, commands):
+        messages = [(helpers.topics.get_tasmota_power_cmnd_topic(device=device_name), command) for device_name, command in commands]
+        self.__logger.info(f"publishing to tasmota devices: {messages}")
+        self.publish_messages(messages, helpers.topics.MESSAGE_CLASS_COMMAND)
+
+    def __get_toggle_command(self, state: bool | None):
         if state is None:
-            command = HomeKeeperMQTT.TASMOTA_DEVICE_TOGGLE_COMMAND
-        else:
-            command = HomeKeeperMQTT.TASMOTA_DEVICE_ON_COMMAND if state else HomeKeeperMQTT.TASMOTA_DEVICE_OFF_COMMAND
+            return HomeKeeperMQTT.TASMOTA_DEVICE_TOGGLE_COMMAND
+        return HomeKeeperMQTT.TASMOTA_DEVICE_ON_COMMAND if state else HomeKeeperMQTT.TASMOTA_DEVICE_OFF_COMMAND
+
+    def send_device_toggle(self, device_name: str, state: bool | None = None, on_ack = None):
+        """
+        Description
+        -----------
+        on_ack(is_acked) is called once the device reports the new state, or with False
+        when it does not answer the command (and its retries). It is called right away
+        when publishing to tasmota is disabled.
+        """
+        self.send_device_toggles([(device_name, state, on_ack)])
+
+    def send_device_toggles(self, toggles):
+        """
+        Description
+        -----------
+        send_device_toggle for a batch of (device_name, state, on_ack). The commands are
+        published back to back without waiting for acknowledgements, the notification
+        covers the whole batch.
+        """
+        if len(toggles) == 0:
+            return
+        config = self.__config.get_config()
         # temporary
-        if Env.get_publish_to_tg():
+        if config.publish_to_tg:
             self.__logger.info("publishing to tg...")
-            self.publish(topic=helpers.topics.SEND_MESSAGE, payload=f"device {device_name} should be {command} now!")
-
-        if Env.get_publish_to_tasmota():
-            publish_topic = helpers.topics.get_tasmota_power_cmnd_topic(device=device_name)
-            self.__logger.info(f"publishing to tasmota device on topic {publish_topic}, command: {command}")
-            self.publish(publish_topic, command)
+            message = "\n".join(f"device {device_name} should be {self.__get_toggle_command(state)} now!" for device_name, state, _ in toggles)
+            self.publish_message(helpers.topics.SEND_MESSAGE, message, helpers.topics.MESSAGE_CLASS_NOTIFICATION)
+
+        if not config.publish_to_tasmota:
+            for _, _, on_ack in toggles:
+                if on_ack is not None:
+                    on_ack(True)
+            return
+
+        commands = []
+        for device_name, state, on_ack in toggles:
+            expected_state = state
+            if expected_state is None:
+                device = self.__registry.get_device(device_name)
+                if device is not None and MongoDbAccess.DEVICE_POWER_ON_FIELD in device:
+                    expected_state = not device[MongoDbAccess.DEVICE_POWER_ON_FIELD]
+            commands.append((device_name, self.__get_toggle_command(state), expected_state, on_ack))
+        self.__commands.send_many(commands)
 
     def on_telegram_message_request(self, client: mqtt_client.Client, userdata, msg):
         self.__tl_message_sender.send_telegram_message(msg.payload.decode())
 
-    def on_device_sensor_message(self, client: mqtt_client.Client, userdata, msg):
-        segments = msg.topic.split('/')
-        if len(segments) != 3:
-            self.__logger.error("topic segments are not equal to 3...")
-        device_name = segments[1]
-
-        payload = msg.payload.decode()
-        self.__logger.info(f"got MQTT message on topic: {msg.topic}, payload: {payload}")
-        sensor_json = json.loads(payload)
-
-        energy = sensor_json[HomeKeeperMQTT.TASMOTA_DEVICE_ENERGY_STATUS][HomeKeeperMQTT.TASMOTA_DEVICE_ENERGY_TOTAL_STATUS]
-
-        device_sensor_stats = {
-            MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD: energy
-        }
+    def on_device_sensor_message(self, device_name: str, msg):
+        self.__logger.info(f"got MQTT message on topic: {msg.topic}, payload: {msg.payload}")
+        try:
+            record = decode_sensor_payload(msg.payload)
+        except ValueError as e:
+            self.__logger.warning(f"malformed sensor payload on topic: {msg.topic}: {e}")
+            return
+        if record is None:
+            return
 
-        if HomeKeeperMQTT.TASMOTA_DEVICE_ANALOG_STATUS in sensor_json:
-            analog_section = sensor_json[HomeKeeperMQTT.TASMOTA_DEVICE_ANALOG_STATUS]
-            if HomeKeeperMQTT.TASMOTA_DEVICE_ANALOG_TEMPERATURE_STATUS in analog_section:
-                temperature = analog_section[HomeKeeperMQTT.TASMOTA_DEVICE_ANALOG_TEMPERATURE_STATUS]
-                device_sensor_stats[MongoDbAccess.DEVICE_TEMPERATURE_FIELD] = temperature
+        self.__logger.info(f"got sensor telemetry from {device_name}: {record}")
 
-        self.__logger.info(f'got payload on topic: {msg.topic} from sensor: {payload}')
+        self.__telemetry.submit(device_name, record.to_fields())
 
-        with MongoDbAccess() as mongo_client:
-            mongo_client.update_device_sensor_stats(device_name, device_sensor_stats)
+        self.__device_manager.device_telemetry_handler(device_name)
 
-        self.__device_manager.process_device_states()
+    def on_device_result_message(self, device_name: str, msg):
+        self.__logger.info(f"got MQTT message on topic: {msg.topic}, payload: {msg.payload}")
+        try:
+            record = decode_result_payload(msg.payload)
+        except ValueError as e:
+            self.__logger.warning(f"malformed result payload on topic: {msg.topic}: {e}")
+            return
+        if record is None:
+            return
 
-    def on_device_result_message(self, client: mqtt_client.Client, userdata, msg):
-        segments = msg.topic.split('/')
-        if len(segments) != 3:
-            self.__logger.error("topic segments are not equal to 3...")
-        device_name = segments[1]
+        self.__logger.info(f"got device state on topic: {msg.topic}, relays: {record.relays}, device name: {device_name}")
 
-        payload = msg.payload.decode()
-        self.__logger.info(f"got MQTT message on topic: {msg.topic}, payload: {payload}")
-        stat_json = json.loads(payload)
-        is_power_on = True if stat_json[HomeKeeperMQTT.TASMOTA_DEVICE_POWER_STATUS] == HomeKeeperMQTT.TASMOTA_DEVICE_ON_COMMAND.upper() else False
+        self.__telemetry.submit(device_name, record.to_fields())
 
-        self.__logger.info(f"got device state on topic: {msg.topic}, is power on: {is_power_on}, device name: {device_name}")
+        self.__commands.handle_result(device_name, record.power_on)
 
-        with MongoDbAccess() as mongo_client:
-            mongo_client.update_device_power_on(device_name=device_name, power_on=is_power_on)
\ No newline at end of file
+        self.__record_status_reply(device_name)
@@ -1,44 +1,256 @@
 from helpers.dbaccess import MongoDbAccess
+from helpers.deviceregistry import DeviceRegistry
+from helpers.icmpsweeper import IcmpSweeper
+from helpers.neighbourtable import NeighbourTable
+from helpers.env import Env
+import heapq
 import logging
-import subprocess
-from helpers.interfaces import DeviceManagerInterface, NetwatcherInterface
+import threading
+import time
+import pymongo.errors
+from helpers.interfaces import ConfigProviderInterface, DeviceManagerInterface
 
-class HomeKeeperNetwatcher(NetwatcherInterface):
+class MobileDeviceState:
+    """
+    Description
+    -----------
+    Hysteresis and probe statistics of one mobile device, snapshotted to Mongo
+    so the first sweep after a restart continues from the previous state.
+    """
+    __slots__ = ('state', 'counter', 'interval', 'last_seen', 'rtt_count', 'rtt_mean', 'rtt_min', 'rtt_max')
 
-    def __init__(self, device_manager: DeviceManagerInterface, logger: logging.Logger) -> None:
+    def __init__(self, state: bool, interval: int) -> None:
+        self.state = state
+        self.counter = 0
+        self.interval = interval
+        self.last_seen = None
+        self.rtt_count = 0
+        self.rtt_mean = None
+        self.rtt_min = None
+        self.rtt_max = None
+
+    def record_seen(self, rtt: float | None):
+        self.last_seen = time.time()
+        if rtt is None:
+            return
+        self.rtt_count += 1
+        self.rtt_mean = rtt if self.rtt_mean is None else self.rtt_mean + (rtt - self.rtt_mean) / self.rtt_count
+        self.rtt_min = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+        self.rtt_max = rtt if self.rtt_max is None else max(self.rtt_max, rtt)
+
+    def to_document(self, ip_addr: str):
+        document = {attribute: getattr(self, attribute) for attribute in MobileDeviceState.__slots__}
+        document[MongoDbAccess.NETWATCHER_STATE_IP_ADDRESS_FIELD] = ip_addr
+        return document
+
+    def from_document(document):
+        device_state = MobileDeviceState(document['state'], document['interval'])
+        for attribute in MobileDeviceState.__slots__:
+            if attribute in document:
+                setattr(device_state, attribute, document[attribute])
+        return device_state
+
+class HomeKeeperNetwatcher:
+
+    # how long to wait for more devices to become due, so they share one sweep
+    SWEEP_BATCH_WINDOW = 1
+    # upper bound of the idle wait, new mobile devices are picked up at this pace
+    REGISTRY_SYNC_INTERVAL = 10
+
+    def __init__(self, device_manager: DeviceManagerInterface, registry: DeviceRegistry, config: ConfigProviderInterface, logger: logging.Logger) -> None:
         self.__device_states = {}
         self.__device_manager = device_manager
+        self.__registry = registry
         self.__logger = logger
+        self.__config = config
+        self.__sweeper = IcmpSweeper(config, logger)
+        self.__neighbours = NeighbourTable(logger) if Env.get_neighbour_table_enabled() else None
+
+        self.__snapshot_interval = Env.get_netwatcher_snapshot_interval()
+        self.__last_snapshot = time.monotonic()
+        self.__probe_queue = []
+        self.__sweep_lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        # wakes the probe loop before its next due probe, e.g. after a configuration change
+        self.__wake_event = threading.Event()
+        self.__is_config_changed = False
+        self.__thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
 
-    def __process_device_state(self, res: bool, ip_addr: str, name: str):
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        self.restore_states()
+        self.__stop_event.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop_event.set()
+        self.__wake_event.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.snapshot_states()
+        self.close()
+
+    def restore_states(self):
+        try:
+            with MongoDbAccess() as mongo_client:
+                documents = list(mongo_client.get_netwatcher_states())
+        except pymongo.errors.PyMongoError as e:
+            self.__logger.error(f'failed to restore netwatcher states: {e}')
+            return
+
+        with self.__sweep_lock:
+            for document in documents:
+                self.__device_states[document[MongoDbAccess.NETWATCHER_STATE_IP_ADDRESS_FIELD]] = MobileDeviceState.from_document(document)
+        self.__logger.info(f'restored netwatcher states of {len(documents)} mobile devices')
+
+    def snapshot_states(self):
+        with self.__sweep_lock:
+            documents = [device_state.to_document(ip_addr) for ip_addr, device_state in self.__device_states.items()]
+        try:
+            with MongoDbAccess() as mongo_client:
+                mongo_client.save_netwatcher_states(documents)
+        except pymongo.errors.PyMongoError as e:
+            self.__logger.error(f'failed to snapshot netwatcher states: {e}')
+            return
+        self.__last_snapshot = time.monotonic()
+
+    def __process_device_state(self, res: bool, ip_addr: str, name: str, rtt: float | None = None):
+        config = self.__config.get_config()
         if ip_addr not in self.__device_states:
-            self.__device_states[ip_addr] = {
-                "state": res,
-                "counter": 0
-            }
+            self.__device_states[ip_addr] = MobileDeviceState(res, config.ping_interval)
+
+        device_state = self.__device_states[ip_addr]
+        if res:
+            device_state.record_seen(rtt)
 
-        if self.__device_states[ip_addr]["state"] != res:
+        if device_state.state != res:
             counter_threshold = 5 if not res else 1
-            if self.__device_states[ip_addr]["counter"] >= counter_threshold:
+            if device_state.counter >= counter_threshold:
                 self.__device_manager.mobile_device_connect_disconnect_handler(name, res)
-                self.__device_states[ip_addr]["state"] = res
-                self.__device_states[ip_addr]["counter"] = 0
+                device_state.state = res
+                device_state.counter = 0
+                device_state.interval = config.ping_interval
                 self.__logger.info("device state counter reset")
             else:
                 self.__logger.info("device state counter incremented")
-                self.__device_states[ip_addr]["counter"] += 1
+                device_state.counter += 1
+                device_state.interval = config.ping_min_interval
+        else:
+            if device_state.counter > 0:
+                self.__logger.info("device state change was not confirmed, counter reset")
+                device_state.counter = 0
+                device_state.interval = config.ping_interval
+            else:
+                # a reload can lower the maximum below the current interval
+                device_state.interval = min(device_state.interval * 2, config.ping_max_interval)
 
-    def ping_mobile_devices(self):
-        with MongoDbAccess() as mongo_client:
-            for mobile_device in mongo_client.get_mobile_devices():
-                device_name = mobile_device['mobile_device_name']
+    def __sweep(self, mobile_devices):
+        passive_presence = {}
+        if self.__neighbours is not None:
+            self.__neighbours.refresh()
+            for mobile_device in mobile_devices:
                 ip_addr = mobile_device['ip_address']
-                self.__logger.info(f'processing {device_name}')
+                passive_presence[ip_addr] = self.__neighbours.get_presence(ip_addr)
+
+        probed_addresses = {mobile_device['ip_address'] for mobile_device in mobile_devices if passive_presence.get(mobile_device['ip_address']) is None}
+        results = self.__sweeper.sweep(probed_addresses)
+        self.__logger.info(f'{len(mobile_devices) - len(probed_addresses)} mobile devices resolved from the neighbour table, {len(probed_addresses)} probed')
+
+        for mobile_device in mobile_devices:
+            device_name = mobile_device['mobile_device_name']
+            ip_addr = mobile_device['ip_address']
+            self.__logger.info(f'processing {device_name}')
+            rtt = None
+            if ip_addr in results:
+                result = results[ip_addr]
+                response = result.is_alive
+                rtt = result.rtt
+                if result.is_alive:
+                    logging.info(f'{device_name} ping successfully, rtt: {round(result.rtt * 1000, 2)} ms, attempts: {result.attempts}')
+                else:
+                    logging.info(f'{device_name} ping failed after {result.attempts} attempts')
+            else:
+                response = passive_presence[ip_addr]
+                logging.info(f'{device_name} is {"reachable" if response else "unreachable"} in the neighbour table')
+            self.__process_device_state(response, ip_addr, device_name, rtt)
+
+    def apply_config(self, config):
+        """
+        Description
+        -----------
+        Configuration reload listener, the probe loop brings the probe intervals and the
+        queued probes within the new ping intervals.
+        """
+        self.__is_config_changed = True
+        self.__wake_event.set()
+
+    def __apply_ping_intervals(self, now: float):
+        config = self.__config.get_config()
+        for device_state in self.__device_states.values():
+            device_state.interval = min(max(device_state.interval, config.ping_min_interval), config.ping_max_interval)
+        self.__probe_queue = [(min(due, now + self.__device_states[ip_addr].interval if ip_addr in self.__device_states else now + config.ping_interval), ip_addr)
+                              for due, ip_addr in self.__probe_queue]
+        heapq.heapify(self.__probe_queue)
+        self.__logger.info(f'ping intervals updated: {config.ping_min_interval}..{config.ping_max_interval}, base {config.ping_interval}')
+
+    def __sync_probe_queue(self, mobile_devices: dict, now: float):
+        queued = {ip_addr for _, ip_addr in self.__probe_queue}
+        for ip_addr in mobile_devices.keys() - queued:
+            heapq.heappush(self.__probe_queue, (now, ip_addr))
+
+    def __pop_due_devices(self, mobile_devices: dict, now: float):
+        due = []
+        while len(self.__probe_queue) > 0 and self.__probe_queue[0][0] <= now + HomeKeeperNetwatcher.SWEEP_BATCH_WINDOW:
+            _, ip_addr = heapq.heappop(self.__probe_queue)
+            # devices removed from the registry drop out of the queue here
+            if ip_addr in mobile_devices:
+                due.append(mobile_devices[ip_addr])
+        return due
+
+    def __run(self):
+        while not self.__stop_event.is_set():
+            now = time.monotonic()
+            if self.__is_config_changed:
+                self.__is_config_changed = False
+                self.__apply_ping_intervals(now)
+            mobile_devices = {mobile_device['ip_address']: mobile_device for mobile_device in self.__registry.get_mobile_devices()}
+            self.__sync_probe_queue(mobile_devices, now)
+
+            due_devices = self.__pop_due_devices(mobile_devices, now)
+            if len(due_devices) > 0:
                 try:
-                    subprocess.check_output(['ping', '-c', '1', ip_addr])
-                    logging.info(f'{device_name} ping successfully')
-                    response = True
-                except:
-                    logging.info(f'{device_name} ping failed')
-                    response = False
-                self.__process_device_state(response, ip_addr, device_name)
\ No newline at end of file
+                    with self.__sweep_lock:
+                        self.__sweep(due_devices)
+                except Exception as e:
+                    self.__logger.error(f'mobile devices sweep failed: {e}')
+
+                now = time.monotonic()
+                base_interval = self.__config.get_config().ping_interval
+                for mobile_device in due_devices:
+                    ip_addr = mobile_device['ip_address']
+                    device_state = self.__device_states.get(ip_addr)
+                    interval = base_interval if device_state is None else device_state.interval
+                    heapq.heappush(self.__probe_queue, (now + interval, ip_addr))
+
+            if now - self.__last_snapshot >= self.__snapshot_interval:
+                self.snapshot_states()
+
+            wait_time = HomeKeeperNetwatcher.REGISTRY_SYNC_INTERVAL
+            if len(self.__probe_queue) > 0:
+                wait_time = min(wait_time, self.__probe_queue[0][0] - time.monotonic())
+            if wait_time > 0:
+                self.__wake_event.wait(wait_time)
+                self.__wake_event.clear()
+
+    def close(self):
+        self.__sweeper.close()
+        if self.__neighbours is not None:
+            self.__neighbours.close()
@@ -1,125 +1,465 @@
-import suntime
 import datetime
 import logging
+import threading
+import pymongo.errors
 from helpers.env import Env
 from helpers.dailyevents import DailyEvent
+from helpers.solartable import SolarEvent, SolarTable
+from helpers.jobstats import InstrumentedThreadPoolExecutor, JobStats
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES
 from apscheduler.schedulers.background import BackgroundScheduler
-from helpers.dbaccess import MongoDbAccess
-from helpers.interfaces import NetwatcherInterface, DeviceManagerInterface, MqttPublisherInterface
+from apscheduler.schedulers.base import STATE_STOPPED
+from apscheduler.jobstores.mongodb import MongoDBJobStore
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from helpers.dbaccess import MongoDbAccess, get_mongo_client
+from helpers.interfaces import ConfigProviderInterface, DeviceManagerInterface, MqttPublisherInterface
+
+# jobs are persisted with a reference to their function, so the job functions are module
+# level and dispatch to the scheduler of the process
+_active_scheduler = None
+
+def timing_event_job(event_type: str, devices = None, group: str | None = None):
+    _active_scheduler.run_timing_event(DailyEvent(event_type), devices, group)
+
+def daily_solar_events_job():
+    _active_scheduler.register_daily_solar_events()
+
+def devices_stat_job():
+    _active_scheduler.poll_devices_stat()
+
+def sensor_history_rollup_job(tier_name: str):
+    _active_scheduler.rollup_sensor_history(tier_name)
+
+def job_stats_log_job():
+    _active_scheduler.log_job_stats()
+
+class JobPolicy:
+    __slots__ = ('misfire_grace_time', 'coalesce', 'max_instances', 'executor')
+
+    def __init__(self, misfire_grace_time: int | None, coalesce: bool, max_instances: int = 1, executor: str = 'default') -> None:
+        self.misfire_grace_time = misfire_grace_time
+        self.coalesce = coalesce
+        self.max_instances = max_instances
+        # 'default' is the shared thread pool, 'dedicated' a single worker of the job class
+        self.executor = executor
+
+class SharedClientMongoDBJobStore(MongoDBJobStore):
+
+    def shutdown(self):
+        # the client is the process-wide one, it is closed by close_mongo_client
+        pass
 
 class HomeKeeperScheduler(BackgroundScheduler):
+    """
+    Description
+    -----------
+    Jobs are kept in the MongoDB job store under stable ids and restored on start. A job
+    whose run was missed while the service was down runs once on start (coalesce) if it is
+    still within the misfire grace time of its class, otherwise the missed run is skipped.
+    """
+
+    SCHEDULES_WATCH_MAX_AWAIT_MS = 1000
+    SCHEDULES_WATCH_RETRY_DELAY = 5
+
+    JOB_CLASS_TIMING = 'timing'
+    JOB_CLASS_DAILY = 'daily'
+    JOB_CLASS_STATUS_POLL = 'status_poll'
+    JOB_CLASS_ROLLUP = 'rollup'
+    JOB_CLASS_STATS = 'stats'
 
-    def __init__(self, netwatcher: NetwatcherInterface, device_manager: DeviceManagerInterface, mqtt_publisher: MqttPublisherInterface, logger: logging.Logger):
-        super().__init__()
-        self.__netwatcher = netwatcher
+    EXECUTOR_DEFAULT = 'default'
+    EXECUTOR_DEDICATED = 'dedicated'
+
+    # None grace time takes Env.get_scheduler_misfire_grace_time()
+    JOB_POLICIES = {
+        JOB_CLASS_TIMING: JobPolicy(None, True),
+        # plans the rest of the day, worth running whenever the day is not over
+        JOB_CLASS_DAILY: JobPolicy(23 * 3600, True),
+        # a late poll is superseded by the next one, a slow one must not hold up the timing events
+        JOB_CLASS_STATUS_POLL: JobPolicy(30, True, executor=EXECUTOR_DEDICATED),
+        # rollups continue from the last rolled up bucket, one catch-up run is enough,
+        # long aggregations run aside of the other jobs
+        JOB_CLASS_ROLLUP: JobPolicy(3600, True, executor=EXECUTOR_DEDICATED),
+        JOB_CLASS_STATS: JobPolicy(60, True)
+    }
+    # schedule document fields overriding the policy of its job
+    SCHEDULE_POLICY_FIELDS = ('misfire_grace_time', 'coalesce', 'max_instances')
+
+    STATS_LOG_INTERVAL = 600
+
+    def __init__(self, device_manager: DeviceManagerInterface, mqtt_publisher: MqttPublisherInterface, config: ConfigProviderInterface, logger: logging.Logger):
+        global _active_scheduler
+        job_store = SharedClientMongoDBJobStore(database=Env.get_mongo_db_name(), collection=Env.get_mongo_scheduler_jobs_coll_name(), client=get_mongo_client())
+        self.__job_stats = JobStats()
+        executors = {HomeKeeperScheduler.EXECUTOR_DEFAULT: InstrumentedThreadPoolExecutor(self.__job_stats, Env.get_scheduler_workers())}
+        for job_class, policy in HomeKeeperScheduler.JOB_POLICIES.items():
+            if policy.executor == HomeKeeperScheduler.EXECUTOR_DEDICATED:
+                executors[job_class] = InstrumentedThreadPoolExecutor(self.__job_stats, 1)
+        super().__init__(jobstores={'default': job_store}, executors=executors)
+        self.add_listener(lambda event: self.__job_stats.record_skipped(event.job_id), EVENT_JOB_MAX_INSTANCES)
         self.__device_manager = device_manager
         self.__mqtt_publisher = mqtt_publisher
+        self.__config = config
         self.__logger = logger
+        self.__solar_table = None
+        # (job id, job args, solar event, offset minutes, policy overrides) of the stored schedules bound to a solar event
+        self.__solar_schedules = []
+        self.__schedules_lock = threading.RLock()
+        self.__schedule_errors = {}
+        self.__stop_event = threading.Event()
+        self.__watch_thread = None
+        _active_scheduler = self
 
     def __enter__(self):
-        self.start()
+        # restored jobs are held until register_all_jobs reconciled them with the current definitions
+        self.start(paused=True)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__stop_event.set()
+        if self.__watch_thread is not None:
+            self.__watch_thread.join()
+            self.__watch_thread = None
+        self.log_job_stats()
         self.shutdown(wait=False)
 
-    def __calculate_dusk_dawn(self):
-        sun_obj = suntime.Sun(lat=self.__latitude, lon=self.__longitude)
-        today = datetime.date.today()
-
-        today_sunrise = sun_obj.get_local_sunrise_time(today)
-        today_sunset = sun_obj.get_local_sunset_time(today)
-
-        return today_sunrise, today_sunset
-
-    def __get_tomorrow_zero_hour(self, curr_datetime: datetime.datetime | None = None):
-        if curr_datetime is None:
-            curr_datetime = datetime.datetime.now()
-        tomorrow = curr_datetime + datetime.timedelta(days=1)
-        tomorrow_zero_hour = tomorrow.replace(hour=0, minute=1)
-        return tomorrow_zero_hour
-    
-    def __timing_event_fn(self, event_type: DailyEvent, devices = None):
-        self.__device_manager.time_event_handler(event_type, devices)
-        
-    def __sunrise_event(self):
-        self.__timing_event_fn(DailyEvent.SUNRISE)
-
-    def __sunset_event(self):
-        self.__timing_event_fn(DailyEvent.SUNSET)
-    
-    def __zero_hour_event(self):
-        sr, ss = self.__calculate_dusk_dawn()
-        
-        tomorrow_zero_hour = self.__get_tomorrow_zero_hour()
-
-        sunrise_event = self.__sunrise_event
-        sunset_event = self.__sunset_event
-
-        self.add_planned_job(sunrise_event, run_date=sr)
-        self.add_planned_job(sunset_event, run_date=ss)
-        self.add_planned_job(self.__zero_hour_event, run_date=tomorrow_zero_hour)
-
-    def add_cron_job(self, job, hour: int, minute: int, args = None):
-        self.add_job(job, 'cron', hour=hour, minute=minute, args=args)
-
-    def add_planned_job(self, job, run_date: datetime.datetime):
-        self.add_job(job, 'date', run_date=run_date)
+    def _process_jobs(self):
+        # the main loop wakes up once more on shutdown, due runs processed then would be
+        # marked as done in the job store without being executed
+        if self.state == STATE_STOPPED:
+            return None
+        return super()._process_jobs()
 
-    def register_timing_events(self):
+    def __restore_or_add_job(self, job_id: str, job_class: str, func, trigger, args = (), jobs: dict | None = None, overrides: dict | None = None) -> bool:
+        """
+        Returns
+        -------
+        bool
+            True, if the job was added or replaced.
+        Description
+        -----------
+        Keeps the stored job (and its pending run) if its definition is unchanged,
+        otherwise replaces it. jobs (id -> job) saves the lookup when many jobs are reconciled,
+        overrides replace fields of the job class policy (SCHEDULE_POLICY_FIELDS).
+        """
+        policy = HomeKeeperScheduler.JOB_POLICIES[job_class]
+        settings = {
+            "misfire_grace_time": Env.get_scheduler_misfire_grace_time() if policy.misfire_grace_time is None else policy.misfire_grace_time,
+            "coalesce": policy.coalesce,
+            "max_instances": policy.max_instances
+        }
+        if overrides is not None:
+            settings.update(overrides)
+        executor = job_class if policy.executor == HomeKeeperScheduler.EXECUTOR_DEDICATED else HomeKeeperScheduler.EXECUTOR_DEFAULT
+        args = tuple(args)
+
+        job = self.get_job(job_id) if jobs is None else jobs.get(job_id)
+        if job is not None and job.func is func and str(job.trigger) == str(trigger) and tuple(job.args) == args and job.executor == executor \
+                and all(getattr(job, name) == value for name, value in settings.items()):
+            self.__logger.debug(f'job {job_id} restored, next run: {job.next_run_time}')
+            return False
+
+        self.add_job(func, trigger, args=args, id=job_id, replace_existing=True, executor=executor, **settings)
+        return True
 
-        longitude, latitude = Env.get_device_lon_lat()
+    def __remove_jobs(self, id_prefix: str, keep_ids, jobs: dict):
+        removed = []
+        for job_id in jobs:
+            if job_id.startswith(id_prefix) and job_id not in keep_ids:
+                self.remove_job(job_id)
+                removed.append(job_id)
+        return removed
 
-        self.__longitude = float(longitude)
-        self.__latitude = float(latitude)
-        sr, ss = self.__calculate_dusk_dawn()
-        
-        current_datetime = datetime.datetime.now()
+    def __get_solar_table(self, day: datetime.date) -> SolarTable:
+        # coordinates are read on every lookup, a table of other coordinates is replaced
+        config = self.__config.get_config()
+        if self.__solar_table is not None and self.__solar_table.covers(config.latitude, config.longitude, day):
+            return self.__solar_table
 
-        if current_datetime.timestamp() < sr.timestamp():
-            next_run = sr
-            scheduled_fn = self.__sunrise_event
-            self.add_planned_job(scheduled_fn, next_run)
-        elif current_datetime.timestamp() > sr.timestamp() and current_datetime.timestamp() < ss.timestamp():
-            next_run = ss
-            scheduled_fn = self.__sunset_event
-            self.add_planned_job(scheduled_fn, next_run)
+        solar_table = None
+        try:
+            with MongoDbAccess() as mongo_db_access:
+                solar_table = SolarTable.from_documents(config.latitude, config.longitude, day.year,
+                                                        mongo_db_access.get_solar_table(config.latitude, config.longitude, day.year))
+        except pymongo.errors.PyMongoError as e:
+            self.__logger.error(f'failed to load the solar table: {e}')
 
-        zero_hour_job_date = self.__get_tomorrow_zero_hour()
-        if zero_hour_job_date is None:
-            self.__logger.fatal("can't set zero hour event for tomorrow")
+        if solar_table is None:
+            solar_table = SolarTable.compute(config.latitude, config.longitude, day.year)
+            self.__logger.info(f'solar table computed for {day.year} at {config.latitude}, {config.longitude}')
+            try:
+                with MongoDbAccess() as mongo_db_access:
+                    mongo_db_access.save_solar_table(solar_table.to_documents())
+            except pymongo.errors.PyMongoError as e:
+                self.__logger.error(f'failed to save the solar table: {e}')
 
-        self.add_planned_job(self.__zero_hour_event, zero_hour_job_date)
+        self.__solar_table = solar_table
+        return solar_table
+
+    def run_timing_event(self, event_type: DailyEvent, devices = None, group: str | None = None):
+        self.__device_manager.time_event_handler(event_type, devices, group)
+
+    def __add_solar_job(self, job_id: str, args: tuple, run_date: datetime.datetime | None, now: datetime.datetime, overrides: dict | None = None):
+        if run_date is None or run_date <= now:
+            # a run that is already due stays with the stored job, it is handled as a misfire,
+            # a run still ahead was planned for a definition that has changed since
+            job = self.get_job(job_id)
+            if job is not None and job.next_run_time is not None and job.next_run_time > now:
+                self.remove_job(job_id)
+            if run_date is None:
+                self.__logger.warning(f'no {args[0]} event today, {job_id} is skipped')
+            return
+        self.__restore_or_add_job(job_id, HomeKeeperScheduler.JOB_CLASS_TIMING, timing_event_job, DateTrigger(run_date), args=args, overrides=overrides)
+
+    def __plan_solar_schedules(self, solar_table: SolarTable, today: datetime.date, now: datetime.datetime):
+        for job_id, args, solar_event, offset, overrides in self.__solar_schedules:
+            self.__add_solar_job(job_id, args, solar_table.get_event_time(today, solar_event, datetime.timedelta(minutes=offset)), now, overrides)
+
+    def register_daily_solar_events(self):
+        """
+        Description
+        -----------
+        Plans today's solar events that are still ahead from the solar table. Runs on start
+        and from a daily cron job, so a failed or missed run only affects its own day.
+        """
+        now = datetime.datetime.now().astimezone()
+        today = now.date()
+        solar_table = self.__get_solar_table(today)
+        config = self.__config.get_config()
+
+        self.__add_solar_job('solar:sunrise', (DailyEvent.SUNRISE.value, None, None),
+                             solar_table.get_event_time(today, SolarEvent.SUNRISE, datetime.timedelta(minutes=config.sunrise_offset)), now)
+        self.__add_solar_job('solar:sunset', (DailyEvent.SUNSET.value, None, None),
+                             solar_table.get_event_time(today, SolarEvent.SUNSET, datetime.timedelta(minutes=config.sunset_offset)), now)
+        with self.__schedules_lock:
+            self.__plan_solar_schedules(solar_table, today, now)
+
+    def register_timing_events(self):
+        # events earlier than the registration time (e.g. sunrise with a negative offset) are dropped for that day
+        self.__restore_or_add_job('solar:daily', HomeKeeperScheduler.JOB_CLASS_DAILY, daily_solar_events_job, CronTrigger(hour=0, minute=1, timezone=self.timezone))
+        self.register_daily_solar_events()
+
+    def apply_config(self, config):
+        """
+        Description
+        -----------
+        Configuration reload listener: re-plans today's solar events with the new coordinates
+        and offsets, and the status poll with its new interval.
+        """
+        self.__logger.info('configuration changed, re-planning solar events and the status poll')
+        self.register_daily_solar_events()
+        self.register_device_ping_events()
+
+    def poll_devices_stat(self):
+        self.__mqtt_publisher.get_devices_stat()
 
     def register_device_ping_events(self, timebase: datetime.datetime | None = None):
         if timebase is None:
             timebase = datetime.datetime.now()
         stats_run_time = timebase + datetime.timedelta(minutes=1)
-        self.add_job(self.__mqtt_publisher.get_devices_stat, 'interval', minutes=20, start_date=stats_run_time)
+        self.__restore_or_add_job('status_poll', HomeKeeperScheduler.JOB_CLASS_STATUS_POLL, devices_stat_job,
+                                  IntervalTrigger(seconds=Env.get_status_poll_interval(), start_date=stats_run_time, timezone=self.timezone))
+
+    def __is_valid_policy(self, overrides: dict) -> bool:
+        misfire_grace_time = overrides.get("misfire_grace_time")
+        max_instances = overrides.get("max_instances", 1)
+        return (misfire_grace_time is None or (isinstance(misfire_grace_time, int) and misfire_grace_time > 0)) \
+            and isinstance(overrides.get("coalesce", True), bool) \
+            and isinstance(max_instances, int) and max_instances > 0
 
-    def register_stored_jobs(self):
+    def __read_schedules(self):
+        """
+        Returns
+        -------
+        tuple
+            Triggers of the cron schedules (job id -> (job args, trigger, policy overrides)),
+            the solar schedules [(job id, job args, solar event, offset minutes, policy overrides)]
+            and the errors of the invalid ones (job id -> error). The job args are the event
+            type and the device scope of the schedule: "devices" (names) and "group".
+        """
+        cron_schedules = {}
+        solar_schedules = []
+        errors = {}
         with MongoDbAccess() as mongo_db_access:
             cursor = mongo_db_access.get_timings()
             if cursor is None:
                 self.__logger.fatal("error to get mongo collection")
+                return cron_schedules, solar_schedules, errors
 
             for schedule in cursor:
-                schedule_type = schedule["type"]
+                job_id = f'schedule:{schedule["_id"]}'
+                schedule_type = schedule.get("type")
                 if schedule_type not in DailyEvent._value2member_map_:
-                    self.__logger.error(f'invalid event type: {schedule_type}')
+                    errors[job_id] = f'invalid event type: {schedule_type}'
+                    continue
+                devices = schedule.get("devices")
+                group = schedule.get("group")
+                if (devices is not None and not isinstance(devices, list)) or (group is not None and not isinstance(group, str)):
+                    errors[job_id] = f'invalid device scope: {devices}, {group}'
                     continue
-                daily_event = DailyEvent(schedule_type)
-                # affected_devices = schedule["devices"]
+                args = (schedule_type, devices, group)
+                overrides = {name: schedule[name] for name in HomeKeeperScheduler.SCHEDULE_POLICY_FIELDS if name in schedule}
+                if not self.__is_valid_policy(overrides):
+                    errors[job_id] = f'invalid job policy: {overrides}'
+                    continue
+
+                # {"solar_event": "civil_dusk", "offset": -30} instead of hour/minute follows the solar table
+                solar_event = schedule.get("solar_event")
+                if solar_event is not None:
+                    if solar_event not in SolarEvent._value2member_map_:
+                        errors[job_id] = f'invalid solar event: {solar_event}'
+                        continue
+                    offset = schedule.get("offset", 0)
+                    if isinstance(offset, bool) or not isinstance(offset, (int, float)):
+                        errors[job_id] = f'invalid solar event offset: {offset}'
+                        continue
+                    solar_schedules.append((job_id, args, SolarEvent(solar_event), offset, overrides))
+                    continue
+
+                try:
+                    trigger = CronTrigger(hour=schedule["hour"], minute=schedule["minute"], timezone=self.timezone)
+                except (KeyError, ValueError, TypeError) as e:
+                    errors[job_id] = f'invalid time: {e}'
+                    continue
+                cron_schedules[job_id] = (args, trigger, overrides)
+        return cron_schedules, solar_schedules, errors
+
+    def reload_schedules(self):
+        """
+        Description
+        -----------
+        Reconciles the schedule:<_id> jobs with the schedules collection: jobs of changed
+        schedules are replaced, of deleted ones removed, unchanged jobs keep their state.
+        The collection is read in full before any job is touched, so a failed read
+        leaves the jobs as they are.
+        """
+        cron_schedules, solar_schedules, errors = self.__read_schedules()
+
+        now = datetime.datetime.now().astimezone()
+        with self.__schedules_lock:
+            jobs = {job.id: job for job in self.get_jobs()}
+            changed = [job_id for job_id, (args, trigger, overrides) in cron_schedules.items()
+                       if self.__restore_or_add_job(job_id, HomeKeeperScheduler.JOB_CLASS_TIMING, timing_event_job, trigger, args=args, jobs=jobs, overrides=overrides)]
+            # a schedule that moved from a fixed time to a solar event drops its cron job
+            for job_id, _, _, _, _ in solar_schedules:
+                job = jobs.get(job_id)
+                if job is not None and not isinstance(job.trigger, DateTrigger):
+                    self.remove_job(job_id)
+                    changed.append(job_id)
+            removed = self.__remove_jobs('schedule:', set(cron_schedules) | {job_id for job_id, _, _, _, _ in solar_schedules}, jobs)
+
+            self.__solar_schedules = solar_schedules
+            self.__plan_solar_schedules(self.__get_solar_table(now.date()), now.date(), now)
+
+            # the collection is polled, an invalid schedule is reported when it becomes invalid
+            new_errors = {job_id: error for job_id, error in errors.items() if self.__schedule_errors.get(job_id) != error}
+            self.__schedule_errors = errors
+
+        for job_id, error in new_errors.items():
+            self.__logger.error(f'{job_id} is skipped, {error}')
+
+        if len(changed) > 0 or len(removed) > 0:
+            self.__logger.info(f'schedules reloaded, changed: {changed}, removed: {removed}')
+
+    def __is_change_stream_supported(self):
+        try:
+            with MongoDbAccess() as mongo_db_access:
+                with mongo_db_access.watch_schedules(max_await_time_ms=1):
+                    pass
+            return True
+        except pymongo.errors.OperationFailure as e:
+            self.__logger.info(f"change streams are not available ({e}), polling the schedules")
+            return False
+
+    def __watch_schedules(self):
+        resume_token = None
+        while not self.__stop_event.is_set():
+            try:
+                with MongoDbAccess() as mongo_db_access:
+                    with mongo_db_access.watch_schedules(resume_after=resume_token, max_await_time_ms=HomeKeeperScheduler.SCHEDULES_WATCH_MAX_AWAIT_MS) as stream:
+                        # changes between the last reload and the stream start are not in the stream
+                        is_reload_pending = resume_token is None
+                        while stream.alive and not self.__stop_event.is_set():
+                            change = stream.try_next()
+                            resume_token = stream.resume_token
+                            if change is None:
+                                # a burst of changes is applied with one reload once the stream is idle
+                                if is_reload_pending:
+                                    self.reload_schedules()
+                                    is_reload_pending = False
+                                continue
+                            is_reload_pending = True
+                            if change["operationType"] in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                                self.__logger.info(f"schedules change stream invalidated ({change['operationType']}), reloading")
+                                resume_token = None
+                                break
+            except pymongo.errors.PyMongoError as e:
+                self.__logger.error(f"schedules change stream failed: {e}")
+                resume_token = None
+                self.__stop_event.wait(HomeKeeperScheduler.SCHEDULES_WATCH_RETRY_DELAY)
+
+    def __poll_schedules(self):
+        interval = Env.get_schedules_poll_interval()
+        while not self.__stop_event.wait(interval):
+            try:
+                self.reload_schedules()
+            except pymongo.errors.PyMongoError as e:
+                self.__logger.error(f"schedules reload failed: {e}")
+
+    def watch_schedules(self):
+        target = self.__watch_schedules if self.__is_change_stream_supported() else self.__poll_schedules
+        self.__stop_event.clear()
+        self.__watch_thread = threading.Thread(target=target, daemon=True)
+        self.__watch_thread.start()
+
+    def rollup_sensor_history(self, tier_name: str):
+        try:
+            with MongoDbAccess() as mongo_db_access:
+                start, end = mongo_db_access.rollup_sensor_history(tier_name)
+            self.__logger.info(f'sensor history rolled up to {tier_name} tier for {start} - {end}')
+        except pymongo.errors.PyMongoError as e:
+            self.__logger.error(f'sensor history {tier_name} rollup failed: {e}')
+
+    def register_sensor_history_rollups(self):
+        self.__restore_or_add_job('rollup:minute', HomeKeeperScheduler.JOB_CLASS_ROLLUP, sensor_history_rollup_job, CronTrigger(second=15, timezone=self.timezone), args=('minute',))
+        self.__restore_or_add_job('rollup:hour', HomeKeeperScheduler.JOB_CLASS_ROLLUP, sensor_history_rollup_job, CronTrigger(minute=2, timezone=self.timezone), args=('hour',))
+        self.__restore_or_add_job('rollup:day', HomeKeeperScheduler.JOB_CLASS_ROLLUP, sensor_history_rollup_job, CronTrigger(hour=0, minute=5, timezone=self.timezone), args=('day',))
 
-                self.add_cron_job(self.__timing_event_fn, schedule["hour"], schedule["minute"], args=(daily_event, None))
+    def get_job_stats(self):
+        """
+        Returns
+        -------
+        dict
+            Run stats per job id with the executor and max instances of the job, interval
+            jobs also report the share of their interval taken by an average run.
+        """
+        stats = self.__job_stats.get_stats()
+        for job in self.get_jobs():
+            job_stats = stats.setdefault(job.id, {"runs": 0})
+            job_stats["executor"] = job.executor
+            job_stats["max_instances"] = job.max_instances
+            job_stats["next_run"] = job.next_run_time
+            if isinstance(job.trigger, IntervalTrigger) and job_stats.get("avg_duration_ms") is not None:
+                job_stats["interval_usage"] = round(job_stats["avg_duration_ms"] / 1000 / job.trigger.interval_length, 4)
+        return stats
 
-    def register_mobile_ping_job(self):
-        interval = Env.get_mobile_device_ping_interval()
+    def log_job_stats(self):
+        self.__logger.info(f'scheduler job stats: {self.get_job_stats()}')
+        # the MQTT pools only log from their own loops, which stay quiet while idle
+        self.__logger.info(f'mqtt worker pool stats: {self.__mqtt_publisher.get_worker_stats()}')
+        self.__logger.info(f'mqtt command stats: {self.__mqtt_publisher.get_command_stats()}')
 
-        self.add_job(self.__netwatcher.ping_mobile_devices, 'interval', seconds=interval)
+    def register_stats_events(self):
+        self.__restore_or_add_job('stats:log', HomeKeeperScheduler.JOB_CLASS_STATS, job_stats_log_job,
+                                  IntervalTrigger(seconds=HomeKeeperScheduler.STATS_LOG_INTERVAL, timezone=self.timezone))
 
     def register_all_jobs(self):
+        self.reload_schedules()
         self.register_timing_events()
         self.register_device_ping_events()
-        self.register_stored_jobs()
-        self.register_mobile_ping_job()
\ No newline at end of file
+        self.register_sensor_history_rollups()
+        self.register_stats_events()
+        self.resume()
+        self.watch_schedules()
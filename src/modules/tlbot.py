@@ -1,9 +1,14 @@
+import asyncio
 import json
+import datetime
+import pymongo.errors
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, Update, Bot
 from telegram.ext import Application, CommandHandler, ContextTypes, ConversationHandler, MessageHandler, filters, CallbackContext, CallbackQueryHandler
 import validators
 import logging
 from helpers.dbaccess import MongoDbAccess
+from helpers.deviceregistry import DeviceRegistry
+from helpers.asyncdbaccess import AsyncMongoDbAccess
 import helpers.topics
 import random
 from helpers.env import Env
@@ -16,11 +21,13 @@ class TlBot(TelegramMessageSenderInterface):
     POWER_STATE_AFTER_SELECT = 2
     STATS_AFTER_DEVICE_SELECT = 3
 
-    def __init__(self, publisher: MqttPublisherInterface, device_manager: DeviceManagerInterface, logger: logging.Logger):
+    def __init__(self, publisher: MqttPublisherInterface, device_manager: DeviceManagerInterface, registry: DeviceRegistry, data_access: AsyncMongoDbAccess, logger: logging.Logger):
         self.__token = Env.get_tl_token()
         self.__chat_id = Env.get_tl_chat_id()
         self.__publisher = publisher
         self.__device_manager = device_manager
+        self.__registry = registry
+        self.__data_access = data_access
         self.__logger = logger
 
     async def __video_download_start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -35,13 +42,13 @@ class TlBot(TelegramMessageSenderInterface):
             self.__logger.error("url %s is invalid\n", url)
             await update.message.reply_text("Invalid url, try again")
             return self.YOUTUBE_DOWNLOAD
-        self.__publisher.publish(topic=helpers.topics.VIDEO_DOWNLOAD, payload=url, qos=2)
+        self.__publisher.publish_message(topic=helpers.topics.VIDEO_DOWNLOAD, payload=url, message_class=helpers.topics.MESSAGE_CLASS_REQUEST)
         await update.message.reply_text("Video download queued")
         return ConversationHandler.END
 
     async def __get_ip_address(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         self.__logger.info("got ip address determination request")
-        self.__publisher.publish(topic=helpers.topics.GET_IP_ADDRESS, payload=None, qos=2)
+        self.__publisher.publish_message(topic=helpers.topics.GET_IP_ADDRESS, payload=None, message_class=helpers.topics.MESSAGE_CLASS_REQUEST)
         await update.message.reply_text("Getting IP address...")
         return ConversationHandler.END
     
@@ -51,15 +58,13 @@ class TlBot(TelegramMessageSenderInterface):
         if len(args) == 2:
             device_name = args[0]
             state = True if args[1].lower() == 'on' else False
-            self.__device_manager.device_direct_command_handler(device_name, state)
+            await self.__data_access.run(self.__device_manager.device_direct_command_handler, device_name, state)
             await update.message.reply_text(f"Device {device_name} set to {state}")
             return ConversationHandler.END
         
         keyboard = [[]]
-        with MongoDbAccess() as mongo_client:
-            for device in mongo_client.get_devices_names():
-                device_name = device[mongo_client.DEVICE_NAME_FIELD]
-                keyboard[0].append(InlineKeyboardButton(device_name, callback_data=device_name))
+        for device_name in self.__registry.get_devices_names():
+            keyboard[0].append(InlineKeyboardButton(device_name, callback_data=device_name))
 
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(
@@ -78,12 +83,11 @@ class TlBot(TelegramMessageSenderInterface):
         json_data_off = json.dumps({"device_name": device_name, "state": False})
         json_data_no_forced = json.dumps({"device_name": device_name, "forced": False})
 
-        with MongoDbAccess() as mongo_client:
-            stored_device = mongo_client.get_device_by_name(device_name)
-            if MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD in stored_device:
-                is_device_state_forced = stored_device[MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD]
-            else:
-                is_device_state_forced = False
+        stored_device = await self.__data_access.run(self.__registry.get_device, device_name)
+        if MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD in stored_device:
+            is_device_state_forced = stored_device[MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD]
+        else:
+            is_device_state_forced = False
 
         keyboard = [
             [
@@ -114,12 +118,11 @@ class TlBot(TelegramMessageSenderInterface):
         data = json.loads(json_data)
         device_name = data['device_name']
         if 'forced' in data:
-            with MongoDbAccess() as mongo_client:
-                mongo_client.update_device_forced_state(device_name=device_name, is_forced=data['forced'])
+            await self.__data_access.run(self.__registry.update_device_forced_state, device_name=device_name, is_forced=data['forced'])
             await query.edit_message_text(f"Device {device_name} removed from forced state")
         else:
             state = data['state']
-            self.__device_manager.device_direct_command_handler(device_name=device_name, state=state)
+            await self.__data_access.run(self.__device_manager.device_direct_command_handler, device_name=device_name, state=state)
             await query.edit_message_text(f"Device {device_name} set to {state}")
 
         return ConversationHandler.END
@@ -128,10 +131,8 @@ class TlBot(TelegramMessageSenderInterface):
         self.__logger.info('got device stats select request')
 
         keyboard = [[]]
-        with MongoDbAccess() as mongo_client:
-            for device in mongo_client.get_devices_names():
-                device_name = device[mongo_client.DEVICE_NAME_FIELD]
-                keyboard[0].append(InlineKeyboardButton(device_name, callback_data=device_name))
+        for device_name in self.__registry.get_devices_names():
+            keyboard[0].append(InlineKeyboardButton(device_name, callback_data=device_name))
 
         reply_markup = InlineKeyboardMarkup(keyboard)
         await update.message.reply_text(
@@ -148,8 +149,7 @@ class TlBot(TelegramMessageSenderInterface):
 
         device_name = query.data
 
-        with MongoDbAccess() as mongo_client:
-            stored_device = mongo_client.get_device_by_name(device_name)
+        stored_device = await self.__data_access.run(self.__registry.get_device, device_name)
 
         reply_text = 'Device stats:\n'
         if MongoDbAccess.DEVICE_NAME_FIELD in stored_device:
@@ -175,6 +175,16 @@ class TlBot(TelegramMessageSenderInterface):
         if MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD in stored_device:
             reply_text += f'🔋 Device total energy: {stored_device[MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD]}\n'
 
+        history_end = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            _, history = await self.__data_access.get_sensor_history(device_name, history_end - datetime.timedelta(days=1), history_end)
+        except (asyncio.TimeoutError, pymongo.errors.PyMongoError) as e:
+            self.__logger.error(f'failed to read the sensor history of {device_name}: {e}')
+            history = []
+        if len(history) > 0:
+            energy_consumed = sum(bucket.get(MongoDbAccess.HISTORY_ENERGY_DELTA_FIELD, 0) for bucket in history)
+            reply_text += f'📈 Energy consumed in 24h: {round(energy_consumed, 3)}\n'
+
         await query.edit_message_text(reply_text)
         return ConversationHandler.END
 
@@ -0,0 +1,95 @@
+import logging
+import pytest
+from helpers import commandtracker
+from helpers.commandtracker import CommandAckTracker
+
+logger = logging.getLogger('test_commandtracker')
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr(commandtracker, 'time', fake_clock)
+    return fake_clock
+
+@pytest.fixture
+def tracker(monkeypatch, clock):
+    monkeypatch.setenv('COMMAND_ACK_TIMEOUT', '1')
+    monkeypatch.setenv('COMMAND_RETRIES', '2')
+    published = []
+    tracker = CommandAckTracker(published.append, lambda state: 'ON' if state else 'OFF', logger)
+    tracker.published = published
+    return tracker
+
+def process_timeouts(tracker: CommandAckTracker, now: float):
+    # the tracker thread is not started, timeouts are processed at the given moments
+    return tracker._CommandAckTracker__process_timeouts(now)
+
+def test_retries_back_off_exponentially_with_the_state_command(tracker, clock):
+    tracker.send('desk_light', 'toggle', True)
+    assert tracker.published == [[('desk_light', 'toggle')]]
+
+    # deadlines: 1 s after the first attempt, then 2 s, then 4 s
+    assert process_timeouts(tracker, 100.99) == []
+    assert len(tracker.published) == 1
+    clock.now = 101.0
+    assert process_timeouts(tracker, clock.now) == []
+    assert tracker.published[-1] == [('desk_light', 'ON')]
+
+    assert process_timeouts(tracker, 102.99) == []
+    assert len(tracker.published) == 2
+    clock.now = 103.0
+    assert process_timeouts(tracker, clock.now) == []
+    assert tracker.published[-1] == [('desk_light', 'ON')]
+
+    assert process_timeouts(tracker, 106.99) == []
+    timed_out = process_timeouts(tracker, 107.0)
+    assert [command.device_name for command in timed_out] == ['desk_light']
+    assert timed_out[0].attempts == 3
+    assert not tracker.has_pending('desk_light')
+    assert len(tracker.published) == 3
+    assert tracker.get_stats()['desk_light']['retried'] == 2
+    assert tracker.get_stats()['desk_light']['timed_out'] == 1
+
+def test_retry_without_expected_state_repeats_the_command(tracker, clock):
+    tracker.send('kettle', 'toggle')
+    clock.now = 101.0
+    process_timeouts(tracker, clock.now)
+    assert tracker.published[-1] == [('kettle', 'toggle')]
+
+def test_due_retries_are_published_as_one_batch(tracker, clock):
+    tracker.send_many([('desk_light', 'ON', True, None), ('floor_heating', 'OFF', False, None)])
+    assert tracker.published == [[('desk_light', 'ON'), ('floor_heating', 'OFF')]]
+    clock.now = 101.0
+    process_timeouts(tracker, clock.now)
+    assert tracker.published[-1] == [('desk_light', 'ON'), ('floor_heating', 'OFF')]
+
+def test_result_with_the_expected_state_acknowledges(tracker, clock):
+    acks = []
+    tracker.send('desk_light', 'ON', True, acks.append)
+    tracker.handle_result('desk_light', False)
+    assert acks == []
+    assert tracker.has_pending('desk_light')
+
+    clock.now = 100.2
+    tracker.handle_result('desk_light', True)
+    assert acks == [True]
+    assert not tracker.has_pending('desk_light')
+    stats = tracker.get_stats()['desk_light']
+    assert stats['acked'] == 1
+    assert stats['avg_latency_ms'] == pytest.approx(200)
+
+def test_newer_command_supersedes_the_pending_one(tracker):
+    acks = []
+    tracker.send('desk_light', 'ON', True, lambda is_acked: acks.append(('first', is_acked)))
+    tracker.send('desk_light', 'OFF', False, lambda is_acked: acks.append(('second', is_acked)))
+    assert acks == [('first', False)]
+    tracker.handle_result('desk_light', False)
+    assert acks == [('first', False), ('second', True)]
+    assert tracker.get_stats()['desk_light']['superseded'] == 1
@@ -0,0 +1,152 @@
+import datetime
+import itertools
+import logging
+import pytest
+from helpers import devicerules
+from helpers.dbaccess import DeviceType, MongoDbAccess
+from helpers.devicerules import DEFAULT_RULES, DeviceRuleEngine, compile_rule
+
+logger = logging.getLogger('test_devicerules')
+
+class RulesMongoDbAccess(MongoDbAccess):
+    # serves the device rules collection from memory
+    documents = []
+
+    def __init__(self) -> None:
+        pass
+
+    def get_device_rules(self):
+        return list(RulesMongoDbAccess.documents)
+
+@pytest.fixture
+def engine(monkeypatch):
+    RulesMongoDbAccess.documents = []
+    monkeypatch.setattr(devicerules, 'MongoDbAccess', RulesMongoDbAccess)
+    engine = DeviceRuleEngine(logger)
+    assert engine.reload()
+    return engine
+
+def get_device(device_type: DeviceType, power_on: bool, **fields):
+    device = {
+        MongoDbAccess.DEVICE_NAME_FIELD: device_type.value,
+        MongoDbAccess.DEVICE_TYPE_FIELD: device_type.value,
+        MongoDbAccess.DEVICE_POWER_ON_FIELD: power_on,
+        MongoDbAccess.DEVICE_IS_DEVICE_SLEEP: False
+    }
+    device.update(fields)
+    return device
+
+# the checks of the validators the rules replaced
+def get_validator_state(device):
+    if device[MongoDbAccess.DEVICE_TYPE_FIELD] == DeviceType.DESK_LIGHT.value:
+        state = device[MongoDbAccess.DEVICE_IS_DARK_FIELD]
+    else:
+        temperature = device[MongoDbAccess.DEVICE_TEMPERATURE_FIELD]
+        if temperature < 25:
+            state = True
+        elif temperature > 25 and temperature < 38:
+            state = device[MongoDbAccess.DEVICE_POWER_ON_FIELD]
+        else:
+            state = False
+    if device[MongoDbAccess.DEVICE_IS_DEVICE_SLEEP]:
+        state = False
+    return state
+
+def is_toggle_allowed_by_validator(device, forced: bool):
+    switch_interval = device.get(MongoDbAccess.DEVICE_SWITCH_INTERVAL_FIELD, 300)
+    last_switch = device.get(MongoDbAccess.DEVICE_LAST_SWITCH_FIELD, datetime.datetime.min)
+    if last_switch + datetime.timedelta(seconds=switch_interval) > datetime.datetime.now():
+        return False
+    is_power_forced = device.get(MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD, False)
+    if is_power_forced == forced:
+        return get_validator_state(device) != device[MongoDbAccess.DEVICE_POWER_ON_FIELD]
+    return forced
+
+@pytest.mark.parametrize('power_on, is_dark, sleep', list(itertools.product([False, True], repeat=3)))
+def test_desk_light_rule_matches_the_dark_validator(power_on, is_dark, sleep):
+    desired_state, min_switch_interval = compile_rule(DEFAULT_RULES[DeviceType.DESK_LIGHT.value])
+    device = get_device(DeviceType.DESK_LIGHT, power_on, **{MongoDbAccess.DEVICE_IS_DARK_FIELD: is_dark, MongoDbAccess.DEVICE_IS_DEVICE_SLEEP: sleep})
+    assert desired_state(device, None) == get_validator_state(device)
+    assert min_switch_interval == 300
+
+@pytest.mark.parametrize('power_on, sleep, temperature', list(itertools.product([False, True], [False, True], [-5, 24.9, 25, 25.1, 30, 37.9, 38, 45])))
+def test_floor_heating_rule_matches_the_cold_validator(power_on, sleep, temperature):
+    desired_state, _ = compile_rule(DEFAULT_RULES[DeviceType.FLOOR_HEATING.value])
+    device = get_device(DeviceType.FLOOR_HEATING, power_on, **{MongoDbAccess.DEVICE_TEMPERATURE_FIELD: temperature, MongoDbAccess.DEVICE_IS_DEVICE_SLEEP: sleep})
+    assert desired_state(device, None) == get_validator_state(device)
+
+def test_floor_heating_thresholds():
+    desired_state, _ = compile_rule(DEFAULT_RULES[DeviceType.FLOOR_HEATING.value])
+    def get_state(power_on, temperature):
+        return desired_state(get_device(DeviceType.FLOOR_HEATING, power_on, **{MongoDbAccess.DEVICE_TEMPERATURE_FIELD: temperature}), None)
+    assert get_state(False, 24) is True
+    # exactly 25 is neither cold nor in the keep range
+    assert get_state(True, 25) is False
+    assert get_state(True, 30) is True
+    assert get_state(False, 30) is False
+    assert get_state(True, 38) is False
+
+def test_missing_field_gives_no_state():
+    desired_state, _ = compile_rule(DEFAULT_RULES[DeviceType.FLOOR_HEATING.value])
+    assert desired_state(get_device(DeviceType.FLOOR_HEATING, False), None) is None
+
+@pytest.mark.parametrize('rule', [
+    {},
+    {"states": []},
+    {"states": [{"state": "maybe"}]},
+    {"states": [{"when": {"humidity_below": 40}, "state": True}]},
+    {"states": [{"when": {"dark": "yes"}, "state": True}]}
+])
+def test_invalid_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        compile_rule(rule)
+
+def test_presence_rule():
+    desired_state, min_switch_interval = compile_rule({"states": [{"when": {"sleep": True}, "state": False}, {"state": "present"}], "min_switch_interval": 60})
+    device = get_device(DeviceType.DESK_LIGHT, False)
+    assert desired_state(device, True) is True
+    assert desired_state(device, False) is False
+    assert min_switch_interval == 60
+
+@pytest.mark.parametrize('power_on, is_dark, sleep, is_power_forced, forced, last_switch_ago',
+                         list(itertools.product([False, True], [False, True], [False, True], [False, True], [False, True], [10, 3600])))
+def test_desk_light_toggle_matches_the_validators(engine, power_on, is_dark, sleep, is_power_forced, forced, last_switch_ago):
+    device = get_device(DeviceType.DESK_LIGHT, power_on, **{
+        MongoDbAccess.DEVICE_IS_DARK_FIELD: is_dark,
+        MongoDbAccess.DEVICE_IS_DEVICE_SLEEP: sleep,
+        MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD: is_power_forced,
+        MongoDbAccess.DEVICE_LAST_SWITCH_FIELD: datetime.datetime.now() - datetime.timedelta(seconds=last_switch_ago)
+    })
+    is_allowed, _ = engine.evaluate(device, forced=forced)
+    assert is_allowed == is_toggle_allowed_by_validator(device, forced)
+
+@pytest.mark.parametrize('power_on, temperature, is_power_forced, forced',
+                         list(itertools.product([False, True], [20, 25, 30, 38], [False, True], [False, True])))
+def test_floor_heating_toggle_matches_the_validators(engine, power_on, temperature, is_power_forced, forced):
+    device = get_device(DeviceType.FLOOR_HEATING, power_on, **{
+        MongoDbAccess.DEVICE_TEMPERATURE_FIELD: temperature,
+        MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD: is_power_forced
+    })
+    is_allowed, _ = engine.evaluate(device, forced=forced)
+    assert is_allowed == is_toggle_allowed_by_validator(device, forced)
+
+def test_forced_toggle_takes_the_device_over(engine):
+    device = get_device(DeviceType.DESK_LIGHT, False, **{MongoDbAccess.DEVICE_IS_DARK_FIELD: False})
+    assert engine.evaluate(device, state=True, forced=True, use_rules=False) == (True, True)
+    device[MongoDbAccess.DEVICE_IS_POWER_FORCED_FIELD] = True
+    assert engine.evaluate(device, forced=False) == (False, True)
+
+def test_device_rule_wins_over_the_type_rule(engine):
+    RulesMongoDbAccess.documents = [
+        {"_id": 1, MongoDbAccess.DEVICE_NAME_FIELD: "hall_light", "states": [{"state": "present"}], "min_switch_interval": 0},
+        {"_id": 2, "states": [{"state": True}]},
+        {"_id": 3, MongoDbAccess.DEVICE_TYPE_FIELD: DeviceType.FLOOR_HEATING.value, "states": [{"state": "unknown"}]}
+    ]
+    assert engine.reload()
+    hall_light = get_device(DeviceType.DESK_LIGHT, False, **{MongoDbAccess.DEVICE_NAME_FIELD: "hall_light", MongoDbAccess.DEVICE_IS_DARK_FIELD: False})
+    assert engine.evaluate(hall_light, present=True) == (True, False)
+    desk_light = get_device(DeviceType.DESK_LIGHT, False, **{MongoDbAccess.DEVICE_IS_DARK_FIELD: False})
+    assert engine.evaluate(desk_light, present=True) == (False, False)
+    # the invalid floor heating rule is skipped, the default one stays
+    floor_heating = get_device(DeviceType.FLOOR_HEATING, False, **{MongoDbAccess.DEVICE_TEMPERATURE_FIELD: 20})
+    assert engine.evaluate(floor_heating) == (True, False)
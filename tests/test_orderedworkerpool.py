@@ -0,0 +1,86 @@
+import logging
+import threading
+import pytest
+from helpers.orderedworkerpool import OrderedWorkerPool
+
+logger = logging.getLogger('test_orderedworkerpool')
+
+def test_unknown_overflow_policy():
+    with pytest.raises(ValueError):
+        OrderedWorkerPool('test', 1, 1, 'drop_all', logger)
+
+def test_tasks_of_a_key_run_in_submission_order():
+    executed = {}
+    lock = threading.Lock()
+
+    def record(key, index):
+        with lock:
+            executed.setdefault(key, []).append(index)
+
+    with OrderedWorkerPool('test', 4, 4000, OrderedWorkerPool.OVERFLOW_BLOCK, logger) as pool:
+        for index in range(200):
+            for key in ['desk_light', 'floor_heating', 'kettle', 'boiler', 'fan']:
+                assert pool.submit(key, record, key, index)
+
+    assert executed == {key: list(range(200)) for key in ['desk_light', 'floor_heating', 'kettle', 'boiler', 'fan']}
+    assert pool.get_stats()["processed"] == 1000
+
+def test_failed_task_does_not_stop_the_worker():
+    executed = []
+
+    def fail():
+        raise RuntimeError('handler failure')
+
+    with OrderedWorkerPool('test', 1, 10, OrderedWorkerPool.OVERFLOW_BLOCK, logger) as pool:
+        pool.submit('device', fail)
+        pool.submit('device', executed.append, 'next')
+
+    assert executed == ['next']
+    assert pool.get_stats()["failed"] == 1
+
+def test_drop_newest_rejects_the_submitted_task():
+    executed = []
+    pool = OrderedWorkerPool('test', 1, 2, OrderedWorkerPool.OVERFLOW_DROP_NEWEST, logger)
+    assert pool.submit('device', executed.append, 1)
+    assert pool.submit('device', executed.append, 2)
+    assert not pool.submit('device', executed.append, 3)
+    pool.start()
+    pool.stop()
+    assert executed == [1, 2]
+    assert pool.get_stats()["dropped"] == 1
+
+def test_drop_oldest_evicts_the_oldest_queued_task():
+    executed = []
+    pool = OrderedWorkerPool('test', 1, 2, OrderedWorkerPool.OVERFLOW_DROP_OLDEST, logger)
+    for index in range(1, 5):
+        assert pool.submit('device', executed.append, index)
+    pool.start()
+    pool.stop()
+    assert executed == [3, 4]
+    assert pool.get_stats()["dropped"] == 2
+
+def test_drop_oldest_never_evicts_the_stop_sentinel():
+    executed = []
+    pool = OrderedWorkerPool('test', 1, 1, OrderedWorkerPool.OVERFLOW_DROP_OLDEST, logger)
+    pool.stop()
+    assert not pool.submit('device', executed.append, 1)
+    pool.start()
+    pool.stop()
+    assert executed == []
+
+def test_block_waits_for_room():
+    executed = []
+    pool = OrderedWorkerPool('test', 1, 2, OrderedWorkerPool.OVERFLOW_BLOCK, logger)
+    pool.submit('device', executed.append, 1)
+    pool.submit('device', executed.append, 2)
+    submitter = threading.Thread(target=pool.submit, args=('device', executed.append, 3))
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive()
+
+    pool.start()
+    submitter.join(5)
+    assert not submitter.is_alive()
+    pool.stop()
+    assert executed == [1, 2, 3]
+    assert pool.get_stats()["dropped"] == 0
@@ -0,0 +1,77 @@
+import datetime
+import pytest
+from helpers.dbaccess import MongoDbAccess
+from helpers.solartable import SolarEvent, SolarTable, compute_solar_events
+
+LONDON = (51.5074, -0.1278)
+NEW_YORK = (40.7128, -74.006)
+LONGYEARBYEN = (78.22, 15.65)
+
+def utc(*args):
+    return datetime.datetime(*args, tzinfo=datetime.timezone.utc)
+
+def assert_close(moment: datetime.datetime, expected: datetime.datetime, tolerance_minutes: float = 2):
+    assert abs(moment - expected) <= datetime.timedelta(minutes=tolerance_minutes)
+
+@pytest.mark.parametrize('day, sunrise, sunset', [
+    # published times, 04:43 / 21:21 BST at the summer solstice, 08:04 / 15:53 GMT at the winter one
+    (datetime.date(2024, 6, 21), utc(2024, 6, 21, 3, 43), utc(2024, 6, 21, 20, 21)),
+    (datetime.date(2024, 12, 21), utc(2024, 12, 21, 8, 4), utc(2024, 12, 21, 15, 53))
+])
+def test_london_sunrise_and_sunset(day, sunrise, sunset):
+    events = compute_solar_events(*LONDON, [day])[0]
+    assert_close(events[SolarEvent.SUNRISE], sunrise)
+    assert_close(events[SolarEvent.SUNSET], sunset)
+    assert events[SolarEvent.NAUTICAL_DAWN] < events[SolarEvent.CIVIL_DAWN] < events[SolarEvent.SUNRISE]
+    assert events[SolarEvent.SUNSET] < events[SolarEvent.CIVIL_DUSK] < events[SolarEvent.NAUTICAL_DUSK]
+
+def test_sunset_after_utc_midnight():
+    # 20:31 EDT is on the next UTC day
+    events = compute_solar_events(*NEW_YORK, [datetime.date(2024, 6, 20)])[0]
+    assert_close(events[SolarEvent.SUNRISE], utc(2024, 6, 20, 9, 25))
+    assert_close(events[SolarEvent.SUNSET], utc(2024, 6, 21, 0, 31))
+
+def test_polar_day_and_night():
+    polar_day, polar_night = compute_solar_events(*LONGYEARBYEN, [datetime.date(2024, 6, 21), datetime.date(2024, 12, 21)])
+    assert all(moment is None for moment in polar_day.values())
+    assert polar_night[SolarEvent.SUNRISE] is None
+    assert polar_night[SolarEvent.CIVIL_DUSK] is None
+    # the sun still climbs above the nautical twilight zenith at noon
+    assert polar_night[SolarEvent.NAUTICAL_DAWN] < polar_night[SolarEvent.NAUTICAL_DUSK]
+
+def test_table_covers_its_year_and_location():
+    table = SolarTable.compute(*LONDON, 2024)
+    assert len(table.to_documents()) == 366
+    assert table.covers(*LONDON, datetime.date(2024, 3, 1))
+    assert not table.covers(*LONDON, datetime.date(2025, 3, 1))
+    assert not table.covers(*NEW_YORK, datetime.date(2024, 3, 1))
+
+def test_event_time_is_local_and_shifted_by_the_offset():
+    table = SolarTable.compute(*LONDON, 2024)
+    day = datetime.date(2024, 6, 21)
+    sunrise = compute_solar_events(*LONDON, [day])[0][SolarEvent.SUNRISE]
+    moment = table.get_event_time(day, SolarEvent.SUNRISE, datetime.timedelta(minutes=-30))
+    assert moment.tzinfo is not None
+    assert moment == sunrise - datetime.timedelta(minutes=30)
+
+def test_documents_round_trip():
+    table = SolarTable.compute(*LONGYEARBYEN, 2023)
+    documents = table.to_documents()
+    for document in documents:
+        assert document[MongoDbAccess.SOLAR_TABLE_LATITUDE_FIELD] == LONGYEARBYEN[0]
+        assert document[MongoDbAccess.SOLAR_TABLE_LONGITUDE_FIELD] == LONGYEARBYEN[1]
+        # mongo returns naive UTC datetimes
+        for event in SolarEvent:
+            if document[event.value] is not None:
+                document[event.value] = document[event.value].replace(tzinfo=None)
+
+    restored = SolarTable.from_documents(*LONGYEARBYEN, 2023, documents)
+    for offset in range(365):
+        day = datetime.date(2023, 1, 1) + datetime.timedelta(days=offset)
+        for event in SolarEvent:
+            assert restored.get_event_time(day, event) == table.get_event_time(day, event)
+
+def test_incomplete_documents_are_rejected():
+    documents = SolarTable.compute(*LONDON, 2024).to_documents()
+    assert SolarTable.from_documents(*LONDON, 2024, documents[:-1]) is None
+    assert SolarTable.from_documents(*LONDON, 2025, documents) is None
@@ -0,0 +1,76 @@
+import pytest
+from helpers.dbaccess import MongoDbAccess
+from helpers.tasmotapayload import SENSOR_SPEC, compile_sensor_spec, decode_result_payload, decode_sensor_payload
+
+def test_energy_and_analog_temperature():
+    record = decode_sensor_payload(b'{"Time":"2024-01-01T12:00:00","ENERGY":{"Total":12.345,"Power":87,"Voltage":229,"Current":0.415},'
+                                   b'"ANALOG":{"Temperature":24.7},"TempUnit":"C"}')
+    assert record.to_fields() == {
+        MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD: 12.345,
+        MongoDbAccess.DEVICE_POWER_FIELD: 87.0,
+        MongoDbAccess.DEVICE_VOLTAGE_FIELD: 229.0,
+        MongoDbAccess.DEVICE_CURRENT_FIELD: 0.415,
+        MongoDbAccess.DEVICE_TEMPERATURE_FIELD: 24.7
+    }
+    assert type(record.power) is float
+    assert record.temperature == 24.7
+
+def test_temperature_falls_back_to_the_alias_section():
+    record = decode_sensor_payload(b'{"DS18B20":{"Id":"0316A2794F50","Temperature":21.5}}')
+    assert record.to_fields() == {MongoDbAccess.DEVICE_TEMPERATURE_FIELD: 21.5}
+    assert record.energy_total is None
+
+def test_first_alias_wins():
+    record = decode_sensor_payload(b'{"ANALOG":{"Temperature":24.7},"DS18B20":{"Temperature":21.5}}')
+    assert record.temperature == 24.7
+
+def test_malformed_first_alias_falls_back_to_the_next():
+    record = decode_sensor_payload(b'{"ANALOG":{"Temperature":"n/a"},"DS18B20":{"Temperature":21.5}}')
+    assert record.temperature == 21.5
+
+def test_multi_channel_values():
+    record = decode_sensor_payload(b'{"ENERGY":{"Total":[1.5,2.5],"Power":[10,20,30],"Voltage":[230,231],"Current":[0.1,0.2]}}')
+    assert record.energy_total == 4.0
+    assert record.power == 60.0
+    # channels share the voltage, the first one is taken
+    assert record.voltage == 230.0
+    assert record.current == pytest.approx(0.3)
+
+def test_empty_voltage_list_is_skipped():
+    record = decode_sensor_payload(b'{"ENERGY":{"Total":1,"Voltage":[]}}')
+    assert record.to_fields() == {MongoDbAccess.DEVICE_TOTAL_ENERGY_FIELD: 1.0}
+
+def test_unknown_or_non_object_payloads():
+    assert decode_sensor_payload(b'{"Time":"2024-01-01T12:00:00"}') is None
+    assert decode_sensor_payload(b'{"ENERGY":"off"}') is None
+    assert decode_sensor_payload(b'[1,2]') is None
+    assert decode_sensor_payload(b'42') is None
+
+@pytest.mark.parametrize('payload', [b'', b'{"ENERGY":', b'not json', b'\xff\xfe'])
+def test_malformed_json_raises_value_error(payload):
+    with pytest.raises(ValueError):
+        decode_sensor_payload(payload)
+    with pytest.raises(ValueError):
+        decode_result_payload(payload)
+
+def test_single_relay_result():
+    record = decode_result_payload(b'{"POWER":"ON"}')
+    assert record.relays == {1: True}
+    assert record.power_on is True
+    assert record.to_fields() == {MongoDbAccess.DEVICE_RELAYS_FIELD: {"1": True}, MongoDbAccess.DEVICE_POWER_ON_FIELD: True}
+
+def test_multi_relay_result():
+    record = decode_result_payload(b'{"POWER1":"OFF","POWER2":"ON","POWER9":"ON"}')
+    assert record.relays == {1: False, 2: True}
+    assert record.power_on is False
+
+def test_result_without_relays():
+    assert decode_result_payload(b'{"Dimmer":50}') is None
+    assert decode_result_payload(b'{"POWER":"TOGGLE"}') is None
+    assert decode_result_payload(b'{"POWER2":"ON"}').power_on is None
+
+def test_spec_with_contradicting_section_order_is_rejected():
+    spec = dict(SENSOR_SPEC)
+    spec['humidity'] = ([('DS18B20', 'Humidity'), ('ANALOG', 'Humidity')], float, 'device_humidity')
+    with pytest.raises(ValueError):
+        compile_sensor_spec(spec)
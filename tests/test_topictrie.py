@@ -0,0 +1,49 @@
+from helpers.topictrie import TopicTrie
+
+def on_sensor():
+    pass
+
+def on_result():
+    pass
+
+def on_any():
+    pass
+
+def test_exact_topic():
+    trie = TopicTrie()
+    trie.add('tl/send_message', on_any)
+    assert trie.match('tl/send_message') == (on_any, [])
+    assert trie.match('tl/send') == (None, None)
+    assert trie.match('tl/send_message/extra') == (None, None)
+
+def test_single_level_wildcard_returns_the_segment():
+    trie = TopicTrie()
+    trie.add('tele/+/SENSOR', on_sensor)
+    trie.add('stat/+/RESULT', on_result)
+    assert trie.match('tele/desk_light/SENSOR') == (on_sensor, ['desk_light'])
+    assert trie.match('stat/floor_heating/RESULT') == (on_result, ['floor_heating'])
+    assert trie.match('tele/desk_light/STATE') == (None, None)
+    # '+' matches exactly one level
+    assert trie.match('tele/a/b/SENSOR') == (None, None)
+
+def test_multi_level_wildcard_matches_its_parent_level():
+    trie = TopicTrie()
+    trie.add('stat/#', on_any)
+    assert trie.match('stat/desk_light/RESULT') == (on_any, [])
+    assert trie.match('stat') == (on_any, [])
+    assert trie.match('tele/desk_light/SENSOR') == (None, None)
+
+def test_exact_segment_wins_over_wildcards():
+    trie = TopicTrie()
+    trie.add('stat/#', on_any)
+    trie.add('stat/+/RESULT', on_result)
+    trie.add('stat/desk_light/RESULT', on_sensor)
+    assert trie.match('stat/desk_light/RESULT') == (on_sensor, [])
+    assert trie.match('stat/floor_heating/RESULT') == (on_result, ['floor_heating'])
+    assert trie.match('stat/floor_heating/POWER') == (on_any, [])
+
+def test_backtracking_drops_the_wildcard_of_a_failed_branch():
+    trie = TopicTrie()
+    trie.add('tele/+/SENSOR', on_sensor)
+    trie.add('tele/#', on_any)
+    assert trie.match('tele/desk_light/STATE') == (on_any, [])